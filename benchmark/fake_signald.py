@@ -0,0 +1,146 @@
+import json
+import logging
+import random
+import time
+import uuid
+from typing import Dict, List, Callable
+
+import anyio
+from anyio.abc import SocketStream, TaskStatus
+from anyio.streams.buffered import BufferedByteReceiveStream
+
+MAX_LINE_BYTES = 1024 * 1024
+
+
+def uuid_for(number: str) -> str:
+    """Deterministic account uuid of a phone number."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"signal:{number}"))
+
+
+class FakeSignald:
+    """
+    Local stand-in for signald, speaking its JSON-lines protocol over a Unix socket.
+
+    Requests with an id are answered like signald would (resolve_address, get_group, get_profile, send, version),
+    optionally after a latency and with a share of RateLimitError responses to sends. Incoming messages are pushed
+    to the subscribed connections. Every outbound message of the bot is recorded, and the first mark_read/react
+    referencing an incoming message timestamp is reported to the on_answer callback.
+    """
+
+    def __init__(self, socket_path: str, latency_seconds: float = 0.0, send_error_rate: float = 0.0,
+                 on_answer: Callable[[int, float], None] | None = None):
+        self.socket_path = socket_path
+        self._latency_seconds = latency_seconds
+        self._send_error_rate = send_error_rate
+        self._on_answer = on_answer
+        self._subscribers: List[SocketStream] = []
+        self._subscribed = anyio.Event()
+        self._answered: set[int] = set()
+        self.request_counts: Dict[str, int] = {}
+        self.error_count = 0
+
+    async def serve(self, *, task_status: TaskStatus = anyio.TASK_STATUS_IGNORED):
+        async with await anyio.create_unix_listener(self.socket_path) as listener:
+            task_status.started()
+            await listener.serve(self._handle_connection)
+
+    async def wait_subscribed(self):
+        await self._subscribed.wait()
+
+    async def push_incoming(self, message: dict):
+        line = json.dumps({"type": "IncomingMessage", "data": message}).encode() + b"\n"
+        for subscriber in list(self._subscribers):
+            try:
+                await subscriber.send(line)
+            except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                self._subscribers.remove(subscriber)
+
+    async def _handle_connection(self, client: SocketStream):
+        stream = BufferedByteReceiveStream(client)
+        write_lock = anyio.Lock()
+        try:
+            async with client, anyio.create_task_group() as tg:
+                while True:
+                    request = json.loads(await stream.receive_until(b"\n", MAX_LINE_BYTES))
+                    message_type = request.get("type")
+                    self.request_counts[message_type] = self.request_counts.get(message_type, 0) + 1
+
+                    if message_type == "subscribe":
+                        self._subscribers.append(client)
+                        self._subscribed.set()
+                    elif message_type in ("mark_read", "react"):
+                        self._record_answer(request)
+                    if "id" in request:
+                        tg.start_soon(self._respond, client, write_lock, request)
+        except (anyio.EndOfStream, anyio.IncompleteRead, anyio.BrokenResourceError, anyio.ClosedResourceError):
+            pass
+        finally:
+            if client in self._subscribers:
+                self._subscribers.remove(client)
+
+    def _record_answer(self, request: dict):
+        if request["type"] == "mark_read":
+            timestamps = request.get("timestamps", [])
+        else:
+            timestamps = [request.get("reaction", {}).get("targetSentTimestamp")]
+
+        now = time.perf_counter()
+        for timestamp in timestamps:
+            if timestamp is not None and timestamp not in self._answered:
+                self._answered.add(timestamp)
+                if self._on_answer:
+                    self._on_answer(timestamp, now)
+
+    async def _respond(self, client: SocketStream, write_lock: anyio.Lock, request: dict):
+        if self._latency_seconds:
+            await anyio.sleep(self._latency_seconds)
+
+        response = self._response_for(request)
+        async with write_lock:
+            try:
+                await client.send(json.dumps(response).encode() + b"\n")
+            except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                logging.debug(f"Client went away before the response to {request['id']}.")
+
+    def _response_for(self, request: dict) -> dict:
+        message_type = request.get("type")
+        response = {"id": request["id"], "type": message_type}
+
+        if message_type == "resolve_address":
+            number = request["partial"]["number"]
+            response["data"] = {"number": number, "uuid": uuid_for(number)}
+        elif message_type == "get_group":
+            group_id = request["groupID"]
+            response["data"] = {"id": group_id, "title": f"Group {group_id[:8]}"}
+        elif message_type == "get_profile":
+            address = request.get("address", {})
+            response["data"] = {"name": f"User {address.get('uuid', '')[:8]}", "address": address}
+        elif message_type == "send":
+            if self._send_error_rate and random.random() < self._send_error_rate:
+                self.error_count += 1
+                response["error_type"] = "RateLimitError"
+                response["error"] = {"message": "Rate limit exceeded (fake signald)"}
+            else:
+                response["data"] = {"timestamp": int(time.time() * 1000),
+                                    "results": [{"success": {"unidentified": False}}]}
+        elif message_type == "version":
+            response["data"] = {"name": "fake-signald", "version": "0.0.0"}
+        else:
+            response["data"] = {}
+        return response
+
+
+def incoming_message(bot_number: str, sender_number: str, body: str, timestamp: int,
+                     group_id: str | None = None) -> dict:
+    """The data of an IncomingMessage, as signald delivers it to subscribers."""
+    data_message = {"timestamp": timestamp, "body": body}
+    if group_id is not None:
+        data_message["groupV2"] = {"id": group_id, "revision": 1}
+
+    return {"account": bot_number,
+            "source": {"number": sender_number, "uuid": uuid_for(sender_number)},
+            "type": "UNIDENTIFIED_SENDER",
+            "timestamp": timestamp,
+            "server_receiver_timestamp": timestamp,
+            "server_deliver_timestamp": timestamp,
+            "data_message": data_message}
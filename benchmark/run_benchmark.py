@@ -0,0 +1,285 @@
+"""
+End-to-end throughput benchmark of the bot.
+
+Runs bot.start_bot against a local fake signald (see fake_signald.py) with the HTTP handlers stubbed locally, drives
+synthetic traffic across many conversations and roles, then reports throughput, answer latency and memory.
+
+    python -m benchmark.run_benchmark --messages 5000 --conversations 200 --output result.json
+    python -m benchmark.run_benchmark --messages 5000 --baseline result.json
+
+The latency of a message is measured from its delivery to the bot until the bot marks it read or reacts to it, which
+the built-in handlers do right before replying.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import anyio
+
+BOT_NUMBER = '+19999999999'
+ADMIN_NUMBER = '+10000000000'
+
+# (body, weight) of the user messages, the bot answers the ones starting with ANSWERED_PREFIXES
+USER_TRAFFIC = [("!bbc", 25), ("!bbc tech", 10), ("!apod", 15), ("!ai hello", 25), ("hello there", 25)]
+ANSWERED_PREFIXES = ("!bbc", "!apod", "!ai", "!adm")
+
+
+class Conversation:
+    __slots__ = ('kind', 'members', 'group_id')
+
+    def __init__(self, kind: str, members: List[str], group_id: str | None = None):
+        self.kind = kind  # 'user', 'group', 'rejected' or 'unknown'
+        self.members = members
+        self.group_id = group_id
+
+
+def build_conversations(count: int, group_size: int) -> List[Conversation]:
+    conversations = []
+    number = 10000000001
+    for i in range(count):
+        share = i % 20
+        if share < 13:
+            kind = 'user'
+        elif share < 18:
+            kind = 'group'
+        elif share < 19:
+            kind = 'rejected'
+        else:
+            kind = 'unknown'
+
+        size = group_size if kind == 'group' else 1
+        members = [f"+{number + j}" for j in range(size)]
+        number += size
+        group_id = f"{i:08d}benchmarkgroup=" if kind == 'group' else None
+        conversations.append(Conversation(kind, members, group_id))
+    return conversations
+
+
+def seed_state(conversations: List[Conversation]):
+    """Write the initial state file, with the conversations already authorized or rejected."""
+    from benchmark.fake_signald import uuid_for
+    from signalaibot.settings import constants
+    from signalaibot.settings.model import State, Conversation as StateConversation, ConversationType
+
+    st = State(bot_uuid=uuid_for(BOT_NUMBER), admin_uuid=uuid_for(ADMIN_NUMBER))
+    for conversation in conversations:
+        if conversation.group_id is not None:
+            state_conversation = StateConversation(type=ConversationType.GROUP, id=conversation.group_id)
+        else:
+            state_conversation = StateConversation(type=ConversationType.PRIVATE,
+                                                   id=uuid_for(conversation.members[0]))
+        if conversation.kind in ('user', 'group'):
+            st.authorized_conversations.add(state_conversation)
+        elif conversation.kind == 'rejected':
+            st.rejected_conversations.add(state_conversation)
+
+    with open(constants.STATE_FILE_PATH, 'w') as file:
+        json.dump(st.to_json_dict(), file)  # JSON is valid YAML
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float | None:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float | int | None]:
+    values = sorted(latencies)
+    return {'count': len(values),
+            'p50_ms': _ms(percentile(values, 0.50)),
+            'p99_ms': _ms(percentile(values, 0.99)),
+            'max_ms': _ms(values[-1] if values else None)}
+
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def current_rss_bytes() -> int | None:
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    conversations = build_conversations(args.conversations, args.group_size)
+    seed_state(conversations)  # before the bot starts, which loads the state
+
+    from benchmark.fake_signald import FakeSignald, incoming_message
+    from benchmark.stub_http import StubHttpClient
+    from signalaibot import bot
+    from signalaibot.services import http_client
+
+    logging.getLogger().setLevel(args.log_level)
+
+    # the handlers reach the network only through the shared client, stub it
+    StubHttpClient.latency_seconds = args.http_latency
+    http_client.HttpClient = StubHttpClient
+
+    sent_at: Dict[int, float] = {}
+    command_of: Dict[int, str] = {}
+    latencies: Dict[str, List[float]] = {}
+    answered = anyio.Event()
+    expected_answers = 0
+    answer_count = 0
+
+    def on_answer(timestamp: int, now: float):
+        nonlocal answer_count
+        started = sent_at.get(timestamp)
+        if started is None:
+            return
+        latencies.setdefault(command_of[timestamp], []).append(now - started)
+        answer_count += 1
+        if answer_count >= expected_answers > 0:
+            answered.set()
+
+    fake_signald = FakeSignald(os.environ['SIGNALD_SOCKET_PATH'], args.signald_latency, args.send_error_rate,
+                               on_answer)
+
+    bodies, weights = zip(*USER_TRAFFIC)
+    traffic = []
+    timestamp = int(time.time() * 1000)
+    for i in range(args.messages):
+        timestamp += 1
+        if args.admin_every and i % args.admin_every == 0:
+            traffic.append((timestamp, ADMIN_NUMBER, "!adm stats", None, True))
+            continue
+        conversation = rng.choice(conversations)
+        sender = rng.choice(conversation.members)
+        body = rng.choices(bodies, weights)[0]
+        is_answered = conversation.kind in ('user', 'group') and body.startswith(ANSWERED_PREFIXES)
+        traffic.append((timestamp, sender, body, conversation.group_id, is_answered))
+    expected_answers = sum(1 for *_, is_answered in traffic if is_answered)
+
+    rss_before = current_rss_bytes()
+    async with anyio.create_task_group() as tg:
+        await tg.start(fake_signald.serve)
+        async with anyio.create_task_group() as bot_tg:
+            bot_tg.start_soon(bot.start_bot)
+            with anyio.fail_after(30):
+                await fake_signald.wait_subscribed()
+
+            started = time.perf_counter()
+            interval = 1 / args.rate if args.rate else 0
+            for i, (timestamp, sender, body, group_id, _) in enumerate(traffic):
+                sent_at[timestamp] = time.perf_counter()
+                command_of[timestamp] = body.split()[0] if body.startswith("!") else "<none>"
+                await fake_signald.push_incoming(incoming_message(BOT_NUMBER, sender, body, timestamp, group_id))
+                if interval:
+                    await anyio.sleep(max(0.0, started + (i + 1) * interval - time.perf_counter()))
+            injected = time.perf_counter()
+
+            with anyio.move_on_after(args.drain_timeout):
+                if expected_answers:
+                    await answered.wait()
+            finished = time.perf_counter()
+            bot_tg.cancel_scope.cancel()  # stop the bot before its fake signald
+        tg.cancel_scope.cancel()
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    duration = finished - started
+    return {
+        'benchmark': 'end_to_end',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'messages': args.messages,
+        'expected_answers': expected_answers,
+        'answers': answer_count,
+        'duration_seconds': round(duration, 3),
+        'injection_seconds': round(injected - started, 3),
+        'messages_per_second': round(args.messages / duration, 1),
+        'answers_per_second': round(answer_count / duration, 1),
+        'latency': latency_summary(all_latencies),
+        'latency_by_command': {command: latency_summary(values) for command, values in sorted(latencies.items())},
+        'signald_requests': dict(sorted(fake_signald.request_counts.items())),
+        'signald_errors': fake_signald.error_count,
+        'memory': {'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                   'rss_before_bytes': rss_before,
+                   'rss_after_bytes': current_rss_bytes()},
+    }
+
+
+def compare(result: dict, baseline: dict) -> List[str]:
+    lines = []
+    for label, path, higher_is_better in [("messages/s", ('messages_per_second',), True),
+                                          ("answers/s", ('answers_per_second',), True),
+                                          ("p50 ms", ('latency', 'p50_ms'), False),
+                                          ("p99 ms", ('latency', 'p99_ms'), False),
+                                          ("max rss bytes", ('memory', 'max_rss_bytes'), False)]:
+        current, previous = result, baseline
+        for key in path:
+            current = current.get(key) if isinstance(current, dict) else None
+            previous = previous.get(key) if isinstance(previous, dict) else None
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous * 100
+        better = (change > 0) == higher_is_better
+        lines.append(f"{label:>14}: {previous} -> {current} ({change:+.1f}%, {'better' if better else 'worse'})")
+    return lines
+
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000, help="number of incoming messages")
+    parser.add_argument('--conversations', type=int, default=100, help="number of conversations")
+    parser.add_argument('--group-size', type=int, default=5, help="members of each group conversation")
+    parser.add_argument('--rate', type=float, default=0, help="incoming messages per second, 0 for a burst")
+    parser.add_argument('--admin-every', type=int, default=100, help="every n-th message is an admin command")
+    parser.add_argument('--signald-latency', type=float, default=0.0, help="fake signald response latency (s)")
+    parser.add_argument('--http-latency', type=float, default=0.0, help="stubbed HTTP response latency (s)")
+    parser.add_argument('--send-error-rate', type=float, default=0.0, help="share of sends failing with rate limits")
+    parser.add_argument('--drain-timeout', type=float, default=60.0, help="max seconds to wait for the answers")
+    parser.add_argument('--rate-limit', action='store_true', help="keep the per-conversation rate limits enabled")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help="write the result as JSON to this file")
+    parser.add_argument('--baseline', help="compare the result with a previous JSON result")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] | None = None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    with tempfile.TemporaryDirectory(prefix='signalaibot-benchmark-') as work_dir:
+        # must be set before the bot modules are imported (constants) and started (config)
+        os.environ.update({
+            'PERSISTENT_DATA_DIR': work_dir,
+            'SIGNALD_SOCKET_PATH': os.path.join(work_dir, 'signald.sock'),
+            'BOT_NUMBER': BOT_NUMBER,
+            'ADMIN_NUMBER': ADMIN_NUMBER,
+            'OPENAI_API_KEY': 'benchmark',
+            'SCHEDULER_QUEUE_TIMEOUT_SECONDS': str(args.drain_timeout),
+            'SCHEDULER_MAX_QUEUED': str(args.messages + 1),
+        })
+        if not args.rate_limit:
+            os.environ['SCHEDULER_CONVERSATION_RATE_PER_MINUTE'] = '0'
+
+        result = anyio.run(run, args)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            print("\n".join(["Compared to the baseline:"] + compare(result, json.load(file))))
+
+    if result['answers'] < result['expected_answers']:
+        print(f"Only {result['answers']} of {result['expected_answers']} messages were answered!", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import json
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
+import anyio
+
+from signalaibot.services.http_client import HttpClient
+
+APOD_IMAGE_URL = 'https://apod.nasa.gov/apod/image/benchmark.png'
+
+# smallest valid PNG (1x1, transparent)
+_PNG_BYTES = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                           '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+
+
+def _rss(title: str, items: int = 5) -> bytes:
+    entries = ''.join(f"<item><title>{title} headline {i}</title><link>https://example.com/{i}</link>"
+                      f"<description>Story {i}</description></item>" for i in range(items))
+    return (f'<?xml version="1.0"?><rss version="2.0"><channel><title>{title}</title>'
+            f'{entries}</channel></rss>').encode()
+
+
+_APOD_RSS = ('<?xml version="1.0"?><rss version="2.0"><channel><title>APOD</title><item>'
+             '<title>Benchmark Nebula</title><link>https://apod.nasa.gov/apod/</link>'
+             f'<description>&lt;img src="{APOD_IMAGE_URL}" alt="A synthetic nebula" /&gt;</description>'
+             '</item></channel></rss>').encode()
+
+
+_COMPLETION_SSE = b''.join(b'data: ' + json.dumps({"choices": [{"delta": {"content": word}}]}).encode() + b'\n\n'
+                           for word in ["This ", "is ", "a ", "stubbed ", "answer."]) + b'data: [DONE]\n\n'
+
+
+class StubBody:
+    def __init__(self, content: bytes):
+        self._content = content
+
+    async def __aiter__(self):
+        yield self._content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class StubResponse:
+    def __init__(self, status_code: int, content: bytes, headers: Dict[str, str]):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.body = StubBody(content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"Stub HTTP status {self.status_code}")
+
+
+class StubHttpClient(HttpClient):
+    """
+    HttpClient answering the feeds, images and completions of the built-in handlers locally, with a simulated latency.
+    """
+
+    latency_seconds = 0.0
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.request_count = 0
+
+    async def request(self, method: str, url: str, *, retries: int | None = None, **kwargs) -> StubResponse:
+        self.request_count += 1
+        if self.latency_seconds:
+            await anyio.sleep(self.latency_seconds)
+
+        status_code, content, content_type = self._fixture_for(url)
+        return StubResponse(status_code, content, {'Content-Type': content_type, 'ETag': f'"{hash(content)}"'})
+
+    @staticmethod
+    def _fixture_for(url: str) -> Tuple[int, bytes, str]:
+        parsed = urlparse(url)
+        if parsed.netloc == 'feeds.bbci.co.uk':
+            return 200, _rss(parsed.path), 'application/rss+xml'
+        if url == 'https://apod.nasa.gov/apod.rss':
+            return 200, _APOD_RSS, 'application/rss+xml'
+        if parsed.path.endswith('/chat/completions'):
+            return 200, _COMPLETION_SSE, 'text/event-stream'
+        if url == APOD_IMAGE_URL:
+            return 200, _PNG_BYTES, 'image/png'
+        return 404, b'', 'text/plain'
+
+    async def aclose(self):
+        pass
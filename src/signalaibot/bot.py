@@ -5,41 +5,141 @@ import anyio
 from anyio import open_signal_receiver, CancelScope
 
 from signalaibot.extensions.semaphore_extensions import ExtendedBot
+from signalaibot.extensions.send_queue import SendQueue
 from signalaibot.handlers import register_handlers_on_bot, load_handlers
-from signalaibot.settings.config_manager import config
-from signalaibot.settings.state_manager import state, StateSaveContext, state_save_context
+from signalaibot.handlers.reloader import reload_handlers_on_changes
+from signalaibot.handlers.framework.scheduler import handler_scheduler_context
+from signalaibot.services.address_directory import address_directory_context, get_address_directory
+from signalaibot.services.completions import completion_client_context, response_cache_context
+from signalaibot.services.cpu_offload import cpu_offload_context
+from signalaibot.services.feed_cache import feed_cache_context
+from signalaibot.services.history import history_context
+from signalaibot.services.http_client import http_client_context
+from signalaibot.services.image_cache import image_cache_context
+from signalaibot.services.metrics import metrics_server_context
+from signalaibot.services.name_cache import name_cache_context
+from signalaibot.settings import constants
+from signalaibot.settings.config_manager import load_env_and_config, get_config
+from signalaibot.settings.state_manager import load_state, get_state, StateSaveContext, state_save_context
+from signalaibot.startup import startup_timer
 
 
-async def start_bot():
+async def start_bot(reload_handlers: bool = False):
+    with startup_timer.phase("load config"):
+        await anyio.to_thread.run_sync(load_env_and_config)
+    with startup_timer.phase("load state"):
+        await anyio.to_thread.run_sync(load_state)
+
+    config = get_config()
     async with ExtendedBot(config.bot_number,
                            # profile_name="[botee]", profile_picture=str(Path.cwd() / "resources" / "avatar.jpg"),
                            group_auto_accept=False,
                            raise_errors=True,
-                           socket_path="/signald/signald.sock") as bot:
-        async with state_save_context() as save_context:
+                           socket_path=config.signald_socket_path,
+                           request_timeout_seconds=config.signald_request_timeout_seconds,
+                           send_socket_pool_size=config.signald_send_socket_pool_size,
+                           health_check_interval_seconds=config.signald_health_check_interval_seconds,
+                           send_queue=SendQueue(
+                               retries=config.send_retries,
+                               retry_backoff_seconds=config.send_retry_backoff_seconds,
+                               rate_limit_pause_seconds=config.send_rate_limit_pause_seconds,
+                               rate_limit_max_pause_seconds=config.send_rate_limit_max_pause_seconds,
+                               rate_limited_interval_seconds=config.send_rate_limited_interval_seconds,
+                               rate_limited_window_seconds=config.send_rate_limited_window_seconds
+                           ) if config.send_queue_enabled else None) as bot:
+        async with state_save_context(journal_enabled=config.state_journal_enabled,
+                                      journal_compaction_threshold=config.state_journal_compaction_threshold,
+                                      dump_backend=config.state_dump_backend
+                                      ) as save_context, \
+                address_directory_context(bot.get_address_from_number,
+                                          constants.ADDRESS_DIRECTORY_FILE_PATH
+                                          if config.address_directory_persist else None,
+                                          max_entries=config.address_directory_max_entries,
+                                          ttl_seconds=config.address_directory_ttl_seconds,
+                                          negative_ttl_seconds=config.address_directory_negative_ttl_seconds,
+                                          max_concurrent_resolutions=config.address_directory_max_concurrent_resolutions
+                                          ), \
+                http_client_context(connections_per_host=config.http_connections_per_host,
+                                    max_concurrent_requests=config.http_max_concurrent_requests,
+                                    timeout_seconds=config.http_timeout_seconds,
+                                    connect_timeout_seconds=config.http_connect_timeout_seconds,
+                                    retries=config.http_retries,
+                                    retry_backoff_seconds=config.http_retry_backoff_seconds), \
+                completion_client_context(base_url=config.openai_base_url,
+                                          api_key=config.openai_api_key,
+                                          model=config.openai_model,
+                                          max_concurrent=config.ai_max_concurrent_completions,
+                                          max_response_tokens=config.ai_max_response_tokens,
+                                          timeout_seconds=config.ai_timeout_seconds,
+                                          retries=config.http_retries), \
+                response_cache_context(max_entries=config.ai_response_cache_max_entries,
+                                       ttl_seconds=config.ai_response_cache_ttl_seconds,
+                                       max_bytes=config.ai_response_cache_max_bytes), \
+                cpu_offload_context(config.cpu_offload_max_workers, config.cpu_offload_mode), \
+                feed_cache_context(config.feed_cache_ttl_seconds, config.feed_cache_refresh_in_background), \
+                image_cache_context(constants.IMAGE_CACHE_DIR, config.image_cache_max_bytes,
+                                    attachment_max_bytes=config.image_attachment_max_bytes,
+                                    attachment_max_pixels=config.image_attachment_max_pixels), \
+                metrics_server_context(config.metrics_port + config.account_index
+                                       if config.metrics_port is not None else None, config.metrics_host), \
+                name_cache_context(constants.NAME_CACHE_FILE_PATH if config.name_cache_persist else None,
+                                   max_entries=config.name_cache_max_entries,
+                                   ttl_seconds=config.name_cache_ttl_seconds,
+                                   negative_ttl_seconds=config.name_cache_negative_ttl_seconds), \
+                history_context(constants.HISTORY_DB_PATH,
+                                ring_size=config.history_ring_size,
+                                max_conversations=config.history_max_conversations,
+                                batch_size=config.history_batch_size,
+                                flush_interval_seconds=config.history_flush_interval_seconds,
+                                retention_days=config.history_retention_days), \
+                handler_scheduler_context(
+                    max_concurrent_handlers=config.scheduler_max_concurrent_handlers,
+                    reserved_priority_slots=config.scheduler_reserved_priority_slots,
+                    max_concurrent_per_handler=config.scheduler_max_concurrent_per_handler,
+                    max_concurrent_per_conversation=config.scheduler_max_concurrent_per_conversation,
+                    conversation_rate_per_minute=config.scheduler_conversation_rate_per_minute,
+                    conversation_burst=config.scheduler_conversation_burst,
+                    max_rate_limited_conversations=config.scheduler_max_rate_limited_conversations,
+                    max_queued=config.scheduler_max_queued,
+                    queue_timeout_seconds=config.scheduler_queue_timeout_seconds):
             async with anyio.create_task_group() as tg:
                 tg.start_soon(interrupt_handler, tg.cancel_scope)
 
-                await initialize_state(bot, save_context)
+                with startup_timer.phase("initialize state"):
+                    await initialize_state(save_context)
 
                 logging.info("Loading handlers...")
-                load_handlers()
+                with startup_timer.phase("load handlers"):
+                    load_handlers(lazy=config.lazy_handler_loading)
 
                 logging.info("Registering handlers...")
-                register_handlers_on_bot(bot)
+                with startup_timer.phase("register handlers"):
+                    register_handlers_on_bot(bot)
 
+                logging.info(startup_timer.report())
+                if reload_handlers:
+                    tg.start_soon(reload_handlers_on_changes, bot, config.lazy_handler_loading)
                 await bot.start()
     logging.info("Bot exited...")
 
 
-async def initialize_state(bot, save_context: StateSaveContext):
+async def initialize_state(save_context: StateSaveContext):
+    config = get_config()
+    state = get_state()
+    address_directory = get_address_directory()
+    address_directory.learn(config.bot_number, state.bot_uuid)
+    address_directory.learn(config.admin_number, state.admin_uuid)
+
+    # resolved concurrently, and only the ones unknown to both the state and the address directory
+    uuids = await address_directory.resolve_many([config.bot_number, config.admin_number])
+
     if state.bot_uuid is None:
-        state.bot_uuid = (await bot.get_address_from_number(config.bot_number)).uuid
+        state.set_bot_uuid(uuids[config.bot_number])
         save_context.save_soon(state)
     logging.info(f"Bot uuid is: {state.bot_uuid}")
 
     if state.admin_uuid is None:
-        state.admin_uuid = (await bot.get_address_from_number(config.admin_number)).uuid
+        state.set_admin_uuid(uuids[config.admin_number])
         save_context.save_soon(state)
     logging.info(f"Admin uuid is: {state.admin_uuid}")
 
@@ -0,0 +1,90 @@
+import heapq
+import re
+from re import Pattern, Match
+from typing import Callable, Iterable, Iterator, List, Tuple, Dict, Any
+
+_REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+_REGEX_QUANTIFIER_CHARS = frozenset('*+?{')
+_UNSAFE_FLAGS = re.IGNORECASE | re.MULTILINE | re.VERBOSE
+
+_ROUTES_KEY = None
+
+
+def literal_prefix(regex: Pattern) -> str:
+    """
+    Return the literal text every match of the regex must start the message body with, or '' if unknown.
+
+    Only simple patterns anchored with '^' are analyzed, everything else is conservatively treated as unindexable.
+    """
+    pattern = regex.pattern
+    if (not isinstance(pattern, str)
+            or not pattern.startswith('^')
+            or '|' in pattern
+            or regex.flags & _UNSAFE_FLAGS):
+        return ''
+
+    prefix = []
+    for char in pattern[1:]:
+        if char in _REGEX_SPECIAL_CHARS:
+            if char in _REGEX_QUANTIFIER_CHARS and prefix:
+                prefix.pop()  # the last literal char is optional or repeated
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+class HandlerRouter:
+    """
+    Compiled dispatch structure over the handlers registered on a bot.
+
+    Handlers with a literal '^prefix' are indexed in a prefix trie, so only the handlers whose prefix starts the
+    message body are tried, plus the few unindexed handlers. Candidates are yielded in registration order, so
+    priorities and the always-first root handlers behave exactly as with a linear scan.
+    """
+
+    def __init__(self, handlers: Iterable[Tuple[Pattern, Callable]]):
+        self._routes: List[Tuple[Pattern, Callable]] = list(handlers)
+        self._trie: Dict[Any, Any] = {}
+        self._unindexed: List[int] = []
+
+        for index, (regex, _) in enumerate(self._routes):
+            prefix = literal_prefix(regex)
+            if prefix:
+                node = self._trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node.setdefault(_ROUTES_KEY, []).append(index)
+            else:
+                self._unindexed.append(index)
+
+    @property
+    def indexed_count(self) -> int:
+        return len(self._routes) - len(self._unindexed)
+
+    @property
+    def unindexed_count(self) -> int:
+        return len(self._unindexed)
+
+    def candidates(self, body: str) -> List[int]:
+        """Return the indexes of the handlers that may match the body, in registration order."""
+        indexed = []
+        node = self._trie
+        for char in body:
+            node = node.get(char)
+            if node is None:
+                break
+            routes = node.get(_ROUTES_KEY)
+            if routes:
+                indexed.append(routes)
+
+        if not indexed:
+            return self._unindexed
+        return list(heapq.merge(self._unindexed, *indexed))
+
+    def match(self, body: str) -> Iterator[Tuple[Callable, Match]]:
+        """Yield every (handler, match) for the body, in registration order."""
+        for index in self.candidates(body):
+            regex, func = self._routes[index]
+            match = regex.search(body)
+            if match:
+                yield func, match
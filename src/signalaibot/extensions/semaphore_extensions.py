@@ -1,20 +1,95 @@
 import json
-from typing import Dict, Callable, TypeVar
+import re
+from re import Pattern
+from typing import Dict, Callable, TypeVar, Any, Optional, List, Union, Iterable, Tuple
 
-from semaphore import Bot, Socket, MessageSender, Address, GroupV2
+import anyio
+from anyio import CancelScope
+from anyio.abc import TaskGroup, TaskStatus
+from anyio.streams.buffered import BufferedByteReceiveStream
+from semaphore import Bot, Socket, MessageSender, Address, GroupV2, Profile, Message, StopPropagation
 from semaphore.exceptions import UnknownError, IDENTIFIABLE_SIGNALD_ERRORS
 
+from signalaibot.extensions.handler_router import HandlerRouter
+from signalaibot.extensions.send_queue import MessageNotSentError, SendQueue, conversation_key
+from signalaibot.services.metrics import metrics, SIGNALD_REQUEST_DURATION
+
+MAX_RESPONSE_LINE_BYTES = 16 * 1024 * 1024
+
 
 class ExtendedBot(Bot):
 
+    def __init__(self, *args,
+                 request_timeout_seconds: Optional[float] = None,
+                 send_socket_pool_size: int = 1,
+                 health_check_interval_seconds: float = 30.0,
+                 send_queue: Optional[SendQueue] = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self._request_timeout_seconds = request_timeout_seconds
+        self._send_socket_pool_size = send_socket_pool_size
+        self._health_check_interval_seconds = health_check_interval_seconds
+        self._send_queue = send_queue
+        self._router: Optional[HandlerRouter] = None
+        self._router_source: Optional[List] = None
+
     async def __aenter__(self) -> 'ExtendedBot':
-        """Connect to the bot's internal socket."""
-        self._send_socket = await Socket(self._username,
-                                         self._socket_path,
-                                         False).__aenter__()
-        self._sender = ExtendedMessageSender(self._username, self._send_socket, self._raise_errors)
+        """Connect the pool of send sockets to signald."""
+        self._sender = await PooledMessageSender(self._username,
+                                                 self._socket_path,
+                                                 self._raise_errors,
+                                                 pool_size=self._send_socket_pool_size,
+                                                 request_timeout_seconds=self._request_timeout_seconds,
+                                                 health_check_interval_seconds=self._health_check_interval_seconds,
+                                                 send_queue=self._send_queue
+                                                 ).__aenter__()
         return self
 
+    async def __aexit__(self, *excinfo: Any) -> None:
+        """Disconnect the pool of send sockets, then the receive socket."""
+        if isinstance(self._sender, PooledMessageSender):
+            await self._sender.__aexit__(*excinfo)
+        await super().__aexit__(*excinfo)
+
+    def register_handler(self, regex: Union[str, Pattern], func: Callable) -> None:
+        super().register_handler(regex, func)
+        self._router = None
+
+    def compile_handlers(self) -> HandlerRouter:
+        """Compile the registered handlers into the router used to dispatch incoming messages."""
+        self._router = HandlerRouter(self._handlers)
+        self._router_source = self._handlers
+        self.log.info(f"Compiled {self._router.indexed_count} prefix-indexed"
+                      f" and {self._router.unindexed_count} unindexed handlers")
+        return self._router
+
+    def replace_handlers(self, handlers: Iterable[Tuple[Union[str, Pattern], Callable]]) -> HandlerRouter:
+        """
+        Swap all the registered handlers for the given ones at once, e.g. after reloading the handler modules.
+
+        The new router is compiled before the swap, the messages already being dispatched finish with the previous
+        handlers.
+        """
+        new_handlers = [(regex if isinstance(regex, Pattern) else re.compile(regex, re.UNICODE), func)
+                        for regex, func in handlers]
+        router = HandlerRouter(new_handlers)
+        self._handlers, self._router, self._router_source = new_handlers, router, new_handlers
+        self.log.info(f"Replaced the handlers with {router.indexed_count} prefix-indexed"
+                      f" and {router.unindexed_count} unindexed handlers")
+        return router
+
+    async def _match_message(self, message: Message) -> None:
+        """Match an incoming message against the compiled handlers."""
+        router = self._router
+        if router is None or self._router_source is not self._handlers:
+            router = self.compile_handlers()
+
+        for func, match in router.match(message.get_body()):
+            try:
+                await self._handle_message(message, func, match)
+            except StopPropagation:
+                break
+
     async def get_address_from_number(self: Bot, user_number: str) -> Address:
         return await self._sender._generic_send({
             "type": "resolve_address",
@@ -34,58 +109,342 @@ class ExtendedBot(Bot):
 
 T = TypeVar('T')
 
+_DEFAULT_TIMEOUT = object()
+
+
+class _PendingResponse:
+    __slots__ = ('_event', 'response', 'error')
+
+    def __init__(self):
+        self._event = anyio.Event()
+        self.response: Optional[dict] = None
+        self.error: Optional[BaseException] = None
+
+    def resolve(self, response: dict):
+        self.response = response
+        self._event.set()
+
+    def fail(self, error: BaseException):
+        self.error = error
+        self._event.set()
+
+    async def wait(self) -> dict:
+        await self._event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.response
+
 
 class ExtendedMessageSender(MessageSender):
+    """
+    Message sender multiplexing many in-flight requests over a single signald socket.
+
+    Requests are written under a short write lock only, while a background reader task routes every
+    response to the waiting request by its 'id', so out-of-order responses are delivered instead of dropped.
+    Either use it as an async context manager, which owns the reader task, or start run_reader in a task group.
+    """
+
+    def __init__(self, username: str, socket: Socket, raise_errors: bool = False,
+                 request_timeout_seconds: Optional[float] = None):
+        super().__init__(username, socket, raise_errors)
+        self._request_timeout_seconds = request_timeout_seconds
+        self._write_lock = anyio.Lock()
+        self._pending: Dict[str, _PendingResponse] = {}
+        self._connection_error: Optional[BaseException] = None
+        self._reader_scope: Optional[CancelScope] = None
+        self._task_group: Optional[TaskGroup] = None
+
+    async def __aenter__(self) -> 'ExtendedMessageSender':
+        self._task_group = anyio.create_task_group()
+        await self._task_group.__aenter__()
+        await self._task_group.start(self.run_reader)
+        return self
+
+    async def __aexit__(self, *excinfo: Any) -> None:
+        if self._task_group is not None:
+            self._task_group.cancel_scope.cancel()
+            await self._task_group.__aexit__(None, None, None)
+            self._task_group = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    @property
+    def is_connected(self) -> bool:
+        return self._reader_scope is not None and self._connection_error is None
+
+    def close(self):
+        """Stop the response reader, failing every request in flight."""
+        if self._reader_scope is not None:
+            self._reader_scope.cancel()
+
+    async def run_reader(self, *, task_status: TaskStatus = anyio.TASK_STATUS_IGNORED):
+        """Read responses from the socket until it is closed, routing each to its waiting request."""
+        # noinspection PyProtectedMember
+        stream = BufferedByteReceiveStream(self._socket._socket)
+        try:
+            with CancelScope() as self._reader_scope:
+                task_status.started()
+                while True:
+                    line = await stream.receive_until(b"\n", MAX_RESPONSE_LINE_BYTES)
+                    self.log.debug(f"Socket of sender received: {line.decode()}")
+
+                    # Load Signal message wrapper.
+                    try:
+                        response_wrapper = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        self.log.error("Could not decode signald response", exc_info=e)
+                        continue
+
+                    # Skip everything but responses to our requests.
+                    response_id = response_wrapper.get('id') if isinstance(response_wrapper, dict) else None
+                    if response_id is None:
+                        continue
+
+                    pending = self._pending.pop(response_id, None)
+                    if pending is None:
+                        self.log.warning(f"Received response for unknown or expired request id {response_id}")
+                        continue
+
+                    pending.resolve(response_wrapper)
+        except (anyio.EndOfStream, anyio.IncompleteRead, anyio.DelimiterNotFound, anyio.BrokenResourceError,
+                anyio.ClosedResourceError, OSError) as e:
+            self.log.error("Socket of sender was disconnected", exc_info=e)
+        finally:
+            self._connection_error = ConnectionResetError("Connection was reset")
+            self._fail_pending(self._connection_error)
+
+    def _fail_pending(self, error: BaseException):
+        pending_responses = list(self._pending.values())
+        self._pending.clear()
+        for pending in pending_responses:
+            pending.fail(error)
+
+    async def _request(self, message: Dict, timeout: Optional[float] | object = _DEFAULT_TIMEOUT) -> dict:
+        if not self.is_connected:
+            raise MessageNotSentError("Message sender is not connected") from self._connection_error
+
+        if timeout is _DEFAULT_TIMEOUT:
+            timeout = self._request_timeout_seconds
 
-    async def _generic_send(self, message: Dict, mapper: Callable[[dict], T]) -> T:
         self.signald_message_id += 1
-        message['id'] = str(self.signald_message_id)
+        message_id = str(self.signald_message_id)
+        message['id'] = message_id
+
+        pending = _PendingResponse()
+        self._pending[message_id] = pending
+        try:
+            with metrics.timer(SIGNALD_REQUEST_DURATION, type=message.get('type')):
+                async with self._write_lock:
+                    await self._socket.send(message)
+
+                with anyio.fail_after(timeout):
+                    return await pending.wait()
+        finally:
+            self._pending.pop(message_id, None)
 
-        async with self._socket_lock:
+    async def _write(self, message: Dict):
+        if not self.is_connected:
+            raise MessageNotSentError("Message sender is not connected") from self._connection_error
+        async with self._write_lock:
             await self._socket.send(message)
 
-            async for line in self._socket.read():
-                self.log.debug(f"Socket of sender received: {line.decode()}")
+    def _has_error(self, response_wrapper: dict) -> bool:
+        """Returns whether the response is an error, raising it instead if the sender is configured to."""
+        if response_wrapper.get("error") is None:
+            return False
 
-                # Load Signal message wrapper.
-                try:
-                    response_wrapper = json.loads(line)
-                except json.JSONDecodeError as e:
-                    self.log.error("Could not decode signald response", exc_info=e)
-                    continue
+        self.log.warning(f"Could not send message:"
+                         f"{response_wrapper}")
 
-                # Skip everything but response for our message.
-                if 'id' not in response_wrapper:
-                    continue
+        if not self._raise_signald_errors:
+            return True
 
-                if response_wrapper['id'] != message['id']:
-                    self.log.warning("Received message response for another id")
-                    continue
+        # Match error.
+        for error_class in IDENTIFIABLE_SIGNALD_ERRORS:
+            if error_class.IDENTIFIER == response_wrapper.get("error_type"):
+                error_dict = response_wrapper.get("error")
+                if not error_dict:
+                    break
 
-                if response_wrapper.get("error") is not None:
-                    self.log.warning(f"Could not send message:"
-                                     f"{response_wrapper}")
+                error = error_class()
+                for k in error_dict.keys():
+                    setattr(error, k, error_dict.get(k))
 
-                    if not self._raise_signald_errors:
-                        return None
+                raise error
 
-                    # Match error.
-                    for error_class in IDENTIFIABLE_SIGNALD_ERRORS:
-                        if error_class.IDENTIFIER == response_wrapper.get("error_type"):
-                            error_dict = response_wrapper.get("error")
-                            if not error_dict:
-                                break
+        raise UnknownError(response_wrapper.get("error_type"),
+                           response_wrapper.get("error"))
 
-                            error = error_class()
-                            for k in error_dict.keys():
-                                setattr(error, k, error_dict.get(k))
+    async def _send(self, message: Dict) -> Any:
+        message_type = message.get('type')
 
-                            raise error
+        if message_type == 'send':
+            response_wrapper = await self._request(message)
+            if self._has_error(response_wrapper):
+                return False
 
-                    raise UnknownError(response_wrapper.get("error_type"),
-                                       response_wrapper.get("error"))
+            results = response_wrapper.get('data', {}).get("results")
+            return bool(results and results[0].get('success'))
+        elif message_type == 'get_profile':
+            response_wrapper = await self._request(message)
+            if self._has_error(response_wrapper):
+                return None
 
-                response = response_wrapper.get('data', {})
-                return mapper(response) if mapper else response
+            return Profile.create_from_receive_dict(response_wrapper.get('data', {}))
+        else:
+            # Skip waiting for everything else.
+            await self._write(message)
+            return True
 
+    async def _generic_send(self, message: Dict, mapper: Callable[[dict], T],
+                            timeout: Optional[float] | object = _DEFAULT_TIMEOUT) -> T:
+        response_wrapper = await self._request(message, timeout)
+        if self._has_error(response_wrapper):
             return None
+
+        response = response_wrapper.get('data', {})
+        return mapper(response) if mapper else response
+
+
+class PooledMessageSender(MessageSender):
+    """
+    Message sender spreading requests over a pool of multiplexed signald connections.
+
+    Each request goes to the healthy connection with the fewest requests in flight. Broken connections are
+    reconnected in the background, and a periodic 'version' probe replaces connections that stopped responding.
+    With a send queue, the conversation messages (replies, typing indicators...) go through it, to be ordered,
+    coalesced and retried (which needs raise_errors, to tell the errors apart).
+    """
+
+    def __init__(self, username: str, socket_path: Optional[str], raise_errors: bool = False,
+                 pool_size: int = 1,
+                 request_timeout_seconds: Optional[float] = None,
+                 health_check_interval_seconds: float = 30.0,
+                 reconnect_max_delay_seconds: float = 30.0,
+                 send_queue: Optional[SendQueue] = None):
+        super().__init__(username, None, raise_errors)
+        if pool_size < 1:
+            raise ValueError(f"Invalid pool size: {pool_size}!")
+        self._socket_path = socket_path
+        self._request_timeout_seconds = request_timeout_seconds
+        self._health_check_interval_seconds = health_check_interval_seconds
+        self._reconnect_max_delay_seconds = reconnect_max_delay_seconds
+        self._connections: List[Optional[ExtendedMessageSender]] = [None] * pool_size
+        self._next_index = 0
+        self._task_group: Optional[TaskGroup] = None
+        self._send_queue = send_queue
+
+    async def __aenter__(self) -> 'PooledMessageSender':
+        self._task_group = anyio.create_task_group()
+        await self._task_group.__aenter__()
+        try:
+            for slot in range(len(self._connections)):
+                await self._task_group.start(self._run_connection, slot)
+            if self._send_queue is not None:
+                await self._task_group.start(self._send_queue.run, self._send_directly)
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        if self._health_check_interval_seconds:
+            self._task_group.start_soon(self._run_health_checks)
+        return self
+
+    async def __aexit__(self, *excinfo: Any) -> None:
+        if self._task_group is not None:
+            self._task_group.cancel_scope.cancel()
+            await self._task_group.__aexit__(None, None, None)
+            self._task_group = None
+
+    @property
+    def connections(self) -> List[Optional[ExtendedMessageSender]]:
+        return list(self._connections)
+
+    async def _run_connection(self, slot: int, *, task_status: TaskStatus = anyio.TASK_STATUS_IGNORED):
+        started = False
+        reconnect_delay = 1.0
+        while True:
+            try:
+                socket = await Socket(self._username, self._socket_path, False).__aenter__()
+            except (ConnectionError, OSError) as e:
+                if not started:
+                    raise
+                self.log.error(f"Could not reconnect send socket #{slot}, retrying in {reconnect_delay}s", exc_info=e)
+                await anyio.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, self._reconnect_max_delay_seconds)
+                continue
+
+            reconnect_delay = 1.0
+            sender = ExtendedMessageSender(self._username, socket, self._raise_signald_errors,
+                                           self._request_timeout_seconds)
+            try:
+                async with anyio.create_task_group() as tg:
+                    await tg.start(sender.run_reader)
+                    self._connections[slot] = sender
+                    if not started:
+                        started = True
+                        task_status.started()
+            finally:
+                self._connections[slot] = None
+                with CancelScope(shield=True):
+                    try:
+                        await socket.__aexit__(None, None, None)
+                    except Exception as e:
+                        self.log.debug(f"Could not close send socket #{slot} cleanly: {e}")
+
+            self.log.warning(f"Send socket #{slot} was disconnected, reconnecting...")
+
+    async def _run_health_checks(self):
+        while True:
+            await anyio.sleep(self._health_check_interval_seconds)
+            for slot, sender in enumerate(self._connections):
+                if sender is None or not sender.is_connected:
+                    continue
+                try:
+                    await sender._generic_send({"type": "version"}, None,
+                                               timeout=self._request_timeout_seconds or self._health_check_interval_seconds)
+                except Exception as e:  # timeouts, disconnections and signald errors alike (not cancellation)
+                    self.log.error(f"Health check of send socket #{slot} failed, replacing it", exc_info=e)
+                    sender.close()
+
+    def _pick_connection(self) -> ExtendedMessageSender:
+        """Return the healthy connection with the fewest requests in flight, rotating between equals."""
+        best = None
+        connection_count = len(self._connections)
+        for offset in range(connection_count):
+            candidate = self._connections[(self._next_index + offset) % connection_count]
+            if candidate is not None and candidate.is_connected and (best is None
+                                                                     or candidate.in_flight < best.in_flight):
+                best = candidate
+        self._next_index = (self._next_index + 1) % connection_count
+
+        if best is None:
+            raise MessageNotSentError("No healthy signald connection is available")
+        return best
+
+    async def _send(self, message: Dict) -> Any:
+        if self._send_queue is not None and conversation_key(message) is not None:
+            return await self._send_queue.send(message)
+        return await self._send_directly(message)
+
+    async def _send_directly(self, message: Dict) -> Any:
+        return await self._pick_connection()._send(message)
+
+    async def mark_read(self, message: Message) -> None:
+        """Mark the message as read, queued with the other messages of its conversation (its group, if any)."""
+        receipt = {
+            "type": "mark_read",
+            "version": "v1",
+            "account": self._username,
+            "to": {"uuid": message.source.uuid},
+            "timestamps": [message.timestamp],
+        }
+        if self._send_queue is not None:
+            await self._send_queue.send(receipt, key=message.get_group_id())
+        else:
+            await self._send_directly(receipt)
+
+    async def _generic_send(self, message: Dict, mapper: Callable[[dict], T],
+                            timeout: Optional[float] | object = _DEFAULT_TIMEOUT) -> T:
+        return await self._pick_connection()._generic_send(message, mapper, timeout)
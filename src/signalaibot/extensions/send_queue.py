@@ -0,0 +1,303 @@
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import anyio
+from anyio.abc import TaskGroup, TaskStatus
+from semaphore.exceptions import InternalError, RateLimitError, SeverNotFoundError
+
+from signalaibot.services.metrics import metrics, OUTBOUND_MESSAGES
+
+SendFunction = Callable[[Dict], Awaitable[Any]]
+
+# the other conversation messages are not waited for, they succeed once queued (failures are only logged)
+_AWAITED_MESSAGE_TYPES = frozenset({'send'})
+# the messages Signal rate limits, the others (typing indicators, read receipts) are never held back
+_PACED_MESSAGE_TYPES = frozenset({'send', 'react'})
+# the messages not worth sending late, dropped while their conversation is paused
+_DROPPED_WHILE_PAUSED_MESSAGE_TYPES = frozenset({'typing'})
+# the messages which change nothing when sent twice, sent again even if their writing failed midway
+_IDEMPOTENT_MESSAGE_TYPES = frozenset({'typing', 'mark_read', 'react'})
+# the signald errors of a transient failure on its side, the message is sent again after a backoff
+_TRANSIENT_SIGNALD_ERRORS = (InternalError, SeverNotFoundError)
+
+
+class MessageNotSentError(ConnectionResetError):
+    """The message was not written to signald at all (no connection), so sending it again cannot duplicate it."""
+
+
+def conversation_key(message: Dict) -> Optional[str]:
+    """
+    The conversation of an outbound message (group id or recipient uuid), None if it is not a conversation one.
+
+    Read receipts only name the sender, the ones of group messages are queued with the group key instead (see
+    SendQueue.send).
+    """
+    message_type = message.get('type')
+    if message_type in ('send', 'react'):
+        return message.get('recipientGroupId') or (message.get('recipientAddress') or {}).get('uuid')
+    if message_type == 'typing':
+        return message.get('group') or (message.get('address') or {}).get('uuid')
+    if message_type == 'mark_read':
+        return (message.get('to') or {}).get('uuid')
+    return None
+
+
+class _OutboundMessage:
+    __slots__ = ('message', '_event', 'result', 'error')
+
+    def __init__(self, message: Dict):
+        self.message = message
+        self._event = anyio.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    def resolve(self, result: Any):
+        self.result = result
+        self._event.set()
+
+    def fail(self, error: BaseException):
+        self.error = error
+        self._event.set()
+
+    async def wait(self) -> Any:
+        await self._event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class _RateLimit:
+    """Rate limit state of the account, or of a conversation (kept until its pacing window is over)."""
+    __slots__ = ('pause', 'paused_until', 'paced_until', 'last_send_at')
+
+    def __init__(self):
+        self.pause = 0.0  # of the last rate limit, 0 once sends succeed again
+        self.paused_until = 0.0
+        self.paced_until = 0.0
+        self.last_send_at = 0.0
+
+    def limit(self, now: float, pause_seconds: float, max_pause_seconds: float, window_seconds: float) -> float:
+        """Extend the pause (doubled on repeated rate limits) and the pacing window, returning the jittered pause."""
+        self.pause = min(max(self.pause * 2, pause_seconds), max_pause_seconds)
+        pause = self.pause * (0.5 + random.random())
+        self.paused_until = max(self.paused_until, now + pause)
+        self.paced_until = self.paused_until + window_seconds
+        return pause
+
+    def wait_seconds(self, now: float, interval_seconds: float) -> float:
+        """The time left until the next send, 0 if it can be sent now."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        if now < self.paced_until:
+            return max(self.last_send_at + interval_seconds - now, 0.0)
+        return 0.0
+
+
+class SendQueue:
+    """
+    Queue of the outbound conversation messages (replies, reactions, typing indicators, read receipts).
+
+    Messages are sent in order per conversation, by a worker task running while the conversation has messages
+    queued, while different conversations are sent concurrently. Queued messages are coalesced: a typing indicator
+    replaces the one queued right before it (a start followed by a stop cancel out), and read receipts of the same
+    sender are merged. Read receipts of group messages are queued with the other messages of the group.
+
+    Messages which could not be written to signald, or which signald answered with a transient error (an internal
+    or a server not found one), are sent again with a jittered exponential backoff, and so are the idempotent ones
+    whose writing failed midway. A reply which may have reached signald (the connection was lost afterwards) is
+    never sent again, as it could be delivered twice.
+
+    Signal rate limits the whole account, so a rate limit error pauses the replies and reactions to every
+    conversation, then spaces them out for a while. The rate limited conversation is paused for longer when it keeps
+    being rate limited. The rate limited message stays at the head of its conversation and is sent again after the
+    pause, while the typing indicators of the paused conversations are dropped.
+    """
+
+    def __init__(self, retries: int = 3,
+                 retry_backoff_seconds: float = 0.5,
+                 rate_limit_pause_seconds: float = 5.0,
+                 rate_limit_max_pause_seconds: float = 120.0,
+                 rate_limited_interval_seconds: float = 1.0,
+                 rate_limited_window_seconds: float = 60.0):
+        self._retries = retries
+        self._retry_backoff_seconds = retry_backoff_seconds
+        self._rate_limit_pause_seconds = rate_limit_pause_seconds
+        self._rate_limit_max_pause_seconds = rate_limit_max_pause_seconds
+        self._rate_limited_interval_seconds = rate_limited_interval_seconds
+        self._rate_limited_window_seconds = rate_limited_window_seconds
+
+        self._send: Optional[SendFunction] = None
+        self._task_group: Optional[TaskGroup] = None
+        self._queues: Dict[str, Deque[_OutboundMessage]] = {}  # only the conversations with a running worker
+        self._account_rate_limit = _RateLimit()
+        self._rate_limits: Dict[str, _RateLimit] = {}  # only the conversations rate limited within their window
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def is_paused(self, key: str) -> bool:
+        now = time.monotonic()
+        rate_limit = self._rate_limits.get(key)
+        return now < self._account_rate_limit.paused_until or (rate_limit is not None and now < rate_limit.paused_until)
+
+    async def run(self, send: SendFunction, *, task_status: TaskStatus = anyio.TASK_STATUS_IGNORED):
+        """Send the queued messages with the send function, until cancelled."""
+        try:
+            async with anyio.create_task_group() as self._task_group:
+                self._send = send
+                task_status.started()
+                await anyio.sleep_forever()
+        finally:
+            self._task_group = None
+            self._send = None
+            for queue in self._queues.values():  # of the workers cancelled before they started
+                self._fail_all(queue)
+            self._queues.clear()
+
+    @staticmethod
+    def _fail_all(queue: Deque[_OutboundMessage]):
+        error = ConnectionResetError("Send queue stopped")
+        while queue:
+            queue.popleft().fail(error)
+
+    async def send(self, message: Dict, key: Optional[str] = None) -> Any:
+        """
+        Queue the message, returning the result of its sending (or True at once if it is not waited for).
+
+        The conversation key defaults to the one of the message, it is given for the messages which do not name their
+        conversation (read receipts of group messages).
+        """
+        key = key or conversation_key(message)
+        if self._task_group is None or key is None:
+            raise RuntimeError(f"Message cannot be queued: {message.get('type')}")
+
+        if message.get('type') in _DROPPED_WHILE_PAUSED_MESSAGE_TYPES and self.is_paused(key):
+            metrics.inc(OUTBOUND_MESSAGES, type=message.get('type'), result='dropped')
+            return True
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._task_group.start_soon(self._run_conversation, key, queue)
+        elif self._coalesce(queue, message):
+            metrics.inc(OUTBOUND_MESSAGES, type=message.get('type'), result='coalesced')
+            return True
+
+        outbound = _OutboundMessage(message)
+        queue.append(outbound)
+        if message.get('type') in _AWAITED_MESSAGE_TYPES:
+            return await outbound.wait()
+        return True
+
+    @staticmethod
+    def _coalesce(queue: Deque[_OutboundMessage], message: Dict) -> bool:
+        """Whether the message was merged into the (not yet sending) queued ones."""
+        message_type = message.get('type')
+        if message_type == 'typing':
+            # the first queued message may be sending already
+            if len(queue) > 1 and queue[-1].message.get('type') == 'typing':
+                if queue[-1].message.get('typing') != message.get('typing'):
+                    queue.pop().resolve(True)  # started and stopped before being sent
+                return True
+        elif message_type == 'mark_read':
+            for outbound in list(queue)[1:]:
+                if outbound.message.get('type') == 'mark_read' and outbound.message.get('to') == message.get('to'):
+                    timestamps = outbound.message['timestamps']
+                    timestamps.extend(t for t in message.get('timestamps', []) if t not in timestamps)
+                    return True
+        return False
+
+    async def _run_conversation(self, key: str, queue: Deque[_OutboundMessage]):
+        try:
+            while queue:
+                outbound = queue[0]
+                try:
+                    if outbound.message.get('type') in _DROPPED_WHILE_PAUSED_MESSAGE_TYPES and self.is_paused(key):
+                        metrics.inc(OUTBOUND_MESSAGES, type=outbound.message.get('type'), result='dropped')
+                        outbound.resolve(True)
+                    else:
+                        outbound.resolve(await self._send_with_retries(key, outbound.message))
+                except Exception as e:
+                    if outbound.message.get('type') not in _AWAITED_MESSAGE_TYPES:
+                        logging.error(f"Could not send {outbound.message.get('type')} message: {e!r}")
+                    outbound.fail(e)
+                finally:
+                    queue.popleft()
+        finally:
+            self._queues.pop(key, None)
+            self._fail_all(queue)
+            rate_limit = self._rate_limits.get(key)
+            if rate_limit is not None and time.monotonic() >= rate_limit.paced_until:
+                del self._rate_limits[key]
+
+    async def _send_with_retries(self, key: str, message: Dict) -> Any:
+        message_type = message.get('type')
+        paced = message_type in _PACED_MESSAGE_TYPES
+        attempt = 0
+        while True:
+            if paced:
+                await self._wait_for_turn(key)
+            try:
+                result = await self._send(message)
+            except RateLimitError as e:
+                # not accepted by Signal, sent again once the pause is over
+                self._on_rate_limit(key)
+                error, delay = e, 0.0 if paced else self._backoff(attempt)
+            except _TRANSIENT_SIGNALD_ERRORS as e:
+                error, delay = e, self._backoff(attempt)
+            except ConnectionError as e:
+                if not isinstance(e, MessageNotSentError) and message_type not in _IDEMPOTENT_MESSAGE_TYPES:
+                    metrics.inc(OUTBOUND_MESSAGES, type=message_type, result='failed')
+                    raise
+                error, delay = e, self._backoff(attempt)
+            else:
+                if paced:
+                    self._account_rate_limit.pause = 0.0
+                    rate_limit = self._rate_limits.get(key)
+                    if rate_limit is not None:
+                        rate_limit.pause = 0.0
+                metrics.inc(OUTBOUND_MESSAGES, type=message_type, result='sent')
+                return result
+
+            if attempt >= self._retries:
+                metrics.inc(OUTBOUND_MESSAGES, type=message_type, result='failed')
+                raise error
+            attempt += 1
+            metrics.inc(OUTBOUND_MESSAGES, type=message_type, result='retried')
+            logging.warning(f"Sending {message_type} message failed ({error!r}),"
+                            f" retry {attempt}/{self._retries} {f'in {delay:.2f}s' if delay else 'after the pause'}...")
+            await anyio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        return self._retry_backoff_seconds * (2 ** attempt) * (1 + random.random())
+
+    def _on_rate_limit(self, key: str):
+        """Pause the sends of the account and of the conversation (for longer if it keeps being rate limited)."""
+        now = time.monotonic()
+        for expired_key in [k for k, rate_limit in self._rate_limits.items() if now >= rate_limit.paced_until]:
+            del self._rate_limits[expired_key]
+
+        limit_args = (now, self._rate_limit_pause_seconds, self._rate_limit_max_pause_seconds,
+                      self._rate_limited_window_seconds)
+        account_pause = self._account_rate_limit.limit(*limit_args)
+        conversation_pause = self._rate_limits.setdefault(key, _RateLimit()).limit(*limit_args)
+        logging.warning(f"Rate limited by Signal in conversation {key}, pausing all the sends for"
+                        f" {account_pause:.1f}s, and the sends to the conversation for {conversation_pause:.1f}s...")
+
+    async def _wait_for_turn(self, key: str):
+        """Wait for the pauses and the pacing of both the account and the conversation."""
+        while True:
+            now = time.monotonic()
+            rate_limit = self._rate_limits.get(key)
+            delay = max(self._account_rate_limit.wait_seconds(now, self._rate_limited_interval_seconds),
+                        rate_limit.wait_seconds(now, self._rate_limited_interval_seconds) if rate_limit else 0.0)
+            if delay <= 0:
+                self._account_rate_limit.last_send_at = now
+                if rate_limit is not None:
+                    rate_limit.last_send_at = now
+                return
+            await anyio.sleep(delay)
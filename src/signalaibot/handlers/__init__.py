@@ -1,27 +1,93 @@
+import ast
 import fnmatch
 import importlib
 import inspect
+import logging
 import os
+import sys
+import time
 from re import Pattern
-from typing import Callable, Tuple, List
+from typing import Callable, Collection, Dict, List, Tuple
 
-from semaphore import Bot
+from signalaibot.extensions.semaphore_extensions import ExtendedBot
+from signalaibot.services.metrics import metrics, HANDLER_IMPORT_DURATION
 
-handlers: List[Tuple[str | Pattern, Callable, int]] = []
+DEFAULT_HANDLER_PRIORITY = 100
+DEFAULT_ROOT_HANDLER_PRIORITY = 0
 
+# decorator name -> default priority of the handlers it declares (see handler_base)
+_HANDLER_DECORATORS = {'handler': DEFAULT_HANDLER_PRIORITY, 'root_handler': DEFAULT_ROOT_HANDLER_PRIORITY}
 
-def load_handlers():
+# qualified name of the handler function -> (regex, handler, priority), in the order of declaration
+handlers: Dict[str, Tuple[str | Pattern, Callable, int]] = {}
+
+
+def load_handlers(lazy: bool = False):
+    """
+    Import the handler modules, which register their handlers.
+
+    In lazy mode, the handler modules (except the framework ones, which handle every message) are only scanned for
+    their handler declarations, and each of them is imported on the first message matching one of its handlers.
+    """
+    for full_package_name, package_lazy in handler_packages(lazy):
+        load_handlers_from(full_package_name, package_lazy)
+
+
+def reload_handlers(changed_file_paths: Collection[str], lazy: bool = False):
+    """
+    Rebuild the handlers after the given handler module files changed, keeping the handlers of the other modules.
+
+    The changed modules are re-imported (or re-scanned in lazy mode, if they were not imported yet), new modules are
+    loaded and the handlers of deleted modules are dropped. The handlers are only replaced if every changed module
+    loads, otherwise the previous handlers stay in place and the error is raised.
+    """
+    global handlers
+
+    changed_file_paths = {os.path.realpath(path) for path in changed_file_paths}
+    previous_handlers = handlers
+    handlers = {}
+    try:
+        for full_package_name, package_lazy in handler_packages(lazy):
+            for full_module_name, file_path in handler_modules(full_package_name):
+                if os.path.realpath(file_path) not in changed_file_paths:
+                    handlers.update({key: entry for key, entry in previous_handlers.items()
+                                     if entry[1].__module__ == full_module_name})
+                elif full_module_name in sys.modules:
+                    import_handler_module(full_module_name, reload=True)
+                else:
+                    load_handler_module(full_module_name, file_path, package_lazy)
+    except BaseException:
+        handlers = previous_handlers
+        raise
+
+
+def handler_packages(lazy: bool = False) -> List[Tuple[str, bool]]:
+    """The (name, lazy) of the packages of the handler modules, the framework handlers are never loaded lazily."""
     package_name = __name__
-    load_handlers_from(f"{package_name}.framework")
-    load_handlers_from(f"{package_name}")
+    return [(f"{package_name}.framework", False), (f"{package_name}", lazy)]
 
 
-def load_handlers_from(full_package_name: str):
+def handler_modules(full_package_name: str) -> List[Tuple[str, str]]:
+    """The (module name, file path) of the handler modules of the package."""
     package_dir = get_package_dir(full_package_name)
-    for filename in os.listdir(package_dir):
-        if fnmatch.fnmatch(filename, '*_handler.py'):
-            full_module_name = f"{full_package_name}.{filename[:-3]}"  # Remove '.py' and append to package name
-            importlib.import_module(full_module_name)
+    return [(f"{full_package_name}.{filename[:-3]}",  # Remove '.py' and append to package name
+             os.path.join(package_dir, filename))
+            for filename in os.listdir(package_dir) if fnmatch.fnmatch(filename, '*_handler.py')]
+
+
+def load_handlers_from(full_package_name: str, lazy: bool = False):
+    for full_module_name, file_path in handler_modules(full_package_name):
+        load_handler_module(full_module_name, file_path, lazy)
+
+
+def load_handler_module(full_module_name: str, file_path: str, lazy: bool = False):
+    declarations = scan_handler_declarations(file_path) if lazy else None
+    if declarations:
+        for func_name, regex, priority in declarations:
+            add_handler(regex, lazy_handler(full_module_name, func_name), priority)
+        logging.info(f"Deferred the import of {full_module_name} until its first use.")
+    else:
+        import_handler_module(full_module_name)
 
 
 def get_package_dir(package_name: str):
@@ -30,10 +96,75 @@ def get_package_dir(package_name: str):
     return os.path.dirname(module_path)
 
 
+def scan_handler_declarations(file_path: str) -> List[Tuple[str, str, int]] | None:
+    """
+    The (function name, regex, priority) of the handlers declared by the module, without importing it.
+
+    Returns None if any handler declaration is not statically evaluable (e.g. a compiled regex), so the module has
+    to be imported to register its handlers.
+    """
+    with open(file_path, 'r') as file:
+        tree = ast.parse(file.read(), file_path)
+
+    declarations = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            if not isinstance(decorator, ast.Call):
+                continue
+            decorator_name = getattr(decorator.func, 'id', None) or getattr(decorator.func, 'attr', None)
+            if decorator_name not in _HANDLER_DECORATORS:
+                continue
+            if len(decorator.args) > 1:
+                return None
+            try:
+                keywords = {keyword.arg: keyword.value for keyword in decorator.keywords}
+                regex_node = decorator.args[0] if decorator.args else keywords['regex']
+                regex = ast.literal_eval(regex_node)
+                priority = ast.literal_eval(keywords['priority']) if 'priority' in keywords \
+                    else _HANDLER_DECORATORS[decorator_name]
+            except (KeyError, ValueError):
+                return None
+            if not isinstance(regex, str) or not isinstance(priority, int):
+                return None
+            declarations.append((node.name, regex, priority))
+    return declarations
+
+
+def import_handler_module(full_module_name: str, lazy: bool = False, reload: bool = False):
+    started = time.perf_counter()
+    if reload:
+        module = importlib.reload(sys.modules[full_module_name])
+    else:
+        module = importlib.import_module(full_module_name)
+    seconds = time.perf_counter() - started
+    metrics.observe(HANDLER_IMPORT_DURATION, seconds, module=full_module_name, lazy=lazy, reload=reload)
+    logging.info("%s handler module %s in %.1f ms.", "Reloaded" if reload else "Imported", full_module_name,
+                 seconds * 1000)
+    return module
+
+
+def lazy_handler(module_name: str, func_name: str) -> Callable:
+    """Stand-in for a handler of a module not imported yet, importing it on the first call."""
+    loaded_handler: Callable | None = None
+
+    async def new_handler(ctx):
+        nonlocal loaded_handler
+        if loaded_handler is None:
+            # importing registers the real handler, which replaces this one in the handlers (not on the bot)
+            loaded_handler = getattr(import_handler_module(module_name, lazy=True), func_name)
+        return await loaded_handler(ctx)
+
+    new_handler.__module__ = module_name
+    new_handler.__name__ = new_handler.__qualname__ = func_name
+    return new_handler
+
+
 def add_handler(regex: str | Pattern, handler: Callable, priority: int):
-    handlers.append((regex, handler, priority))
+    handlers[f"{handler.__module__}.{handler.__qualname__}"] = (regex, handler, priority)
 
 
-def register_handlers_on_bot(bot: Bot):
-    for (regex, handler, _) in sorted(handlers, key=lambda e: e[2]):
-        bot.register_handler(regex, handler)
+def register_handlers_on_bot(bot: ExtendedBot):
+    """Register the handlers on the bot, replacing the previously registered ones at once (e.g. after a reload)."""
+    bot.replace_handlers((regex, handler) for (regex, handler, _) in sorted(handlers.values(), key=lambda e: e[2]))
@@ -1,17 +1,114 @@
-import random
+import logging
+import time
+from typing import List
 
-from semaphore import ChatContext
+from anyio import get_cancelled_exc_class
+from semaphore import ChatContext, Message
 
-from signalaibot.handlers.framework.handler_base import handler
+from signalaibot.handlers.framework.handler_base import handler, get_completion_client, get_history, \
+    get_response_cache
+from signalaibot.services.completions import budget_messages, CompletionError, Message as ChatMessage, \
+    response_cache_key
+from signalaibot.services.history import HistoryEntry
+from signalaibot.settings.config_manager import get_config
+from signalaibot.settings.model import RequestContext
+from signalaibot.settings.state_manager import get_state
+
+AI_PREFIX = "!ai"
 
 
 @handler(r"^!ai")
 async def ai(ctx: ChatContext) -> None:
-    if 'known_receiver' in ctx.data:
-        emoji = ['❤️', '🔥', '👍', '💩', '🐰']
-        await ctx.message.reply(random.choice(emoji), reaction=True)
-    else:
-        ctx.data['known_receiver'] = True
-        await ctx.message.reply('👋', reaction=True)
-        await ctx.message.reply("Hi! I'm a Signal bot running in a Docker container!",
-                                quote=False)
+    config = get_config()
+    question = ctx.message.get_body()[len(AI_PREFIX):].strip()
+    if not question:
+        await ctx.message.reply(f"Hi! I'm a Signal bot, ask me anything with: {AI_PREFIX} <question>")
+        return
+
+    request_context: RequestContext = ctx.data['request_context']
+    conversation_id = request_context.conversation.id
+
+    history = to_chat_messages(await get_history().recent(conversation_id))
+    messages = budget_messages(config.ai_system_prompt, history, config.ai_prompt_token_budget)
+    if len(messages) == 1:  # not even the question fits into the history (or it was not recorded)
+        messages.append({'role': 'user', 'content': question})
+
+    # the key covers exactly what the model sees: the answers depending on a conversation's history stay in it
+    cache_key = response_cache_key(config.openai_model, config.ai_system_prompt, messages[1:-1], question)
+
+    streamer = ReplyStreamer(ctx.message, config.ai_reply_min_chars, config.ai_reply_max_chars)
+    await ctx.message.typing_started()
+    try:
+        answer = await get_response_cache().get_or_load(cache_key, get_completion_client().stream, messages,
+                                                        streamer.feed)
+        if not streamer.started:  # answered from the cache, or by a concurrent request of the same question
+            await streamer.feed(answer)
+        await streamer.finish()
+    except get_cancelled_exc_class():
+        raise
+    except (CompletionError, TimeoutError, OSError) as e:
+        logging.error(f"Completion for conversation {request_context.conversation} failed: {e}")
+        await ctx.message.reply("Sorry, I cannot answer right now, please try again later!")
+        return
+    finally:
+        await ctx.message.typing_stopped()
+
+    get_history().record(HistoryEntry(conversation_id, int(time.time() * 1000), get_state().bot_uuid or "", answer,
+                                      from_bot=True))
+
+
+def to_chat_messages(history: List[HistoryEntry]) -> List[ChatMessage]:
+    messages = []
+    for entry in history:
+        if entry.from_bot:
+            messages.append({'role': 'assistant', 'content': entry.body})
+        else:
+            content = entry.body
+            if content.startswith(AI_PREFIX):
+                content = content[len(AI_PREFIX):].strip()
+            if content:
+                messages.append({'role': 'user', 'content': content})
+    return messages
+
+
+class ReplyStreamer:
+    """
+    Turns a streamed answer into Signal replies: each paragraph is sent as soon as at least min_chars are complete,
+    and over-long paragraphs are split at max_chars.
+    """
+
+    def __init__(self, message: Message, min_chars: int, max_chars: int):
+        self._message = message
+        self._min_chars = min_chars
+        self._max_chars = max_chars
+        self._buffer = ""
+        self._sent_count = 0
+        self.started = False
+
+    async def feed(self, delta: str):
+        self.started = True
+        self._buffer += delta
+
+        paragraph_end = self._buffer.rfind("\n\n")
+        if paragraph_end >= self._min_chars:
+            await self._send(self._buffer[:paragraph_end])
+            self._buffer = self._buffer[paragraph_end:]
+
+        while len(self._buffer) > self._max_chars:
+            cut = self._buffer.rfind(" ", 0, self._max_chars)
+            if cut <= 0:
+                cut = self._max_chars
+            await self._send(self._buffer[:cut])
+            self._buffer = self._buffer[cut:]
+
+    async def finish(self):
+        await self._send(self._buffer)
+        self._buffer = ""
+        if self._sent_count == 0:
+            await self._send("(no answer)")
+
+    async def _send(self, text: str):
+        text = text.strip()
+        if text:
+            await self._message.reply(text, mark_read=self._sent_count == 0)
+            self._sent_count += 1
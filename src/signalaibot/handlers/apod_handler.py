@@ -1,33 +1,44 @@
-import tempfile
+from typing import Tuple
 
-import anyio
-import asks
-import feedparser
 from bs4 import BeautifulSoup
 from semaphore import ChatContext, Attachment
 
-from signalaibot.handlers.framework.handler_base import handler
+from signalaibot.handlers.framework.handler_base import handler, cpu_bound, get_feed_cache, get_image_cache
+from signalaibot.services.image_cache import PreparedImage
 
+APOD_FEED_URL = 'https://apod.nasa.gov/apod.rss'
 
-@handler(r"^!apod")
+# (feed entry, message, attachment) of the latest picture, to answer repeat requests without parsing or downloading
+_latest_apod: Tuple[str, str, PreparedImage] | None = None
+
+
+@handler(r"^!apod", max_concurrency=2)
 async def apod(ctx: ChatContext) -> None:
-    with tempfile.NamedTemporaryFile(delete=True, suffix=".png") as temp_file:
-        path = temp_file.name
-        content = (await asks.get('https://apod.nasa.gov/apod.rss')).text
-        feed = feedparser.parse(content)
-        pointer = feed.entries[0]
-        soup = BeautifulSoup(pointer.description, "html.parser")
-
-        for img in soup.find_all("img"):
-            apod = img["src"]
-            description = img["alt"]
-
-        r = await asks.get(apod, stream=True)
-        async with await anyio.open_file(path, "wb") as f:
-            async for chunk in r.body:
-                await f.write(chunk)
+    global _latest_apod
+
+    # the feed cache bounds the lookups, a new picture is served as soon as the feed has it
+    feed = await get_feed_cache().get(APOD_FEED_URL)
+    pointer = feed.entries[0]
+    if _latest_apod is None or _latest_apod[0] != pointer.description or not _latest_apod[2].path.exists():
+        apod, description = await extract_image(pointer.description)
 
+        image = await get_image_cache().get_or_prepare(apod)
         message = f"{pointer.title} - {description} https://apod.nasa.gov/apod"
-        attachment = Attachment(str(path), width=100, height=100)
+        _latest_apod = (pointer.description, message, image)
+
+    _, message, image = _latest_apod
+    attachment = Attachment(str(image.path),
+                            width=image.info.width if image.info else None,
+                            height=image.info.height if image.info else None)
+
+    await ctx.message.reply(body=message, attachments=[attachment])
+
 
-        await ctx.message.reply(body=message, attachments=[attachment])
+@cpu_bound
+def extract_image(html: str) -> Tuple[str, str]:
+    """The (source, alt text) of the last image of the html."""
+    soup = BeautifulSoup(html, "html.parser")
+    for img in soup.find_all("img"):
+        apod = img["src"]
+        description = img["alt"]
+    return apod, description
@@ -1,8 +1,6 @@
-import asks
-import feedparser
 from semaphore import ChatContext
 
-from signalaibot.handlers.framework.handler_base import handler
+from signalaibot.handlers.framework.handler_base import handler, get_feed_cache
 
 FEEDS = {
     "world": "http://feeds.bbci.co.uk/news/world/rss.xml",
@@ -33,8 +31,8 @@ async def bbc(ctx: ChatContext) -> None:
     else:
         requested_feed = FEEDS.get(news, DEFAULT_FEED)
 
-        # Parse news feed.
-        feed = feedparser.parse((await asks.get(requested_feed)).text)
+        # Fetch parsed news feed.
+        feed = await get_feed_cache().get(requested_feed)
 
         # Create message with 3 latest headlines.
         reply = []
@@ -2,12 +2,19 @@ import logging
 import os
 import re
 import signal
+from typing import Dict
 
+import anyio
 from semaphore import ChatContext
 
 from signalaibot.handlers.framework.handler_base import handler
+from signalaibot.services.metrics import metrics
+from signalaibot.settings import constants
 from signalaibot.settings.model import Role, ConversationType, Conversation, ConversationMeta
-from signalaibot.settings.state_manager import state, state_save_context
+from signalaibot.settings.state_manager import get_state, state_save_context
+from signalaibot.supervisor import read_accounts_status, request_supervisor_stop
+
+LIST_PAGE_SIZE = 10
 
 
 @handler(r"^!adm\s+(\w+)\s*(.*)",
@@ -29,15 +36,15 @@ async def adm(ctx: ChatContext) -> None:
                     if choice == 'y':
                         if conversation.type == ConversationType.GROUP:
                             await ctx.bot.accept_invitation(conversation.id)
-                        state.requested_conversations.pop(conversation)
-                        state.authorized_conversations.add(conversation)
+                        state = get_state()
+                        state.approve_conversation(conversation)
                         save_context.save_soon(state)
                         logging.info(f"The admin approved the conversation {conversation}"
                                      f" with request id {metadata.request_id}.")
                         await ctx.message.reply("Request approved!")
                     elif choice == 'n':
-                        state.requested_conversations.pop(conversation)
-                        state.rejected_conversations.add(conversation)
+                        state = get_state()
+                        state.reject_conversation(conversation)
                         save_context.save_soon(state)
                         logging.info(f"The admin rejected the conversation {conversation}"
                                      f" with request id {metadata.request_id}.")
@@ -48,7 +55,24 @@ async def adm(ctx: ChatContext) -> None:
                 await ctx.message.reply("Given request id not found!")
         else:
             await ctx.message.reply("Syntax error in the req command!")
+    elif subcommand == "list":
+        list_params = re.fullmatch(r"\s*(\d*)\s*", parameters)
+        if list_params:
+            page = int(list_params.group(1) or 1)
+            await ctx.message.reply(format_pending_requests_page(page))
+        else:
+            await ctx.message.reply("Syntax error in the list command!")
+    elif subcommand == "stats":
+        await ctx.message.reply(metrics.summary())
+    elif subcommand == "accounts":
+        await ctx.message.reply(format_accounts_status(await anyio.to_thread.run_sync(read_accounts_status)))
     elif subcommand == "stop":
+        if constants.SUPERVISOR_PID:
+            logging.warning("The admin requested to stop the bot! Asking the supervisor to stop every account.")
+            await ctx.message.reply("Stopping all the bot accounts! This might result in the automatic restart of"
+                                    " the bot by the runtime.")
+            request_supervisor_stop()
+            return
         logging.warning("The admin requested to stop the bot! This might result in the container"
                         " being restarted by the runtime.")
         await ctx.message.reply("Stopping bot! This might result in the automatic restart of the bot"
@@ -64,8 +88,40 @@ async def adm(ctx: ChatContext) -> None:
         await ctx.message.reply(f"Unknown subcommand {subcommand}!")
 
 
-def find_request_id(request_id) -> (Conversation, ConversationMeta):
-    return next(((conv, conv_meta)
-                 for conv, conv_meta in state.requested_conversations.items()
-                 if conv_meta.request_id == request_id),
-                None)
+def find_request_id(request_id) -> (Conversation | None, ConversationMeta | None):
+    return get_state().find_request(request_id) or (None, None)
+
+
+def format_pending_requests_page(page: int) -> str:
+    state = get_state()
+    total = len(state.requested_conversations)
+    if total == 0:
+        return "There are no pending requests."
+
+    page_count = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    page = min(max(page, 1), page_count)
+    lines = [f"Pending requests (page {page}/{page_count}, {total} in total):"]
+    for conversation, metadata in state.pending_requests((page - 1) * LIST_PAGE_SIZE, LIST_PAGE_SIZE):
+        sender_name = metadata.sender_name or "<unknown>"
+        if conversation.type == ConversationType.GROUP:
+            lines.append(f"#{metadata.request_id}: group '{metadata.title or '<unknown>'}' by '{sender_name}'")
+        else:
+            lines.append(f"#{metadata.request_id}: private chat with '{sender_name}'")
+
+    lines.append("Use !adm req <id> y/n to approve/reject a request"
+                 + (f", !adm list {page + 1} for the next page." if page < page_count else "."))
+    return "\n".join(lines)
+
+
+def format_accounts_status(status: Dict[str, dict] | None) -> str:
+    if status is None:
+        return "The bot runs a single account (set BOT_NUMBERS to run several)."
+    if not status:
+        return "The status of the accounts is not available."
+
+    lines = [f"Accounts ({len(status)}):"]
+    for number, account in status.items():
+        running = "running" if account.get('alive') else "down"
+        lines.append(f"{number}: {running}, pid {account.get('pid')}, cpu {account.get('cpu')},"
+                     f" {account.get('restarts', 0)} restarts")
+    return "\n".join(lines)
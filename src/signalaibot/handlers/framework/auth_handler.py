@@ -1,20 +1,100 @@
 import logging
-from typing import cast
+from typing import cast, Any, Dict, Set, Tuple
 
-from aiocache import cached
 from anyio import get_cancelled_exc_class
 from semaphore import ChatContext, StopPropagation, Message
 
 from signalaibot.extensions.semaphore_extensions import ExtendedBot
 from signalaibot.handlers.framework.handler_base import Role, ConversationType, root_handler
-from signalaibot.settings.model import ConversationMeta, Conversation, RequestContext
-from signalaibot.settings.state_manager import state, state_save_context, StateSaveContext
+from signalaibot.services.address_directory import get_address_directory
+from signalaibot.services.metrics import metrics, AUTH_DECISIONS
+from signalaibot.services.name_cache import get_name_caches
+from signalaibot.settings.model import ConversationMeta, Conversation, RequestContext, State
+from signalaibot.settings.state_manager import get_state, state_save_context, StateSaveContext
+
+AUTHORIZATION_CACHE_MAX_ENTRIES = 10000
+
+_AuthorizationKey = Tuple[str, str | None]  # (sender uuid, group id or None for private conversations)
+
+
+class _AuthorizationEntry:
+    __slots__ = ('request_context', 'rejected')
+
+    def __init__(self, request_context: RequestContext):
+        self.request_context = request_context
+        self.rejected = request_context.sender_role_in_conversation == Role.REJECTED
+
+
+class AuthorizationCache:
+    """
+    Memoized authorization decisions of the auth root handler.
+
+    Settled decisions (USER, ADMIN, REJECTED) are cached per sender and conversation, so authorizing a known
+    conversation is a dictionary hit. The cache listens to the changes of the state: changes of a conversation
+    (approve, reject, authorize, removal) invalidate its entries, any other change clears the whole cache.
+    """
+
+    def __init__(self, max_entries: int = AUTHORIZATION_CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries: Dict[_AuthorizationKey, _AuthorizationEntry] = {}
+        self._keys_by_conversation_id: Dict[str, Set[_AuthorizationKey]] = {}
+        self._state: State | None = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def bind(self, bound_state: State):
+        if bound_state is not self._state:
+            self.clear()
+            self._state = bound_state
+            bound_state.add_change_listener(self._on_state_change)
+
+    def get(self, key: _AuthorizationKey) -> _AuthorizationEntry | None:
+        return self._entries.get(key)
+
+    def put(self, key: _AuthorizationKey, request_context: RequestContext):
+        if len(self._entries) >= self._max_entries:
+            self.clear()
+        self._entries[key] = _AuthorizationEntry(request_context)
+        self._keys_by_conversation_id.setdefault(request_context.conversation.id, set()).add(key)
+
+    def invalidate_conversation(self, conversation_id: str):
+        for key in self._keys_by_conversation_id.pop(conversation_id, ()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_conversation_id.clear()
+
+    def _on_state_change(self, change: Dict[str, Any]):
+        conversation = change.get('conversation')
+        if conversation is None:
+            self.clear()  # e.g. the admin uuid changed
+        else:
+            self.invalidate_conversation(conversation['id'])
+
+
+authorization_cache = AuthorizationCache()
 
 
 @root_handler("",
               priority=0)
 async def auth(chat_context: ChatContext) -> None:
     try:
+        message = chat_context.message
+        sender = message.source.uuid
+        group_id = message.get_group_id()
+
+        if not (group_id and is_removal_from_group(ConversationType.GROUP, chat_context)):
+            authorization_cache.bind(get_state())
+            entry = authorization_cache.get((sender, group_id))
+            if entry is not None:
+                chat_context.data['request_context'] = entry.request_context
+                metrics.inc(AUTH_DECISIONS, role=entry.request_context.sender_role_in_conversation.name, cached=True)
+                if entry.rejected:
+                    raise StopPropagation(f"Sender {sender} from group {group_id} was rejected access to the bot!")
+                return
+
         sender, conversation = await extract_sender_and_conversation(chat_context)
 
         async with state_save_context() as save_context:
@@ -36,6 +116,7 @@ async def auth(chat_context: ChatContext) -> None:
 async def extract_sender_and_conversation(chat_context: ChatContext):
     sender = chat_context.message.source.uuid
     assert sender, "Sender uuid is not set!"
+    get_address_directory().learn(chat_context.message.source.number, sender)
 
     group_id = chat_context.message.get_group_id()
     conversation_type = ConversationType.GROUP if group_id else ConversationType.PRIVATE
@@ -47,18 +128,21 @@ async def extract_sender_and_conversation(chat_context: ChatContext):
 
 async def handle_message_or_invite(sender: str, conversation: Conversation,
                                    chat_context: ChatContext, save_context: StateSaveContext):
+    state = get_state()
     request_context = RequestContext(sender=sender, conversation=conversation)
     chat_context.data['request_context'] = request_context
 
     sender_role_in_conversation = get_assigned_role(sender, conversation)
     request_context.sender_role_in_conversation = sender_role_in_conversation
+    metrics.inc(AUTH_DECISIONS, role=sender_role_in_conversation.name, cached=False)
 
-    logging.info(f"Authorization check for sender {sender} from conversation {conversation} resulted in"
-                 f" role: {sender_role_in_conversation}.")
+    logging.info("Authorization check for sender %s from conversation %s resulted in role: %s.",
+                 sender, conversation, sender_role_in_conversation)
 
     if sender_role_in_conversation == Role.REJECTED:
         error = f"Sender {sender} from conversation {conversation} was rejected access to the bot!"
         logging.error(error)
+        authorization_cache.put((sender, chat_context.message.get_group_id()), request_context)
         # TODO leave the group again
         raise StopPropagation(error)
     elif sender_role_in_conversation == Role.NONE:
@@ -67,21 +151,20 @@ async def handle_message_or_invite(sender: str, conversation: Conversation,
             logging.error(error)
             logging.info(f"Requesting approval for {sender} from conversation {conversation} by admin...")
 
-            conversation_meta = ConversationMeta(request_id=state.request_id_next_value)
-            state.request_id_next_value += 1
-            state.requested_conversations[conversation] = conversation_meta
+            conversation_meta = state.request_conversation(conversation)
             save_context.save_soon(state)
 
-            await send_request_to_admin(conversation, conversation_meta, chat_context)
+            await send_request_to_admin(conversation, conversation_meta, chat_context, save_context)
 
         raise StopPropagation(error)
     elif sender_role_in_conversation in (Role.USER, Role.ADMIN):
-        logging.info(f"Sender {sender} from conversation {conversation} is authorized to access the bot!")
+        logging.debug("Sender %s from conversation %s is authorized to access the bot!", sender, conversation)
         if sender_role_in_conversation == Role.ADMIN and conversation not in state.authorized_conversations:
             logging.info(f"The admin interacted from {conversation},"
                          f" which will be automatically added as an authorized conversation!")
-            state.authorized_conversations.add(conversation)
+            state.authorize_conversation(conversation)
             save_context.save_soon(state)
+        authorization_cache.put((sender, chat_context.message.get_group_id()), request_context)
         return
     else:
         error = f"Unhandled role {sender_role_in_conversation}!"
@@ -90,14 +173,10 @@ async def handle_message_or_invite(sender: str, conversation: Conversation,
 
 
 async def handle_removal_from_group(conversation: Conversation, save_context: StateSaveContext):
+    state = get_state()
     logging.info(f"Bot removed from group {conversation}, cleaning up the state file...")
 
-    if conversation in state.requested_conversations:
-        state.requested_conversations.pop(conversation)
-        save_context.save_soon(state)
-
-    if conversation in state.authorized_conversations:
-        state.authorized_conversations.remove(conversation)
+    if state.remove_conversation(conversation):
         save_context.save_soon(state)
 
 
@@ -109,6 +188,7 @@ def is_removal_from_group(conversation_type: ConversationType, chat_context: Cha
 
 
 def get_assigned_role(sender: str, conversation: Conversation) -> Role:
+    state = get_state()
     if sender == state.admin_uuid:
         return Role.ADMIN
 
@@ -123,15 +203,21 @@ def get_assigned_role(sender: str, conversation: Conversation) -> Role:
 
 async def send_request_to_admin(conversation: Conversation,
                                 conversation_meta: ConversationMeta,
-                                chat_context: ChatContext):
+                                chat_context: ChatContext,
+                                save_context: StateSaveContext):
+    state = get_state()
     try:
         sender_name = await get_sender_name(chat_context.message)
-        if not sender_name:
-            sender_name = "<unknown>"
 
         conversation_title = None
         if conversation.type == ConversationType.GROUP:
             conversation_title = await get_group_title(chat_context)
+
+        state.annotate_request(conversation, sender_name, conversation_title)
+        save_context.save_soon(state)
+
+        if not sender_name:
+            sender_name = "<unknown>"
         if not conversation_title:
             conversation_title = sender_name
 
@@ -157,12 +243,11 @@ async def send_request_to_admin(conversation: Conversation,
         raise
 
 
-def key_builder_get_sender_name(func, msg: Message):
-    return msg.source.uuid
+async def get_sender_name(msg: Message) -> str | None:
+    return await get_name_caches().sender_names.get_or_load(msg.source.uuid, fetch_sender_name, msg)
 
 
-@cached(key_builder=key_builder_get_sender_name)
-async def get_sender_name(msg: Message) -> str:
+async def fetch_sender_name(msg: Message) -> str | None:
     sender_name = None
 
     try:
@@ -177,15 +262,14 @@ async def get_sender_name(msg: Message) -> str:
     return sender_name
 
 
-def key_builder_get_group_title(func, chat_context: ChatContext):
-    return chat_context.message.get_group_id()
+async def get_group_title(chat_context: ChatContext) -> str | None:
+    group_id = chat_context.message.get_group_id()
+    return await get_name_caches().group_titles.get_or_load(group_id, fetch_group_title, chat_context, group_id)
 
 
-@cached(key_builder=key_builder_get_group_title)
-async def get_group_title(chat_context: ChatContext) -> str:
+async def fetch_group_title(chat_context: ChatContext, group_id: str) -> str | None:
     group_title = None
 
-    group_id = chat_context.message.get_group_id()
     try:
         bot = cast(ExtendedBot, chat_context.bot)
         group = await bot.get_group(group_id)
@@ -5,34 +5,65 @@ from typing import Callable, Tuple
 
 from semaphore import ChatContext
 
-from signalaibot.handlers import add_handler
+from signalaibot.handlers import add_handler, DEFAULT_HANDLER_PRIORITY, DEFAULT_ROOT_HANDLER_PRIORITY
+from signalaibot.services.completions import get_completion_client, get_response_cache
+from signalaibot.services.cpu_offload import cpu_bound, get_cpu_offloader
+from signalaibot.services.feed_cache import get_feed_cache
+from signalaibot.services.history import get_history
+from signalaibot.services.http_client import get_http_client
+from signalaibot.services.image_cache import get_image_cache
+from signalaibot.handlers.framework.scheduler import get_handler_scheduler, SchedulingRejected, \
+    HIGH_PRIORITY, NORMAL_PRIORITY
+from signalaibot.services.metrics import metrics, HANDLER_DURATION, HANDLER_SHED
 from signalaibot.settings.model import Role, ConversationType, RequestContext
 
+FRAMEWORK_PACKAGE = __name__.rpartition('.')[0]
+
 
 def handler(regex: str | Pattern,
             minimum_role: Role = Role.USER,
             allowed_conversation_types: Tuple[ConversationType, ...] = (
                     ConversationType.PRIVATE, ConversationType.GROUP),
-            priority: int = 100):
+            priority: int = DEFAULT_HANDLER_PRIORITY,
+            max_concurrency: int | None = None):
     def wrapper(original_handler: Callable):
         handler_name = original_handler.__name__
+        # framework handlers (e.g. admin commands) must keep working when the bot is saturated
+        is_framework_handler = original_handler.__module__.startswith(FRAMEWORK_PACKAGE)
+
+        async def execute(ctx: ChatContext, request_context: RequestContext):
+            logging.info("----> Executing handler '%s' for sender %s.", handler_name, request_context.sender)
+            with metrics.timer(HANDLER_DURATION, handler=handler_name):
+                return await original_handler(ctx)
 
         @wraps(original_handler)
-        def new_handler(ctx: ChatContext):
+        async def new_handler(ctx: ChatContext):
             request_context: RequestContext = ctx.data['request_context']
 
             if request_context.conversation.type in allowed_conversation_types:
                 if request_context.sender_role_in_conversation.access_level >= minimum_role.access_level:
-                    logging.info(f"----> Executing handler '{handler_name}' for sender {request_context.sender}.")
-                    return original_handler(ctx)
+                    if is_framework_handler or request_context.sender_role_in_conversation == Role.ADMIN:
+                        dispatch_priority = HIGH_PRIORITY
+                    else:
+                        dispatch_priority = NORMAL_PRIORITY
+                    try:
+                        async with get_handler_scheduler().slot(handler_name, request_context.conversation.id,
+                                                                max_concurrency, dispatch_priority):
+                            return await execute(ctx, request_context)
+                    except SchedulingRejected as e:
+                        logging.warning(f"Handler {handler_name} for {request_context.conversation} was shed:"
+                                        f" {e.reason}.")
+                        metrics.inc(HANDLER_SHED, handler=handler_name, reason=e.reason)
+                        if e.reply:
+                            await ctx.message.reply(e.reply)
                 else:
                     logging.warning(f"Sender {request_context.sender} from {request_context.conversation} tried"
                                     f" to use {handler_name} but they are not entitled to!")
-                    return do_nothing()
+                    return await do_nothing()
             else:
                 logging.warning(f"Sender {request_context.sender} from {request_context.conversation} tried"
                                 f" to use {handler_name} which is not allowed for this conversation type!")
-                return do_nothing()
+                return await do_nothing()
 
         add_handler(regex, new_handler, priority)
         return new_handler
@@ -41,14 +72,15 @@ def handler(regex: str | Pattern,
 
 
 def root_handler(regex: str | Pattern,
-                 priority: int = 0):
+                 priority: int = DEFAULT_ROOT_HANDLER_PRIORITY):
     def wrapper(original_handler: Callable):
         handler_name = original_handler.__name__
 
         @wraps(original_handler)
-        def new_handler(ctx: ChatContext):
-            logging.info(f"----> Executing root handler '{handler_name}' for sender {ctx.message.source.uuid}.")
-            return original_handler(ctx)
+        async def new_handler(ctx: ChatContext):
+            logging.debug("----> Executing root handler '%s' for sender %s.", handler_name, ctx.message.source.uuid)
+            with metrics.timer(HANDLER_DURATION, handler=handler_name):
+                return await original_handler(ctx)
 
         add_handler(regex, new_handler, priority)
         return new_handler
@@ -1,6 +1,19 @@
 from semaphore import ChatContext
 
+from signalaibot.handlers.framework.handler_base import root_handler, get_history
+from signalaibot.services.history import HistoryEntry
+from signalaibot.settings.model import RequestContext
 
-# @handler("")
+
+@root_handler("",
+              priority=1)  # right after the auth handler, so only authorized messages are recorded
 async def save_history(ctx: ChatContext) -> None:
-    pass  # TODO
+    body = ctx.message.get_body()
+    if not body:
+        return
+
+    request_context: RequestContext = ctx.data['request_context']
+    get_history().record(HistoryEntry(request_context.conversation.id,
+                                      ctx.message.timestamp,
+                                      request_context.sender,
+                                      body))
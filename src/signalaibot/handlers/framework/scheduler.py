@@ -0,0 +1,263 @@
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import anyio
+
+NORMAL_PRIORITY = 0
+HIGH_PRIORITY = 1
+
+
+class SchedulingRejected(Exception):
+    """A handler invocation was shed by the scheduler. The reply is meant for the sender, None to stay silent."""
+
+    def __init__(self, reason: str, reply: str | None):
+        super().__init__(reason)
+        self.reason = reason
+        self.reply = reply
+
+
+class _PriorityWaiter:
+    __slots__ = ('event', 'granted', 'cancelled')
+
+    def __init__(self):
+        self.event = anyio.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class PrioritySemaphore:
+    """
+    Counting semaphore which hands free slots to the highest priority waiter first (FIFO within a priority).
+
+    The last reserved slots are only handed to HIGH_PRIORITY acquirers, so high priority work always finds
+    capacity, however much normal work is queued.
+    """
+
+    def __init__(self, capacity: int, reserved: int = 0):
+        if not 0 <= reserved < capacity:
+            raise ValueError(f"The reserved slots ({reserved}) must be less than the capacity ({capacity})!")
+        self._capacity = capacity
+        self._reserved = reserved
+        self._in_use = 0
+        self._waiters: List[Tuple[int, int, _PriorityWaiter]] = []  # heap of (-priority, sequence, waiter)
+        self._sequence = itertools.count()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, waiter in self._waiters if not waiter.cancelled)
+
+    def _has_room(self, priority: int) -> bool:
+        free = self._capacity - self._in_use
+        return free > 0 if priority >= HIGH_PRIORITY else free > self._reserved
+
+    def _first_waiter_priority(self) -> int | None:
+        while self._waiters and self._waiters[0][2].cancelled:
+            heapq.heappop(self._waiters)
+        return -self._waiters[0][0] if self._waiters else None
+
+    async def acquire(self, priority: int = NORMAL_PRIORITY):
+        await anyio.sleep(0)  # checkpoint, like any other acquire
+
+        first_waiter_priority = self._first_waiter_priority()
+        if self._has_room(priority) and (first_waiter_priority is None or first_waiter_priority < priority):
+            self._in_use += 1
+            return
+
+        waiter = _PriorityWaiter()
+        heapq.heappush(self._waiters, (-priority, next(self._sequence), waiter))
+        try:
+            await waiter.event.wait()
+        except BaseException:
+            if waiter.granted:
+                self.release()  # granted while being cancelled
+            else:
+                waiter.cancelled = True
+            raise
+
+    def release(self):
+        self._in_use -= 1
+        while (priority := self._first_waiter_priority()) is not None and self._has_room(priority):
+            _, _, waiter = heapq.heappop(self._waiters)
+            waiter.granted = True
+            self._in_use += 1
+            waiter.event.set()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = NORMAL_PRIORITY):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class _TokenBucket:
+    __slots__ = ('tokens', 'updated', 'notified')
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.notified = False  # whether the sender was already told to slow down since the bucket ran dry
+
+
+class _ConversationSlot:
+    __slots__ = ('limiter', 'users')
+
+    def __init__(self, limit: int):
+        self.limiter = anyio.CapacityLimiter(limit)
+        self.users = 0  # running and waiting invocations, the slot is dropped when it reaches zero
+
+
+class HandlerScheduler:
+    """
+    Admission control of the handlers.
+
+    Every conversation has a token bucket limiting how fast it can trigger handlers, and a cap on its concurrently
+    running handlers. On top of that each handler and the bot as a whole have concurrency limits. Invocations over a
+    concurrency limit are queued, but shed with a reply if the queue is full or they waited for too long, so one
+    noisy conversation can only ever occupy its own share of the bot.
+
+    High priority invocations (admin and framework work) skip the rate and queue limits, go ahead of every queued
+    normal invocation and can use the reserved slots of the bot-wide limit, keeping the bot controllable while it
+    is saturated.
+    """
+
+    def __init__(self,
+                 max_concurrent_handlers: int = 16,
+                 reserved_priority_slots: int = 2,
+                 max_concurrent_per_handler: int = 4,
+                 max_concurrent_per_conversation: int = 2,
+                 conversation_rate_per_minute: float = 20.0,
+                 conversation_burst: int = 5,
+                 max_rate_limited_conversations: int = 1000,
+                 max_queued: int = 100,
+                 queue_timeout_seconds: float = 30.0):
+        self._dispatch = PrioritySemaphore(max_concurrent_handlers, reserved_priority_slots)
+        self._max_concurrent_per_handler = max_concurrent_per_handler
+        self._max_concurrent_per_conversation = max_concurrent_per_conversation
+        self._conversation_rate_per_second = conversation_rate_per_minute / 60
+        self._conversation_burst = conversation_burst
+        self._max_rate_limited_conversations = max_rate_limited_conversations
+        self._max_queued = max_queued
+        self._queue_timeout_seconds = queue_timeout_seconds
+
+        self._handler_limiters: Dict[str, anyio.CapacityLimiter] = {}
+        self._conversation_slots: Dict[str, _ConversationSlot] = {}
+        self._buckets: OrderedDict[str, _TokenBucket] = OrderedDict()  # least recently active first
+        self._queued = 0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return self._dispatch.in_use
+
+    def _take_token(self, conversation_id: str):
+        if self._conversation_rate_per_second <= 0:
+            return
+
+        now = time.monotonic()
+        bucket = self._buckets.get(conversation_id)
+        if bucket is None:
+            if len(self._buckets) >= self._max_rate_limited_conversations:
+                # only a bucket which would be full again by now is evicted, not to hand a fresh burst to a spammer
+                oldest_id, oldest = next(iter(self._buckets.items()))
+                if self._refilled_tokens(oldest, now) < self._conversation_burst:
+                    raise SchedulingRejected('rate_limited', None)  # every tracked conversation is recently active
+                del self._buckets[oldest_id]
+            bucket = self._buckets[conversation_id] = _TokenBucket(self._conversation_burst, now)
+        else:
+            self._buckets.move_to_end(conversation_id)
+            bucket.tokens = min(self._conversation_burst, self._refilled_tokens(bucket, now))
+            bucket.updated = now
+
+        if bucket.tokens < 1:
+            reply = None if bucket.notified else "You are sending too many requests, please slow down!"
+            bucket.notified = True
+            raise SchedulingRejected('rate_limited', reply)
+
+        bucket.tokens -= 1
+        bucket.notified = False
+
+    def _refilled_tokens(self, bucket: _TokenBucket, now: float) -> float:
+        return bucket.tokens + (now - bucket.updated) * self._conversation_rate_per_second
+
+    def _handler_limiter(self, handler_name: str, max_concurrency: int | None) -> anyio.CapacityLimiter:
+        limiter = self._handler_limiters.get(handler_name)
+        if limiter is None:
+            limiter = self._handler_limiters[handler_name] = anyio.CapacityLimiter(
+                max_concurrency or self._max_concurrent_per_handler)
+        return limiter
+
+    @contextlib.asynccontextmanager
+    async def slot(self, handler_name: str, conversation_id: str, max_concurrency: int | None = None,
+                   priority: int = NORMAL_PRIORITY):
+        """Wait for a slot to run the handler for the conversation, raising SchedulingRejected if it is shed."""
+        if priority >= HIGH_PRIORITY:
+            async with self._dispatch.slot(priority):
+                yield
+            return
+
+        self._take_token(conversation_id)
+
+        if self._queued >= self._max_queued:
+            raise SchedulingRejected('queue_full', "The bot is overloaded, please try again later!")
+
+        conversation_slot = self._conversation_slots.get(conversation_id)
+        if conversation_slot is None:
+            conversation_slot = self._conversation_slots[conversation_id] = _ConversationSlot(
+                self._max_concurrent_per_conversation)
+        conversation_slot.users += 1
+
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                acquired = False
+                self._queued += 1
+                try:
+                    with anyio.move_on_after(self._queue_timeout_seconds):
+                        await stack.enter_async_context(conversation_slot.limiter)
+                        await stack.enter_async_context(self._handler_limiter(handler_name, max_concurrency))
+                        await stack.enter_async_context(self._dispatch.slot(NORMAL_PRIORITY))
+                        acquired = True
+                finally:
+                    self._queued -= 1
+
+                if not acquired:
+                    logging.warning(f"Handler {handler_name} for {conversation_id} timed out in the queue.")
+                    raise SchedulingRejected('queue_timeout', "The bot is busy, please try again later!")
+                yield
+        finally:
+            conversation_slot.users -= 1
+            if conversation_slot.users == 0:
+                del self._conversation_slots[conversation_id]
+
+
+_singleton_handler_scheduler: HandlerScheduler | None = None
+
+
+@contextlib.asynccontextmanager
+async def handler_scheduler_context(**kwargs) -> HandlerScheduler:
+    global _singleton_handler_scheduler
+
+    _singleton_handler_scheduler = HandlerScheduler(**kwargs)
+    try:
+        yield _singleton_handler_scheduler
+    finally:
+        _singleton_handler_scheduler = None
+
+
+def get_handler_scheduler() -> HandlerScheduler:
+    if _singleton_handler_scheduler is None:
+        raise RuntimeError("Handler scheduler is not running!")
+    return _singleton_handler_scheduler
@@ -0,0 +1,35 @@
+import fnmatch
+import logging
+import os
+
+from signalaibot.extensions.semaphore_extensions import ExtendedBot
+from signalaibot.handlers import get_package_dir, reload_handlers, register_handlers_on_bot
+
+
+async def reload_handlers_on_changes(bot: ExtendedBot, lazy: bool = False):
+    """
+    Reload the changed handler modules into the running bot, until cancelled.
+
+    Unlike the process reloader, the bot keeps running: the signald connection, the state and the caches stay as
+    they are, only the handlers of the bot are replaced. Changes of other modules (e.g. services) are not reloaded.
+    """
+    try:
+        from watchfiles import awatch
+    except ImportError:
+        logging.error("watchfiles is not installed, cannot reload the handlers on code changes!")
+        return
+
+    package_dir = get_package_dir(__name__.rpartition('.')[0])
+    logging.info(f"Watching {package_dir} for changes of the handler modules...")
+    async for changes in awatch(package_dir):
+        changed_file_paths = {path for _, path in changes if fnmatch.fnmatch(os.path.basename(path), '*_handler.py')}
+        if not changed_file_paths:
+            continue
+
+        logging.info(f"Reloading the handlers after changes of {', '.join(sorted(changed_file_paths))}...")
+        try:
+            reload_handlers(changed_file_paths, lazy)
+        except Exception as e:
+            logging.error(f"Reloading the handlers failed, keeping the previous ones: {e!r}")
+            continue
+        register_handlers_on_bot(bot)
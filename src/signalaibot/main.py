@@ -1,16 +1,19 @@
 import logging
 import os
+from typing import List
 
 import anyio
 
 
-def start_bot():
+def start_bot(reload_handlers: bool = False):
     logging.info("Starting bot...")
-    from signalaibot import bot
-    anyio.run(bot.start_bot)
+    from signalaibot.startup import startup_timer
+    with startup_timer.phase("import bot"):
+        from signalaibot import bot
+    anyio.run(bot.start_bot, reload_handlers)
 
 
-def start(with_reloader: bool = False):
+def start(with_reloader: bool = False, reload_handlers: bool = False):
     if with_reloader:
         logging.info("Starting bot with source code reloader...")
         try:
@@ -19,12 +22,30 @@ def start(with_reloader: bool = False):
         except ImportError:
             logging.error("watchfiles is not installed, cannot start bot with source code reloader!")
             start_bot()
+    elif reload_handlers:
+        logging.info("Starting bot with in-process reloader of the handlers...")
+        start_bot(reload_handlers=True)
     else:
         start_bot()
 
 
+def supervise(bot_numbers: List[str]):
+    logging.info(f"Starting the supervisor of {len(bot_numbers)} bot accounts...")
+    from signalaibot.settings import constants
+    from signalaibot.supervisor import Supervisor
+    Supervisor(bot_numbers, constants.PERSISTENT_DATA_DIR).run()
+
+
 def main():
-    start(os.environ.get('RELOAD_ON_CODE_CHANGES', '').strip().lower() == "true")
+    # several comma separated numbers run the bot for each of them in its own worker process
+    bot_numbers = [number.strip() for number in os.environ.get('BOT_NUMBERS', '').split(',') if number.strip()]
+    if bot_numbers:
+        supervise(bot_numbers)
+        return
+
+    # "true" restarts the whole process on any code change, "handlers" only reloads the changed handler modules
+    reload_mode = os.environ.get('RELOAD_ON_CODE_CHANGES', '').strip().lower()
+    start(with_reloader=reload_mode == "true", reload_handlers=reload_mode == "handlers")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+import contextlib
+import logging
+from typing import Awaitable, Callable, Dict, Iterable
+
+import anyio
+from semaphore import Address
+
+from signalaibot.services.ttl_cache import TtlCache, load_ttl_caches, save_ttl_caches
+
+ADDRESS_UUID_CACHE = 'address_uuids'
+ADDRESS_NUMBER_CACHE = 'address_numbers'
+
+AddressResolver = Callable[[str], Awaitable[Address]]  # e.g. ExtendedBot.get_address_from_number
+
+_NOT_CACHED = object()
+
+
+class AddressDirectory:
+    """
+    Mappings between the phone numbers and the uuids of Signal accounts.
+
+    Numbers are resolved to uuids through signald once, then served from memory until their TTL expires; the
+    mappings are persisted across restarts. Numbers which are not registered on Signal (uuid None) are only cached
+    for the short negative TTL. The mappings learnt from incoming messages are recorded as well, so that the reverse
+    lookup (uuid to number) never needs a round trip.
+    """
+
+    def __init__(self, resolver: AddressResolver, max_entries: int, ttl_seconds: float,
+                 negative_ttl_seconds: float, max_concurrent_resolutions: int = 8):
+        self._resolver = resolver
+        self._uuids: TtlCache[str | None] = TtlCache(ADDRESS_UUID_CACHE, max_entries, ttl_seconds,
+                                                     negative_ttl_seconds=negative_ttl_seconds)
+        self._numbers: TtlCache[str] = TtlCache(ADDRESS_NUMBER_CACHE, max_entries, ttl_seconds)
+        self._resolution_limiter = anyio.CapacityLimiter(max_concurrent_resolutions)
+
+    def _caches(self):
+        return {ADDRESS_UUID_CACHE: self._uuids, ADDRESS_NUMBER_CACHE: self._numbers}
+
+    def __len__(self):
+        return len(self._uuids)
+
+    def learn(self, number: str | None, uuid: str | None):
+        """Record a mapping known without a lookup, e.g. the source of an incoming message."""
+        if number and uuid:
+            self._uuids.put(number, uuid)
+            self._numbers.put(uuid, number)
+
+    def cached_uuid(self, number: str) -> str | None:
+        return self._uuids.get(number)
+
+    def cached_number(self, uuid: str) -> str | None:
+        return self._numbers.get(uuid)
+
+    async def resolve(self, number: str) -> str | None:
+        """The uuid of the number (None if it is not registered on Signal)."""
+        return await self._uuids.get_or_load(number, self._resolve, number)
+
+    async def resolve_many(self, numbers: Iterable[str]) -> Dict[str, str | None]:
+        """The uuids of the numbers, the ones not cached are resolved concurrently."""
+        uuids: Dict[str, str | None] = {}
+        missing = []
+        for number in dict.fromkeys(numbers):
+            uuid = self._uuids.get(number, default=_NOT_CACHED)
+            if uuid is _NOT_CACHED:
+                missing.append(number)
+            else:
+                uuids[number] = uuid
+
+        async def resolve_into(number: str):
+            uuids[number] = await self.resolve(number)
+
+        if missing:
+            async with anyio.create_task_group() as tg:
+                for number in missing:
+                    tg.start_soon(resolve_into, number)
+        return uuids
+
+    async def _resolve(self, number: str) -> str | None:
+        async with self._resolution_limiter:
+            address = await self._resolver(number)
+        uuid = address.uuid if address is not None else None  # no address: not registered either
+        if uuid:
+            self._numbers.put(uuid, number)
+        return uuid
+
+    def load(self, path: str):
+        """Warm the directory with the unexpired mappings saved by a previous run, if any."""
+        if load_ttl_caches(path, self._caches()):
+            logging.info(f"Address directory warmed with {len(self._uuids)} numbers.")
+
+    def save(self, path: str):
+        save_ttl_caches(path, self._caches())
+
+
+_singleton_address_directory: AddressDirectory | None = None
+
+
+@contextlib.asynccontextmanager
+async def address_directory_context(resolver: AddressResolver, path: str | None, **kwargs) -> AddressDirectory:
+    """Run the address directory, persisted across restarts in the file at path (unless it is None)."""
+    global _singleton_address_directory
+
+    address_directory = AddressDirectory(resolver, **kwargs)
+    if path is not None:
+        await anyio.to_thread.run_sync(address_directory.load, path)
+    _singleton_address_directory = address_directory
+    try:
+        yield address_directory
+    finally:
+        _singleton_address_directory = None
+        if path is not None:
+            with anyio.CancelScope(shield=True):
+                try:
+                    await anyio.to_thread.run_sync(address_directory.save, path)
+                except OSError as e:
+                    logging.error(f"Could not save the address directory into {path}: {e}")
+
+
+def get_address_directory() -> AddressDirectory:
+    if _singleton_address_directory is None:
+        raise RuntimeError("Address directory is not running!")
+    return _singleton_address_directory
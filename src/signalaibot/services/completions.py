@@ -0,0 +1,178 @@
+import contextlib
+import hashlib
+import json
+import logging
+import re
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+
+import anyio
+from asks.errors import AsksException
+
+from signalaibot.services.http_client import get_http_client
+from signalaibot.services.ttl_cache import TtlCache
+
+_SSE_DATA_PREFIX = b'data:'
+_SSE_DONE = b'[DONE]'
+_MAX_ERROR_BODY_BYTES = 4096
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = '?!.… '
+
+Message = Dict[str, str]  # {"role": ..., "content": ...}
+
+
+class CompletionError(Exception):
+    pass
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a chat message (~4 characters per token, plus the per-message overhead)."""
+    return len(text) // 4 + 4
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonical form of a prompt for caching: case, whitespace and trailing punctuation are ignored."""
+    return _WHITESPACE.sub(' ', prompt.casefold()).strip().rstrip(_TRAILING_PUNCTUATION)
+
+
+def response_cache_key(model: str, system_prompt: str, context: List[Message], prompt: str) -> str:
+    key_parts = [model, system_prompt, json.dumps(context, separators=(',', ':')), normalize_prompt(prompt)]
+    return hashlib.sha256('\0'.join(key_parts).encode()).hexdigest()
+
+
+def budget_messages(system_prompt: str, history: List[Message], token_budget: int) -> List[Message]:
+    """The system prompt and the latest history messages (oldest first) fitting into the token budget."""
+    remaining = token_budget - estimate_tokens(system_prompt)
+    selected = []
+    for message in reversed(history):
+        cost = estimate_tokens(message['content'])
+        if cost > remaining:
+            break
+        selected.append(message)
+        remaining -= cost
+    return [{'role': 'system', 'content': system_prompt}] + selected[::-1]
+
+
+async def iter_sse_data(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """The data payloads of a server-sent event stream."""
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line = line.strip()
+            if line.startswith(_SSE_DATA_PREFIX):
+                yield line[len(_SSE_DATA_PREFIX):].strip()
+    line = buffer.strip()
+    if line.startswith(_SSE_DATA_PREFIX):
+        yield line[len(_SSE_DATA_PREFIX):].strip()
+
+
+class CompletionClient:
+    """
+    Streaming client of an OpenAI-compatible chat completion endpoint, going through the shared HTTP client.
+
+    At most max_concurrent completions are in flight at once, the others wait for a free slot. A failed request is
+    retried up to retries times: the answer is only streamed once a request succeeded, so nothing is repeated.
+    """
+
+    def __init__(self, base_url: str, api_key: str, model: str,
+                 max_concurrent: int = 4, max_response_tokens: int = 500, timeout_seconds: float = 120.0,
+                 retries: int = 2):
+        self._url = base_url.rstrip('/') + '/chat/completions'
+        self._api_key = api_key
+        self._model = model
+        self._limiter = anyio.CapacityLimiter(max_concurrent)
+        self._max_response_tokens = max_response_tokens
+        self._timeout_seconds = timeout_seconds
+        self._retries = retries
+
+    async def stream(self, messages: List[Message], on_delta: Callable[[str], Awaitable[None]]) -> str:
+        """Stream the completion of the messages, passing the content deltas to on_delta, return the full text."""
+        request = {'model': self._model,
+                   'messages': messages,
+                   'max_tokens': self._max_response_tokens,
+                   'stream': True}
+        headers = {'Authorization': f'Bearer {self._api_key}',
+                   'Accept': 'text/event-stream'}
+
+        content_parts = []
+        async with self._limiter:
+            with anyio.fail_after(self._timeout_seconds):
+                try:
+                    response = await get_http_client().post(self._url, json=request, headers=headers, stream=True,
+                                                            timeout=self._timeout_seconds, retries=self._retries)
+                    async with response.body:
+                        if response.status_code != 200:
+                            raise CompletionError(f"Completion failed with status {response.status_code}:"
+                                                  f" {await _read_error_body(response)}")
+
+                        async for data in iter_sse_data(response.body):
+                            if data == _SSE_DONE:
+                                break
+                            try:
+                                event = json.loads(data)
+                            except json.JSONDecodeError:
+                                logging.warning(f"Skipping undecodable completion event: {data!r}")
+                                continue
+                            if 'error' in event:
+                                raise CompletionError(f"Completion failed: {event['error']}")
+
+                            for choice in event.get('choices', ()):
+                                content = (choice.get('delta') or {}).get('content')
+                                if content:
+                                    content_parts.append(content)
+                                    await on_delta(content)
+                except AsksException as e:  # the connection failed, or the response was malformed
+                    raise CompletionError(f"Completion request failed: {e!r}") from e
+        return ''.join(content_parts)
+
+
+async def _read_error_body(response) -> str:
+    body = b''
+    async for chunk in response.body:
+        body += chunk
+        if len(body) >= _MAX_ERROR_BODY_BYTES:
+            break
+    return body[:_MAX_ERROR_BODY_BYTES].decode(errors='replace')
+
+
+_singleton_completion_client: CompletionClient | None = None
+
+
+@contextlib.asynccontextmanager
+async def completion_client_context(**kwargs) -> CompletionClient:
+    global _singleton_completion_client
+
+    _singleton_completion_client = CompletionClient(**kwargs)
+    try:
+        yield _singleton_completion_client
+    finally:
+        _singleton_completion_client = None
+
+
+def get_completion_client() -> CompletionClient:
+    if _singleton_completion_client is None:
+        raise RuntimeError("Completion client is not running!")
+    return _singleton_completion_client
+
+
+_singleton_response_cache: TtlCache[str] | None = None
+
+
+@contextlib.asynccontextmanager
+async def response_cache_context(max_entries: int, ttl_seconds: float, max_bytes: int) -> TtlCache[str]:
+    """Run the cache of the answers to repeated questions, shared by every conversation (max_entries 0 disables it)."""
+    global _singleton_response_cache
+
+    _singleton_response_cache = TtlCache('ai_responses', max_entries=max_entries, ttl_seconds=ttl_seconds,
+                                         max_bytes=max_bytes, sizeof=lambda answer: len(answer.encode()))
+    try:
+        yield _singleton_response_cache
+    finally:
+        _singleton_response_cache = None
+
+
+def get_response_cache() -> TtlCache[str]:
+    if _singleton_response_cache is None:
+        raise RuntimeError("Response cache is not running!")
+    return _singleton_response_cache
@@ -0,0 +1,78 @@
+import contextlib
+import functools
+import logging
+from typing import Callable, Literal, TypeVar
+
+import anyio
+import anyio.to_process
+
+from signalaibot.services.metrics import metrics, CPU_OFFLOAD_DURATION
+
+T = TypeVar('T')
+
+OffloadMode = Literal['thread', 'process']
+
+
+class CpuOffloader:
+    """
+    Runs CPU-bound work (parsing, decoding...) off the event loop, so that the receive loop and the other handlers
+    are not blocked while it runs.
+
+    At most max_workers calls run at once, the others wait for a free worker. In thread mode, a cancelled caller is
+    released immediately, while its thread finishes in the background. In process mode, the calls are not limited by
+    the GIL and a cancelled call kills its worker process, but the function must be importable by the worker (module
+    level) and its arguments and result must be picklable.
+    """
+
+    def __init__(self, max_workers: int, mode: OffloadMode = 'thread'):
+        self._limiter = anyio.CapacityLimiter(max_workers)
+        self._mode = mode
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        function_name = getattr(func, '__qualname__', type(func).__name__)
+        with metrics.timer(CPU_OFFLOAD_DURATION, function=function_name):
+            if self._mode == 'process':
+                return await anyio.to_process.run_sync(_invoke, func, args, kwargs, cancellable=True,
+                                                       limiter=self._limiter)
+            return await anyio.to_thread.run_sync(_invoke, func, args, kwargs, cancellable=True,
+                                                  limiter=self._limiter)
+
+
+def _invoke(func: Callable[..., T], args: tuple, kwargs: dict) -> T:
+    # a cpu_bound function is pickled as its (module level) wrapper, the worker calls the original function
+    return getattr(func, '_cpu_bound_function', func)(*args, **kwargs)
+
+
+_singleton_cpu_offloader: CpuOffloader | None = None
+
+
+@contextlib.asynccontextmanager
+async def cpu_offload_context(max_workers: int = 2, mode: OffloadMode = 'thread') -> CpuOffloader:
+    global _singleton_cpu_offloader
+
+    logging.info(f"CPU-bound work is offloaded to at most {max_workers} worker {mode}s.")
+    _singleton_cpu_offloader = CpuOffloader(max_workers, mode)
+    try:
+        yield _singleton_cpu_offloader
+    finally:
+        _singleton_cpu_offloader = None
+
+
+def get_cpu_offloader() -> CpuOffloader:
+    if _singleton_cpu_offloader is None:
+        raise RuntimeError("CPU offloader is not running!")
+    return _singleton_cpu_offloader
+
+
+def cpu_bound(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Declares a synchronous, CPU-bound function: calling it returns an awaitable which runs it on the CPU offloader.
+    The plain function stays available as the __wrapped__ attribute.
+    """
+
+    @functools.wraps(func)
+    async def offloaded(*args, **kwargs) -> T:
+        return await get_cpu_offloader().run(offloaded, *args, **kwargs)
+
+    offloaded._cpu_bound_function = func
+    return offloaded
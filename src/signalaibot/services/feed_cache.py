@@ -0,0 +1,123 @@
+import contextlib
+import logging
+import time
+from typing import Dict, Optional, TYPE_CHECKING
+
+import anyio
+from anyio import get_cancelled_exc_class
+from anyio.abc import TaskGroup
+
+from signalaibot.services.cpu_offload import get_cpu_offloader
+from signalaibot.services.http_client import get_http_client
+from signalaibot.services.single_flight import SingleFlight
+
+if TYPE_CHECKING:
+    import feedparser
+
+
+class _FeedCacheEntry:
+    __slots__ = ('feed', 'etag', 'last_modified', 'fetched_at')
+
+    def __init__(self, feed: 'feedparser.FeedParserDict', etag: Optional[str], last_modified: Optional[str],
+                 fetched_at: float):
+        self.feed = feed
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+
+class FeedCache:
+    """
+    Shared cache of parsed RSS/Atom feeds, keyed by URL.
+
+    Entries are fresh for ttl_seconds, then revalidated with a conditional GET (ETag/Last-Modified), so an
+    unchanged feed is neither downloaded nor parsed again. Concurrent misses for the same URL share one fetch.
+    With refresh_in_background, stale entries are served immediately while being refreshed in the background.
+    """
+
+    def __init__(self, task_group: TaskGroup, ttl_seconds: float, refresh_in_background: bool):
+        self._task_group = task_group
+        self._ttl_seconds = ttl_seconds
+        self._refresh_in_background = refresh_in_background
+        self._entries: Dict[str, _FeedCacheEntry] = {}
+        self._single_flight = SingleFlight()
+
+    async def get(self, url: str) -> 'feedparser.FeedParserDict':
+        entry = self._entries.get(url)
+        if entry is not None:
+            if time.monotonic() - entry.fetched_at < self._ttl_seconds:
+                return entry.feed
+
+            if self._refresh_in_background:
+                if not self._single_flight.in_flight(url):
+                    self._task_group.start_soon(self._refresh_quietly, url)
+                return entry.feed
+
+        return await self._single_flight.do(url, self._fetch, url)
+
+    async def _refresh_quietly(self, url: str):
+        try:
+            await self._single_flight.do(url, self._fetch, url)
+        except get_cancelled_exc_class():
+            raise
+        except Exception as e:
+            logging.error(f"Background refresh of feed {url} failed: {e}")
+
+    async def _fetch(self, url: str) -> 'feedparser.FeedParserDict':
+        entry = self._entries.get(url)
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        # asks would follow a 304 as a redirect (without a location), so conditional requests follow none
+        response = await get_http_client().get(url, headers=headers, follow_redirects=not headers)
+        if headers and 300 <= response.status_code < 400 and response.status_code != 304:
+            response = await get_http_client().get(url)  # the feed moved: fetched again, unconditionally
+        now = time.monotonic()
+
+        if response.status_code == 304 and entry is not None:
+            logging.info(f"Feed {url} is not modified, reusing cached content.")
+            entry.fetched_at = now
+            return entry.feed
+
+        response.raise_for_status()
+        feed = await get_cpu_offloader().run(_parse_feed, bytes(response.content))  # asks reads into a bytearray
+
+        response_headers = {key.lower(): value for key, value in response.headers.items()}
+        self._entries[url] = _FeedCacheEntry(feed,
+                                             response_headers.get('etag'),
+                                             response_headers.get('last-modified'),
+                                             now)
+        return feed
+
+
+def _parse_feed(content: bytes) -> 'feedparser.FeedParserDict':
+    import feedparser  # deferred, it is slow to import and only the feed handlers need it
+    return feedparser.parse(content)
+
+
+_singleton_feed_cache: FeedCache | None = None
+
+
+@contextlib.asynccontextmanager
+async def feed_cache_context(ttl_seconds: float = 60, refresh_in_background: bool = False) -> FeedCache:
+    global _singleton_feed_cache
+
+    async with anyio.create_task_group() as tg:
+        _singleton_feed_cache = FeedCache(tg, ttl_seconds, refresh_in_background)
+        try:
+            yield _singleton_feed_cache
+        finally:
+            # cancel running tasks (i.e. background refreshes)
+            tg.cancel_scope.cancel()
+            _singleton_feed_cache = None
+
+
+def get_feed_cache() -> FeedCache:
+    if _singleton_feed_cache is None:
+        raise RuntimeError("Feed cache is not running!")
+    return _singleton_feed_cache
@@ -0,0 +1,223 @@
+import contextlib
+import logging
+import sqlite3
+import time
+from collections import deque, OrderedDict
+from typing import Deque, List, Tuple
+
+import anyio
+from anyio import get_cancelled_exc_class
+
+_RETENTION_CHECK_INTERVAL_SECONDS = 3600
+_ONE_DAY_MS = 24 * 3600 * 1000
+
+
+class HistoryEntry:
+    __slots__ = ('conversation_id', 'timestamp', 'sender', 'body', 'from_bot')
+
+    def __init__(self, conversation_id: str, timestamp: int, sender: str, body: str, from_bot: bool = False):
+        self.conversation_id = conversation_id
+        self.timestamp = timestamp  # milliseconds since the epoch, like Signal message timestamps
+        self.sender = sender
+        self.body = body
+        self.from_bot = from_bot
+
+    def as_row(self) -> Tuple:
+        return self.conversation_id, self.timestamp, self.sender, self.body, int(self.from_bot)
+
+    @staticmethod
+    def from_row(row: Tuple) -> 'HistoryEntry':
+        conversation_id, timestamp, sender, body, from_bot = row
+        return HistoryEntry(conversation_id, timestamp, sender, body, bool(from_bot))
+
+    def __repr__(self):
+        return f"HistoryEntry({self.conversation_id!r}, {self.timestamp}, {self.sender!r}, {self.body!r})"
+
+
+class HistoryStore:
+    """
+    SQLite persistence of the conversation history. Blocking, only to be used from one worker thread at a time.
+    """
+
+    _COLUMNS = "conversation_id, timestamp, sender, body, from_bot"
+
+    def __init__(self, db_path: str):
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS messages ("
+                                 " id INTEGER PRIMARY KEY,"
+                                 " conversation_id TEXT NOT NULL,"
+                                 " timestamp INTEGER NOT NULL,"
+                                 " sender TEXT NOT NULL,"
+                                 " body TEXT NOT NULL,"
+                                 " from_bot INTEGER NOT NULL DEFAULT 0)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS messages_by_conversation_and_time"
+                                 " ON messages (conversation_id, timestamp)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS messages_by_time ON messages (timestamp)")
+
+    def close(self):
+        self._connection.close()
+
+    def insert_many(self, entries: List[HistoryEntry]):
+        with self._connection:  # one transaction per batch
+            self._connection.execute("BEGIN")
+            self._connection.executemany(f"INSERT INTO messages ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                                         [entry.as_row() for entry in entries])
+
+    def query(self, conversation_id: str, since: int | None = None, until: int | None = None,
+              limit: int = 100) -> List[HistoryEntry]:
+        """The latest messages of the conversation in the [since, until) time range, oldest first."""
+        rows = self._connection.execute(f"SELECT {self._COLUMNS} FROM messages"
+                                        f" WHERE conversation_id = ? AND timestamp >= ? AND timestamp < ?"
+                                        f" ORDER BY timestamp DESC, id DESC LIMIT ?",
+                                        (conversation_id,
+                                         since if since is not None else -1,
+                                         until if until is not None else 2 ** 62,
+                                         limit)).fetchall()
+        return [HistoryEntry.from_row(row) for row in reversed(rows)]
+
+    def delete_older_than(self, timestamp: int) -> int:
+        with self._connection:
+            self._connection.execute("BEGIN")
+            return self._connection.execute("DELETE FROM messages WHERE timestamp < ?", (timestamp,)).rowcount
+
+
+class ConversationHistory:
+    """
+    Recent messages of the conversations.
+
+    Each conversation keeps a fixed-size ring buffer of its latest messages in memory (for the most recently active
+    conversations only), so recording and reading the recent context never blocks. New messages are written to
+    SQLite in batches by a background task in a worker thread, and messages older than the retention are deleted
+    periodically. After a restart, the ring buffer of a conversation is warmed from the database on first read.
+    """
+
+    def __init__(self, store: HistoryStore, ring_size: int = 50, max_conversations: int = 1000,
+                 batch_size: int = 100, flush_interval_seconds: float = 5.0, retention_days: float = 30):
+        self._store = store
+        self._store_limiter = anyio.CapacityLimiter(1)  # the connection is used by one thread at a time
+        self._ring_size = ring_size
+        self._max_conversations = max_conversations
+        self._batch_size = batch_size
+        self._flush_interval_seconds = flush_interval_seconds
+        self._retention_ms = int(retention_days * _ONE_DAY_MS) if retention_days else None
+
+        self._buffers: OrderedDict[str, Deque[HistoryEntry]] = OrderedDict()  # least recently used first
+        self._warm: set[str] = set()  # conversations whose buffer already contains their persisted history
+        self._pending: List[HistoryEntry] = []
+        self._batch_full = anyio.Event()
+
+    def _buffer(self, conversation_id: str) -> Deque[HistoryEntry]:
+        buffer = self._buffers.get(conversation_id)
+        if buffer is None:
+            buffer = self._buffers[conversation_id] = deque(maxlen=self._ring_size)
+            if len(self._buffers) > self._max_conversations:
+                evicted_id, _ = self._buffers.popitem(last=False)
+                self._warm.discard(evicted_id)
+        else:
+            self._buffers.move_to_end(conversation_id)
+        return buffer
+
+    def record(self, entry: HistoryEntry):
+        self._buffer(entry.conversation_id).append(entry)
+        self._pending.append(entry)
+        if len(self._pending) >= self._batch_size:
+            self._batch_full.set()
+
+    async def recent(self, conversation_id: str, limit: int | None = None) -> List[HistoryEntry]:
+        """The latest messages of the conversation (at most the ring size), oldest first."""
+        if conversation_id not in self._warm:
+            await self._warm_up(conversation_id)
+
+        entries = list(self._buffer(conversation_id))
+        return entries[-limit:] if limit else entries
+
+    async def _warm_up(self, conversation_id: str):
+        await self.flush()  # the persisted history must not miss the pending messages
+        persisted = await self._run_in_store(self._store.query, conversation_id, None, None, self._ring_size)
+
+        buffer = self._buffer(conversation_id)
+        newest_persisted = persisted[-1].timestamp if persisted else None
+        recorded_since = [entry for entry in buffer
+                          if newest_persisted is None or entry.timestamp > newest_persisted]
+        buffer.clear()
+        buffer.extend(persisted)
+        buffer.extend(recorded_since)
+        self._warm.add(conversation_id)
+
+    async def query(self, conversation_id: str, since: int | None = None, until: int | None = None,
+                    limit: int = 100) -> List[HistoryEntry]:
+        await self.flush()
+        return await self._run_in_store(self._store.query, conversation_id, since, until, limit)
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            await self._run_in_store(self._store.insert_many, batch)
+        except BaseException:
+            self._pending[:0] = batch  # retried with the next flush
+            raise
+
+    async def apply_retention(self):
+        if self._retention_ms is None:
+            return
+        threshold = int(time.time() * 1000) - self._retention_ms
+        deleted = await self._run_in_store(self._store.delete_older_than, threshold)
+        if deleted:
+            logging.info(f"Deleted {deleted} messages from the history due to the retention policy.")
+
+    async def _run_in_store(self, func, *args):
+        return await anyio.to_thread.run_sync(func, *args, limiter=self._store_limiter)
+
+    async def run(self):
+        """Background task flushing the pending messages and applying the retention policy."""
+        next_retention_check = 0.0
+        while True:
+            with anyio.move_on_after(self._flush_interval_seconds):
+                await self._batch_full.wait()
+            # replaced by the waiter only, the records of a later batch wake up this one
+            self._batch_full = anyio.Event()
+            try:
+                await self.flush()
+                if time.monotonic() >= next_retention_check:
+                    await self.apply_retention()
+                    next_retention_check = time.monotonic() + _RETENTION_CHECK_INTERVAL_SECONDS
+            except get_cancelled_exc_class():
+                raise
+            except Exception as e:
+                logging.error(f"Writing the conversation history failed: {e}")
+
+
+_singleton_history: ConversationHistory | None = None
+
+
+@contextlib.asynccontextmanager
+async def history_context(db_path: str, **kwargs) -> ConversationHistory:
+    global _singleton_history
+
+    store = await anyio.to_thread.run_sync(HistoryStore, db_path)
+    history = ConversationHistory(store, **kwargs)
+    try:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(history.run)
+            _singleton_history = history
+            try:
+                yield history
+            finally:
+                _singleton_history = None
+                tg.cancel_scope.cancel()
+    finally:
+        with anyio.CancelScope(shield=True):
+            try:
+                await history.flush()
+            finally:
+                await anyio.to_thread.run_sync(store.close)
+
+
+def get_history() -> ConversationHistory:
+    if _singleton_history is None:
+        raise RuntimeError("Conversation history is not running!")
+    return _singleton_history
@@ -0,0 +1,117 @@
+import contextlib
+import logging
+import random
+from typing import Dict
+from urllib.parse import urlparse
+
+import anyio
+import asks
+from asks.errors import ConnectivityError, BadHttpResponse
+from asks.response_objects import BaseResponse
+
+from signalaibot.services.metrics import metrics, HTTP_REQUEST_DURATION
+
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+RETRYABLE_ERRORS = (ConnectivityError, BadHttpResponse, OSError, TimeoutError)
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class HttpClient:
+    """
+    Shared HTTP client of the bot.
+
+    Keeps a keep-alive connection pool per host (scheme and netloc), caps the number of concurrent requests,
+    applies default timeouts and retries connection errors and transient status codes with exponential backoff.
+
+    Only the idempotent requests are retried by default, the callers of the other ones (e.g. POST) pass the retries
+    they know to be safe.
+    """
+
+    def __init__(self,
+                 connections_per_host: int = 4,
+                 max_concurrent_requests: int = 32,
+                 timeout_seconds: float = 30.0,
+                 connect_timeout_seconds: float = 10.0,
+                 retries: int = 2,
+                 retry_backoff_seconds: float = 0.5):
+        self._connections_per_host = connections_per_host
+        self._limiter = anyio.CapacityLimiter(max_concurrent_requests)
+        self._timeout_seconds = timeout_seconds
+        self._connect_timeout_seconds = connect_timeout_seconds
+        self._retries = retries
+        self._retry_backoff_seconds = retry_backoff_seconds
+        self._sessions: Dict[str, asks.Session] = {}
+
+    def _session_for(self, url: str) -> asks.Session:
+        parsed = urlparse(url)
+        host_key = f"{parsed.scheme}://{parsed.netloc}"
+        session = self._sessions.get(host_key)
+        if session is None:
+            session = self._sessions[host_key] = asks.Session(connections=self._connections_per_host)
+        return session
+
+    async def request(self, method: str, url: str, *, retries: int | None = None, **kwargs) -> BaseResponse:
+        if retries is None:
+            retries = self._retries if method.upper() in IDEMPOTENT_METHODS else 0
+        kwargs.setdefault('timeout', self._timeout_seconds)
+        session = self._session_for(url)
+        host = urlparse(url).netloc
+
+        attempt = 0
+        while True:
+            try:
+                async with self._limiter:
+                    with metrics.timer(HTTP_REQUEST_DURATION, method=method, host=host) as timer:
+                        # retries=0: asks would otherwise send the request again on a connection error itself
+                        response = await session.request(method, url, retries=0,
+                                                         connection_timeout=self._connect_timeout_seconds,
+                                                         **kwargs)
+                        timer.label(status=response.status_code)
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= retries:
+                    return response
+                reason = f"status {response.status_code}"
+                if kwargs.get('stream'):
+                    await response.body.close()  # otherwise its connection is never released
+            except RETRYABLE_ERRORS as e:
+                if attempt >= retries:
+                    raise
+                reason = repr(e)
+
+            delay = self._retry_backoff_seconds * (2 ** attempt) * (1 + random.random())
+            attempt += 1
+            logging.warning(f"{method} {url} failed ({reason}), retry {attempt}/{retries} in {delay:.2f}s...")
+            await anyio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> BaseResponse:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> BaseResponse:
+        return await self.request('POST', url, **kwargs)
+
+    async def aclose(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
+
+_singleton_http_client: HttpClient | None = None
+
+
+@contextlib.asynccontextmanager
+async def http_client_context(**kwargs) -> HttpClient:
+    global _singleton_http_client
+
+    _singleton_http_client = HttpClient(**kwargs)
+    try:
+        yield _singleton_http_client
+    finally:
+        with anyio.CancelScope(shield=True):
+            await _singleton_http_client.aclose()
+        _singleton_http_client = None
+
+
+def get_http_client() -> HttpClient:
+    if _singleton_http_client is None:
+        raise RuntimeError("HTTP client is not running!")
+    return _singleton_http_client
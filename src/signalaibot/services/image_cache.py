@@ -0,0 +1,179 @@
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, NamedTuple
+from urllib.parse import urlparse
+
+import anyio
+
+from signalaibot.services.cpu_offload import get_cpu_offloader
+from signalaibot.services.http_client import get_http_client
+from signalaibot.services.image_preparation import ImageInfo, prepare_attachment, read_image_info
+from signalaibot.services.single_flight import SingleFlight
+
+_PART_SUFFIX = '.part'
+_DEFAULT_SUFFIX = '.png'
+_PREPARED_SUFFIX = '.jpg'
+
+
+class PreparedImage(NamedTuple):
+    path: Path
+    info: Optional[ImageInfo]  # None if the format is unknown
+
+
+class ImageCache:
+    """
+    Persistent, size-bounded cache of downloaded images, keyed by image URL.
+
+    Files are named by the hash of their key and written atomically (temporary file, then rename), so a crash
+    never leaves a partial image behind. The least recently used files are evicted once max_bytes is exceeded.
+
+    Images to be attached are prepared first: their dimensions are read from their header, and the ones above the
+    attachment byte or pixel budget are re-encoded into a smaller variant, cached as well.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, attachment_max_bytes: int, attachment_max_pixels: int):
+        self._directory = Path(directory)
+        self._max_bytes = max_bytes
+        self._attachment_max_bytes = attachment_max_bytes
+        self._attachment_max_pixels = attachment_max_pixels
+        self._entries: OrderedDict[str, int] = OrderedDict()  # file name -> size, least recently used first
+        self._total_bytes = 0
+        self._single_flight = SingleFlight()
+
+    def scan(self):
+        """Index the files already in the cache directory, oldest first, dropping leftover partial downloads."""
+        self._directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self._directory.iterdir():
+            if path.name.endswith(_PART_SUFFIX):
+                path.unlink(missing_ok=True)
+            elif path.is_file():
+                stat = path.stat()
+                files.append((stat.st_mtime, path.name, stat.st_size))
+
+        self._entries.clear()
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+        self._total_bytes = sum(self._entries.values())
+        logging.info(f"Image cache contains {len(self._entries)} files ({self._total_bytes} bytes).")
+
+    @staticmethod
+    def file_name_for(url: str) -> str:
+        suffix = os.path.splitext(urlparse(url).path)[1].lower() or _DEFAULT_SUFFIX
+        return hashlib.sha256(url.encode()).hexdigest() + suffix
+
+    def prepared_file_name_for(self, url: str) -> str:
+        key = f"{url}\n{self._attachment_max_bytes}\n{self._attachment_max_pixels}"
+        return hashlib.sha256(key.encode()).hexdigest() + _PREPARED_SUFFIX
+
+    def get(self, url: str) -> Optional[Path]:
+        return self._get_file(self.file_name_for(url))
+
+    def _get_file(self, name: str) -> Optional[Path]:
+        if name not in self._entries:
+            return None
+
+        path = self._directory / name
+        try:
+            os.utime(path)  # persist recency across restarts
+        except FileNotFoundError:
+            self._forget(name)
+            return None
+
+        self._entries.move_to_end(name)
+        return path
+
+    async def get_or_fetch(self, url: str) -> Path:
+        path = self.get(url)
+        if path is not None:
+            return path
+        return await self._single_flight.do(self.file_name_for(url), self._fetch, url)
+
+    async def get_or_prepare(self, url: str) -> PreparedImage:
+        """The image to attach, within the attachment budgets, and its dimensions."""
+        name = self.prepared_file_name_for(url)
+        path = self._get_file(name)
+        if path is not None:
+            return PreparedImage(path, await get_cpu_offloader().run(read_image_info, str(path)))
+        return await self._single_flight.do(name, self._prepare, url)
+
+    async def _prepare(self, url: str) -> PreparedImage:
+        source_path = await self.get_or_fetch(url)
+        name = self.prepared_file_name_for(url)
+        path, info = await get_cpu_offloader().run(prepare_attachment, str(source_path), str(self._directory / name),
+                                                   self._attachment_max_bytes, self._attachment_max_pixels)
+        path = Path(path)
+        if path.name == name:
+            self._add(name, path.stat().st_size)
+        return PreparedImage(path, info)
+
+    async def _fetch(self, url: str) -> Path:
+        name = self.file_name_for(url)
+        path = self._directory / name
+        logging.info(f"Downloading image {url} into the image cache...")
+
+        fd, part_path = tempfile.mkstemp(dir=self._directory, suffix=_PART_SUFFIX)
+        os.close(fd)
+        try:
+            response = await get_http_client().get(url, stream=True)
+            async with response.body:  # closed on errors and cancellation too, otherwise its connection leaks
+                response.raise_for_status()
+                async with await anyio.open_file(part_path, "wb") as f:
+                    async for chunk in response.body:
+                        await f.write(chunk)
+            os.replace(part_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(part_path)
+            raise
+
+        self._add(name, path.stat().st_size)
+        return path
+
+    def _add(self, name: str, size: int):
+        self._forget(name)
+        self._entries[name] = size
+        self._total_bytes += size
+        self._evict(keep=name)
+
+    def _forget(self, name: str):
+        size = self._entries.pop(name, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self, keep: str):
+        while self._total_bytes > self._max_bytes and len(self._entries) > 1:
+            name = next(iter(self._entries))
+            if name == keep:
+                break
+            self._forget(name)
+            logging.info(f"Evicting {name} from the image cache...")
+            (self._directory / name).unlink(missing_ok=True)
+
+
+_singleton_image_cache: ImageCache | None = None
+
+
+@contextlib.asynccontextmanager
+async def image_cache_context(directory: str, max_bytes: int, attachment_max_bytes: int = 1024 * 1024,
+                              attachment_max_pixels: int = 4_000_000) -> ImageCache:
+    global _singleton_image_cache
+
+    image_cache = ImageCache(directory, max_bytes, attachment_max_bytes, attachment_max_pixels)
+    await anyio.to_thread.run_sync(image_cache.scan)
+    _singleton_image_cache = image_cache
+    try:
+        yield image_cache
+    finally:
+        _singleton_image_cache = None
+
+
+def get_image_cache() -> ImageCache:
+    if _singleton_image_cache is None:
+        raise RuntimeError("Image cache is not running!")
+    return _singleton_image_cache
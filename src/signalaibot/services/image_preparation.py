@@ -0,0 +1,186 @@
+import contextlib
+import logging
+import os
+import struct
+import tempfile
+from typing import BinaryIO, NamedTuple, Optional, Tuple
+
+_JPEG_QUALITIES = (85, 75, 65, 50)
+_DOWNSCALE_STEP = 0.75  # when even the lowest quality is above the byte budget
+
+# JPEG start of frame markers (the others in C0-CF are DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_JPEG_STANDALONE_MARKERS = frozenset(range(0xD0, 0xDA)) | {0x01}  # RSTn, SOI, EOI, TEM: no length
+_JPEG_APP1_MARKER = 0xE1  # EXIF
+_EXIF_ORIENTATION_TAG = 0x0112
+_TRANSPOSED_ORIENTATIONS = frozenset({5, 6, 7, 8})  # displayed rotated by 90 degrees: width and height swapped
+
+
+class ImageInfo(NamedTuple):
+    format: str  # 'png', 'jpeg', 'gif' or 'webp'
+    width: int
+    height: int
+
+
+def read_image_info(path: str) -> Optional[ImageInfo]:
+    """
+    The format and displayed dimensions (after the EXIF orientation of JPEGs) of the image, read from its header
+    (without decoding it), None if unknown.
+    """
+    with open(path, 'rb') as file:
+        head = file.read(32)
+        try:
+            if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+                width, height = struct.unpack('>II', head[16:24])
+                return ImageInfo('png', width, height)
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                width, height = struct.unpack('<HH', head[6:10])
+                return ImageInfo('gif', width, height)
+            if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+                return _read_webp_info(head)
+            if head.startswith(b'\xff\xd8'):
+                file.seek(2)
+                return _read_jpeg_info(file)
+        except struct.error:  # truncated header
+            return None
+    return None
+
+
+def _read_webp_info(head: bytes) -> Optional[ImageInfo]:
+    chunk = head[12:16]
+    if chunk == b'VP8 ':  # lossy: 14 bit dimensions after the frame tag and the start code
+        width, height = struct.unpack('<HH', head[26:30])
+        return ImageInfo('webp', width & 0x3FFF, height & 0x3FFF)
+    if chunk == b'VP8L':  # lossless: 14 bit (dimension - 1) fields after the signature byte
+        bits = int.from_bytes(head[21:25], 'little')
+        return ImageInfo('webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b'VP8X':  # extended: 24 bit (dimension - 1) fields of the canvas
+        width, height = int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+        return ImageInfo('webp', width, height)
+    return None
+
+
+def _read_jpeg_info(file: BinaryIO) -> Optional[ImageInfo]:
+    # walk the segments up to the start of frame, skipping the (possibly large) metadata ones but the EXIF one
+    orientation = None
+    while True:
+        byte = file.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = file.read(1)
+        while marker == b'\xff':  # fill bytes
+            marker = file.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        length, = struct.unpack('>H', file.read(2))
+        if marker in _JPEG_SOF_MARKERS:
+            _precision, height, width = struct.unpack('>BHH', file.read(5))
+            if orientation in _TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            return ImageInfo('jpeg', width, height)
+        if marker == 0xDA:  # start of scan without a frame header
+            return None
+        if marker == _JPEG_APP1_MARKER and orientation is None:
+            orientation = _read_exif_orientation(file.read(length - 2))
+        else:
+            file.seek(length - 2, os.SEEK_CUR)
+
+
+def _read_exif_orientation(segment: bytes) -> Optional[int]:
+    """The orientation tag of the first IFD of an EXIF segment, None if missing."""
+    if not segment.startswith(b'Exif\x00\x00'):
+        return None
+    tiff = segment[6:]
+    byte_order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if byte_order is None:
+        return None
+    ifd_offset, = struct.unpack(byte_order + 'I', tiff[4:8])
+    entry_count, = struct.unpack(byte_order + 'H', tiff[ifd_offset:ifd_offset + 2])
+    for index in range(entry_count):
+        entry = tiff[ifd_offset + 2 + 12 * index:ifd_offset + 14 + 12 * index]
+        tag, = struct.unpack(byte_order + 'H', entry[:2])
+        if tag == _EXIF_ORIENTATION_TAG:
+            orientation, = struct.unpack(byte_order + 'H', entry[8:10])
+            return orientation
+    return None
+
+
+def prepare_attachment(source_path: str, target_path: str, max_bytes: int,
+                       max_pixels: int) -> Tuple[str, Optional[ImageInfo]]:
+    """
+    The path and info of the image to attach: the source if it is within the budgets (or cannot be re-encoded),
+    otherwise the variant re-encoded into target_path (atomically).
+    """
+    info = read_image_info(source_path)
+    if info is not None and os.path.getsize(source_path) <= max_bytes and info.width * info.height <= max_pixels:
+        return source_path, info
+
+    fd, part_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix='.part')
+    os.close(fd)
+    try:
+        prepared_info = prepare_image(source_path, part_path, max_bytes, max_pixels)
+        if prepared_info is None:
+            os.unlink(part_path)
+            return source_path, info
+        os.replace(part_path, target_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(part_path)
+        raise
+    logging.info(f"Image {source_path} ({info}) re-encoded into {target_path} ({prepared_info}).")
+    return target_path, prepared_info
+
+
+def prepare_image(source_path: str, target_path: str, max_bytes: int, max_pixels: int) -> Optional[ImageInfo]:
+    """
+    Re-encode the image into target_path as a JPEG of at most max_pixels and (if possible) max_bytes: turned upright
+    (the EXIF orientation is dropped with the rest of the metadata), downscaled to the pixel budget, then
+    recompressed with decreasing qualities (and downscaled further) until it fits the byte budget.
+
+    Returns the info of the prepared image, or None if the image cannot be re-encoded (unknown or animated image),
+    in which case the original should be used.
+    """
+    from PIL import Image, ImageOps  # deferred, only the oversized images need it
+
+    try:
+        with Image.open(source_path) as image:
+            if getattr(image, 'n_frames', 1) > 1:
+                return None  # keep the animation
+            width, height = image.size
+            scale = min(1.0, (max_pixels / (width * height)) ** 0.5)
+            image.draft('RGB', (int(width * scale), int(height * scale)))  # JPEGs are decoded at a reduced scale
+            if image.getexif().get(_EXIF_ORIENTATION_TAG) in _TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            image = _flatten(ImageOps.exif_transpose(image))
+    except (OSError, Image.DecompressionBombError) as e:
+        logging.error(f"Could not decode image {source_path}: {e}")
+        return None
+
+    while True:
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+        for quality in _JPEG_QUALITIES:
+            resized.save(target_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+            if os.path.getsize(target_path) <= max_bytes:
+                return ImageInfo('jpeg', *size)
+        if min(size) <= 16:
+            logging.warning(f"Could not fit image {source_path} into {max_bytes} bytes.")
+            return ImageInfo('jpeg', *size)
+        scale *= _DOWNSCALE_STEP
+
+
+def _flatten(image):
+    """The image in RGB, transparent pixels on white."""
+    from PIL import Image
+
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
@@ -0,0 +1,231 @@
+import bisect
+import contextlib
+import logging
+import time
+from typing import Dict, Tuple, List
+
+import anyio
+from anyio.abc import SocketStream
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HANDLER_DURATION = 'signalaibot_handler_duration_seconds'
+HANDLER_SHED = 'signalaibot_handler_shed_total'
+AUTH_DECISIONS = 'signalaibot_auth_decisions_total'
+SIGNALD_REQUEST_DURATION = 'signalaibot_signald_request_duration_seconds'
+STATE_SAVE_DURATION = 'signalaibot_state_save_duration_seconds'
+HTTP_REQUEST_DURATION = 'signalaibot_http_request_duration_seconds'
+CACHE_REQUESTS = 'signalaibot_cache_requests_total'
+STARTUP_PHASE_DURATION = 'signalaibot_startup_phase_duration_seconds'
+HANDLER_IMPORT_DURATION = 'signalaibot_handler_import_duration_seconds'
+CPU_OFFLOAD_DURATION = 'signalaibot_cpu_offload_duration_seconds'
+OUTBOUND_MESSAGES = 'signalaibot_outbound_messages_total'
+
+_DESCRIPTIONS = {
+    HANDLER_DURATION: "Duration of the handler executions.",
+    HANDLER_SHED: "Handler invocations shed by the scheduler.",
+    AUTH_DECISIONS: "Authorization decisions of the auth root handler.",
+    SIGNALD_REQUEST_DURATION: "Round trip time of the signald requests.",
+    STATE_SAVE_DURATION: "Duration of the state saves.",
+    HTTP_REQUEST_DURATION: "Duration of the outbound HTTP requests (per attempt).",
+    CACHE_REQUESTS: "Cache lookups per cache and result (hit, miss, coalesced).",
+    STARTUP_PHASE_DURATION: "Duration of the startup phases, until the bot starts receiving messages.",
+    HANDLER_IMPORT_DURATION: "Import time of the handler modules, at startup or on first use (lazy).",
+    CPU_OFFLOAD_DURATION: "Duration of the CPU-bound calls run off the event loop, including the wait for a worker.",
+    OUTBOUND_MESSAGES: "Outbound conversation messages per type and result (sent, retried, coalesced, failed).",
+}
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+_MAX_SCRAPE_REQUEST_BYTES = 8192
+
+
+class _Histogram:
+    __slots__ = ('bucket_counts', 'count', 'sum', 'max')
+
+    def __init__(self, bucket_count: int):
+        self.bucket_counts = [0] * (bucket_count + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class _Timer:
+    __slots__ = ('_metrics', '_name', '_labels', '_start')
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: Dict[str, str]):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def label(self, **labels):
+        """Add labels only known inside the with block, e.g. a response status."""
+        self._labels.update(labels)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        outcome = 'ok' if exc_type is None else exc_type.__name__
+        self._metrics.observe(self._name, time.perf_counter() - self._start, outcome=outcome, **self._labels)
+        return False
+
+
+class Metrics:
+    """
+    In-process counters and latency histograms of the bot.
+
+    Series are identified by a metric name and label values. They can be rendered in the Prometheus text format
+    for scraping, or summarized for humans (see !adm stats).
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._counters: Dict[str, Dict[_Labels, float]] = {}
+        self._histograms: Dict[str, Dict[_Labels, _Histogram]] = {}
+        self._started_at = time.monotonic()
+
+    @staticmethod
+    def _labels_key(labels: Dict[str, object]) -> _Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = self._labels_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = self._labels_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = _Histogram(len(self._buckets))
+
+        histogram.bucket_counts[bisect.bisect_left(self._buckets, seconds)] += 1
+        histogram.count += 1
+        histogram.sum += seconds
+        if seconds > histogram.max:
+            histogram.max = seconds
+
+    def timer(self, name: str, **labels) -> _Timer:
+        """Observe the duration of the with block, labeled with its outcome ('ok' or the exception name)."""
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        self._counters.clear()
+        self._histograms.clear()
+        self._started_at = time.monotonic()
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, series in sorted(self._counters.items()):
+            self._append_header(lines, name, 'counter')
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        for name, series in sorted(self._histograms.items()):
+            self._append_header(lines, name, 'histogram')
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(self._buckets + (float('inf'),), histogram.bucket_counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _append_header(lines: List[str], name: str, metric_type: str):
+        description = _DESCRIPTIONS.get(name)
+        if description:
+            lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+    def summary(self) -> str:
+        uptime = time.monotonic() - self._started_at
+        lines = [f"Stats for the last {uptime / 60:.0f} minutes:"]
+
+        for name, series in sorted(self._counters.items()):
+            lines.append(f"{_short_name(name)}:")
+            for labels, value in sorted(series.items()):
+                lines.append(f"  {_format_labels_short(labels)}: {value:g}")
+
+        for name, series in sorted(self._histograms.items()):
+            lines.append(f"{_short_name(name)}:")
+            for labels, histogram in sorted(series.items()):
+                lines.append(f"  {_format_labels_short(labels)}: {histogram.count}x,"
+                             f" avg {histogram.sum / histogram.count:.3f}s,"
+                             f" p95 <{self._percentile_bound(histogram, 0.95):g}s,"
+                             f" max {histogram.max:.3f}s")
+
+        if len(lines) == 1:
+            lines.append("Nothing recorded yet.")
+        return "\n".join(lines)
+
+    def _percentile_bound(self, histogram: _Histogram, percentile: float) -> float:
+        """Upper bound of the bucket containing the percentile (the maximum for the +Inf bucket)."""
+        threshold = percentile * histogram.count
+        cumulative = 0
+        for bound, count in zip(self._buckets, histogram.bucket_counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        return histogram.max
+
+
+def _format_labels(labels: _Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_labels_short(labels: _Labels) -> str:
+    return ' '.join(f"{key}={value}" for key, value in labels) or '-'
+
+
+def _short_name(name: str) -> str:
+    return name.removeprefix('signalaibot_')
+
+
+metrics = Metrics()
+
+
+async def _serve_scrape(stream: SocketStream):
+    async with stream:
+        try:
+            request = b''
+            with anyio.fail_after(10):
+                while b'\r\n\r\n' not in request and len(request) < _MAX_SCRAPE_REQUEST_BYTES:
+                    request += await stream.receive()
+
+            if request.startswith(b'GET /metrics'):
+                status, body = '200 OK', metrics.render_prometheus().encode()
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+
+            await stream.send((f"HTTP/1.0 {status}\r\n"
+                               f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                               f"Content-Length: {len(body)}\r\n"
+                               f"Connection: close\r\n\r\n").encode() + body)
+        except (anyio.EndOfStream, anyio.BrokenResourceError, TimeoutError) as e:
+            logging.debug("Metrics scrape failed: %r", e)
+
+
+@contextlib.asynccontextmanager
+async def metrics_server_context(port: int | None, host: str = '127.0.0.1'):
+    """Serve the metrics in the Prometheus text format on http://host:port/metrics, if a port is given."""
+    if port is None:
+        yield
+        return
+
+    listener = await anyio.create_tcp_listener(local_host=host, local_port=port)
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics ...")
+    async with listener, anyio.create_task_group() as tg:
+        tg.start_soon(listener.serve, _serve_scrape)
+        try:
+            yield
+        finally:
+            tg.cancel_scope.cancel()
@@ -0,0 +1,69 @@
+import contextlib
+import logging
+
+import anyio
+
+from signalaibot.services.ttl_cache import TtlCache, load_ttl_caches, save_ttl_caches
+
+SENDER_NAME_CACHE = 'sender_names'
+GROUP_TITLE_CACHE = 'group_titles'
+
+
+class NameCaches:
+    """
+    Display names looked up from signald: profile names of senders (keyed by uuid) and titles of groups (keyed by
+    group id).
+
+    Both caches are bounded LRU caches with a TTL, so renamed senders and groups are picked up eventually. Failed
+    lookups (None) are cached only for the short negative TTL, and concurrent misses of the same key share one
+    signald round trip.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, negative_ttl_seconds: float):
+        self.sender_names: TtlCache[str | None] = TtlCache(SENDER_NAME_CACHE, max_entries, ttl_seconds,
+                                                           negative_ttl_seconds=negative_ttl_seconds)
+        self.group_titles: TtlCache[str | None] = TtlCache(GROUP_TITLE_CACHE, max_entries, ttl_seconds,
+                                                           negative_ttl_seconds=negative_ttl_seconds)
+
+    def _caches(self):
+        return {SENDER_NAME_CACHE: self.sender_names, GROUP_TITLE_CACHE: self.group_titles}
+
+    def load(self, path: str):
+        """Warm the caches with the unexpired names saved by a previous run, if any."""
+        if load_ttl_caches(path, self._caches()):
+            logging.info(f"Name caches warmed with {len(self.sender_names)} sender names"
+                         f" and {len(self.group_titles)} group titles.")
+
+    def save(self, path: str):
+        save_ttl_caches(path, self._caches())
+
+
+_singleton_name_caches: NameCaches | None = None
+
+
+@contextlib.asynccontextmanager
+async def name_cache_context(path: str | None, max_entries: int, ttl_seconds: float,
+                             negative_ttl_seconds: float) -> NameCaches:
+    """Run the name caches, persisted across restarts in the file at path (unless it is None)."""
+    global _singleton_name_caches
+
+    name_caches = NameCaches(max_entries, ttl_seconds, negative_ttl_seconds)
+    if path is not None:
+        await anyio.to_thread.run_sync(name_caches.load, path)
+    _singleton_name_caches = name_caches
+    try:
+        yield name_caches
+    finally:
+        _singleton_name_caches = None
+        if path is not None:
+            with anyio.CancelScope(shield=True):
+                try:
+                    await anyio.to_thread.run_sync(name_caches.save, path)
+                except OSError as e:
+                    logging.error(f"Could not save the name caches into {path}: {e}")
+
+
+def get_name_caches() -> NameCaches:
+    if _singleton_name_caches is None:
+        raise RuntimeError("Name caches are not running!")
+    return _singleton_name_caches
@@ -0,0 +1,62 @@
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar, Any
+
+import anyio
+
+T = TypeVar('T')
+
+
+class _Call:
+    __slots__ = ('_event', 'result', 'error', 'abandoned')
+
+    def __init__(self):
+        self._event = anyio.Event()
+        self.result: Any = None
+        self.error: Exception | None = None
+        self.abandoned = False
+
+    def finish(self, result: Any = None, error: Exception | None = None, abandoned: bool = False):
+        self.result = result
+        self.error = error
+        self.abandoned = abandoned
+        self._event.set()
+
+    async def wait(self):
+        await self._event.wait()
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into a single execution, whose outcome every caller shares.
+
+    If the executing caller is cancelled, one of the waiting callers takes over instead of failing them all.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[T]], *args) -> T:
+        while (call := self._calls.get(key)) is not None:
+            await call.wait()
+            if call.abandoned:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        call = self._calls[key] = _Call()
+        try:
+            result = await func(*args)
+        except Exception as e:
+            call.finish(error=e)
+            raise
+        except BaseException:
+            call.finish(abandoned=True)
+            raise
+        else:
+            call.finish(result=result)
+            return result
+        finally:
+            del self._calls[key]
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Tuple, TypeVar
+
+from signalaibot.services.metrics import metrics, CACHE_REQUESTS
+from signalaibot.services.single_flight import SingleFlight
+
+T = TypeVar('T')
+
+_MISSING = object()
+
+
+class _CacheEntry:
+    __slots__ = ('value', 'size', 'expires_at')
+
+    def __init__(self, value: Any, size: int, expires_at: float):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+
+class TtlCache(Generic[T]):
+    """
+    In-memory LRU cache with a time-to-live, bounded by entry count and (optionally) by the total size of the values.
+
+    Misses are loaded with single-flight: concurrent lookups of the same missing key share one load. Loaded None
+    values (failed lookups) are cached for negative_ttl_seconds only. Requests are counted per result (hit, miss,
+    coalesced) in the metrics, labeled with the name of the cache.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float,
+                 max_bytes: int | None = None, sizeof: Callable[[T], int] | None = None,
+                 negative_ttl_seconds: float | None = None):
+        self._name = name
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._negative_ttl_seconds = ttl_seconds if negative_ttl_seconds is None else negative_ttl_seconds
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: 0)
+        self._entries: OrderedDict[Hashable, _CacheEntry] = OrderedDict()  # least recently used first
+        self._total_bytes = 0
+        self._single_flight = SingleFlight()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _lookup(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return _MISSING
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def get(self, key: Hashable, default: T | None = None) -> T | None:
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def put(self, key: Hashable, value: T, ttl_seconds: float | None = None):
+        size = self._sizeof(value)
+        if self._max_bytes is not None and size > self._max_bytes:
+            return  # would evict everything else
+
+        self._remove(key)
+        ttl_seconds = self._ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = _CacheEntry(value, size, time.monotonic() + ttl_seconds)
+        self._total_bytes += size
+        while len(self._entries) > self._max_entries or (self._max_bytes is not None
+                                                         and self._total_bytes > self._max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self._total_bytes = 0
+
+    async def get_or_load(self, key: Hashable, loader: Callable[..., Awaitable[T]], *args) -> T:
+        """The cached value of the key, loading (and caching) it with loader(*args) on a miss."""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            metrics.inc(CACHE_REQUESTS, cache=self._name, result='hit')
+            return value
+
+        if self._single_flight.in_flight(key):
+            metrics.inc(CACHE_REQUESTS, cache=self._name, result='coalesced')
+        else:
+            metrics.inc(CACHE_REQUESTS, cache=self._name, result='miss')
+        return await self._single_flight.do(key, self._load, key, loader, *args)
+
+    async def _load(self, key: Hashable, loader: Callable[..., Awaitable[T]], *args) -> T:
+        value = await loader(*args)
+        self.put(key, value, self._negative_ttl_seconds if value is None else None)
+        return value
+
+    def export_entries(self) -> List[Tuple[Hashable, T, float]]:
+        """The live non-None entries as (key, value, expiry as a wall-clock timestamp), to persist them."""
+        offset = time.time() - time.monotonic()
+        now = time.monotonic()
+        return [(key, entry.value, entry.expires_at + offset) for key, entry in self._entries.items()
+                if entry.value is not None and entry.expires_at > now]
+
+    def import_entries(self, entries: List[Tuple[Hashable, T, float]]):
+        """Warm the cache with the exported entries which did not expire since."""
+        offset = time.time() - time.monotonic()
+        for key, value, expires_at in entries:
+            ttl_seconds = expires_at - offset - time.monotonic()
+            if ttl_seconds > 0:
+                self.put(key, value, ttl_seconds)
+
+
+def load_ttl_caches(path: str, caches: Dict[str, TtlCache]) -> bool:
+    """Warm the caches with the unexpired entries saved into the JSON file by save_ttl_caches, if it exists."""
+    try:
+        with open(path) as file:
+            saved = json.load(file)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring the unreadable cache file {path}: {e}")
+        return False
+
+    for name, cache in caches.items():
+        cache.import_entries([tuple(entry) for entry in saved.get(name, ())])
+    return True
+
+
+def save_ttl_caches(path: str, caches: Dict[str, TtlCache]):
+    """Write the unexpired entries of the caches (with string keys) atomically (temporary file, then rename)."""
+    saved = {name: cache.export_entries() for name, cache in caches.items()}
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(saved, file)
+    os.replace(temp_path, path)
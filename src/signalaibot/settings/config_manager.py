@@ -33,6 +33,7 @@ def load_config():
 
 
 def load_env_and_config():
+    """Load the environment and the config. Blocking, run once at startup (see bot.start_bot)."""
     global env
     global config
 
@@ -45,8 +46,18 @@ def load_env_and_config():
     logging.info(f"Config loaded for {env}")
 
 
-# ------- globals -------
-env: Env
-config: Config
+def get_env() -> Env:
+    if env is None:
+        raise RuntimeError("Environment is not loaded!")
+    return env
+
+
+def get_config() -> Config:
+    if config is None:
+        raise RuntimeError("Config is not loaded!")
+    return config
 
-load_env_and_config()
+
+# ------- globals -------
+env: Env | None = None
+config: Config | None = None
@@ -1,7 +1,22 @@
+import os
+
 ENV_KEY = 'ENV'
 
+# overridable to run the bot outside its container, e.g. for benchmarks
+PERSISTENT_DATA_DIR = os.environ.get('PERSISTENT_DATA_DIR', '/persistent_data')
+
 SECRETS_PATH = '/secrets/'
-ENV_FILE_PATH = '/persistent_data/.env'
-STATE_FILE_PATH = '/persistent_data/signalaibot_state.yaml'
+ENV_FILE_PATH = os.environ.get('ENV_FILE_PATH', os.path.join(PERSISTENT_DATA_DIR, '.env'))
+STATE_FILE_PATH = os.path.join(PERSISTENT_DATA_DIR, 'signalaibot_state.yaml')
+STATE_JOURNAL_FILE_PATH = os.path.join(PERSISTENT_DATA_DIR, 'signalaibot_state.journal')
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(PERSISTENT_DATA_DIR, 'image_cache'))
+HISTORY_DB_PATH = os.path.join(PERSISTENT_DATA_DIR, 'signalaibot_history.sqlite3')
+NAME_CACHE_FILE_PATH = os.path.join(PERSISTENT_DATA_DIR, 'signalaibot_name_cache.json')
+ADDRESS_DIRECTORY_FILE_PATH = os.path.join(PERSISTENT_DATA_DIR, 'signalaibot_addresses.json')
+
+# set by the supervisor for its workers in multi-account mode (see supervisor.py)
+ACCOUNTS_STATUS_FILE_PATH = os.environ.get('ACCOUNTS_STATUS_FILE_PATH')
+SUPERVISOR_PID = os.environ.get('SUPERVISOR_PID')
 
 ONE_KB = 1024
+ONE_MB = 1024 * ONE_KB
@@ -1,8 +1,9 @@
+import itertools
 import os
 from enum import Enum, StrEnum
-from typing import Any, Dict, Set
+from typing import Any, Callable, Dict, Set, List, Literal, Tuple
 
-from pydantic import ValidationError, field_serializer, field_validator, Field, BaseModel
+from pydantic import ValidationError, field_serializer, field_validator, Field, BaseModel, PrivateAttr
 
 from signalaibot.settings import constants
 
@@ -33,8 +34,89 @@ class Env(Enum):
 class Config(BaseModel, frozen=True):
     bot_number: str
     admin_number: str
+    account_index: int = 0  # of the bot number in BOT_NUMBERS, set by the supervisor in multi-account mode
 
     openai_api_key: str
+    openai_base_url: str = 'https://api.openai.com/v1'  # any OpenAI-compatible endpoint
+    openai_model: str = 'gpt-3.5-turbo'
+
+    ai_system_prompt: str = "You are a helpful assistant in a Signal chat. Answer concisely."
+    ai_prompt_token_budget: int = 3000
+    ai_max_response_tokens: int = 500
+    ai_max_concurrent_completions: int = 4
+    ai_timeout_seconds: float = 120.0
+    ai_reply_min_chars: int = 200  # streamed paragraphs are sent once at least this long
+    ai_reply_max_chars: int = 1500
+    ai_response_cache_max_entries: int = 1000  # 0 disables the cache
+    ai_response_cache_max_bytes: int = 4 * constants.ONE_MB
+    ai_response_cache_ttl_seconds: float = 3600.0
+
+    signald_socket_path: str = '/signald/signald.sock'
+    signald_request_timeout_seconds: float | None = None
+    signald_send_socket_pool_size: int = 1
+    signald_health_check_interval_seconds: float = 30.0
+
+    send_queue_enabled: bool = True  # order, coalesce and retry the outbound messages per conversation
+    send_retries: int = 3
+    send_retry_backoff_seconds: float = 0.5
+    send_rate_limit_pause_seconds: float = 5.0  # all the sends pause on a rate limit, doubled if repeated
+    send_rate_limit_max_pause_seconds: float = 120.0
+    send_rate_limited_interval_seconds: float = 1.0  # minimum spacing of the sends for a while after a rate limit
+    send_rate_limited_window_seconds: float = 60.0
+
+    state_journal_enabled: bool = False
+    state_journal_compaction_threshold: int = 1000
+    state_dump_backend: Literal['yaml', 'yaml_c', 'json'] = 'yaml'
+
+    http_connections_per_host: int = 4
+    http_max_concurrent_requests: int = 32
+    http_timeout_seconds: float = 30.0
+    http_connect_timeout_seconds: float = 10.0
+    http_retries: int = 2
+    http_retry_backoff_seconds: float = 0.5
+
+    feed_cache_ttl_seconds: float = 60.0
+    feed_cache_refresh_in_background: bool = False
+
+    image_cache_max_bytes: int = 256 * constants.ONE_MB
+    # larger images are downscaled and recompressed (into JPEG) before being attached, if Pillow is installed
+    image_attachment_max_bytes: int = constants.ONE_MB
+    image_attachment_max_pixels: int = 4_000_000
+
+    cpu_offload_max_workers: int = 2  # concurrent CPU-bound calls (e.g. feed and HTML parsing) off the event loop
+    cpu_offload_mode: Literal['thread', 'process'] = 'thread'  # processes avoid the GIL, but cost more per call
+
+    lazy_handler_loading: bool = True  # import the handler modules on their first matching message
+
+    name_cache_max_entries: int = 10000  # per cache (sender names, group titles)
+    name_cache_ttl_seconds: float = 24 * 3600.0
+    name_cache_negative_ttl_seconds: float = 300.0  # failed lookups are retried after this
+    name_cache_persist: bool = True  # warm start from the names cached by the previous run
+
+    address_directory_max_entries: int = 10000
+    address_directory_ttl_seconds: float = 30 * 24 * 3600.0  # number to uuid mappings rarely change
+    address_directory_negative_ttl_seconds: float = 3600.0  # numbers not registered on Signal
+    address_directory_max_concurrent_resolutions: int = 8
+    address_directory_persist: bool = True
+
+    history_ring_size: int = 50  # messages kept in memory per conversation
+    history_max_conversations: int = 1000  # conversations kept in memory
+    history_batch_size: int = 100
+    history_flush_interval_seconds: float = 5.0
+    history_retention_days: float = 30.0  # 0 keeps the history forever
+
+    scheduler_max_concurrent_handlers: int = 16
+    scheduler_reserved_priority_slots: int = 2  # of the above, only usable by admin and framework handlers
+    scheduler_max_concurrent_per_handler: int = 4
+    scheduler_max_concurrent_per_conversation: int = 2
+    scheduler_conversation_rate_per_minute: float = 20.0  # 0 disables rate limiting
+    scheduler_conversation_burst: int = 5
+    scheduler_max_rate_limited_conversations: int = 1000  # new conversations are shed while all of them are active
+    scheduler_max_queued: int = 100
+    scheduler_queue_timeout_seconds: float = 30.0
+
+    metrics_port: int | None = None  # serve Prometheus metrics on this local port (plus the account index), if set
+    metrics_host: str = '127.0.0.1'
 
     @staticmethod
     def from_env_dict(source_env_dict: dict[str, Any]) -> 'Config':
@@ -61,10 +143,21 @@ class Conversation(BaseModel, frozen=True):
 class ConversationMeta(BaseModel, frozen=True):
     request_id: int
 
+    # cached at request time, to list pending requests without signald round trips
+    sender_name: str | None = None
+    title: str | None = None
+
 
 class State(BaseModel):
-    bot_uuid: str = None
-    admin_uuid: str = None
+    """
+    Persistent state of the bot.
+
+    Mutate it only through its methods: each of them records a compact change record, which the state manager
+    appends to the state journal instead of rewriting the whole state file. Pending change records also mark the
+    state as dirty, and snapshot() hands out copy-on-write snapshots for serialization outside the event loop.
+    """
+    bot_uuid: str | None = None
+    admin_uuid: str | None = None
 
     requested_conversations: Dict[Conversation, ConversationMeta] = Field(default_factory=dict)
     request_id_next_value: int = 0
@@ -72,12 +165,19 @@ class State(BaseModel):
     rejected_conversations: Set[Conversation] = Field(default_factory=set)
     authorized_conversations: Set[Conversation] = Field(default_factory=set)
 
+    _changes: List[Dict[str, Any]] = PrivateAttr(default_factory=list)
+    _shared_with_snapshot: bool = PrivateAttr(default=False)
+    _requests_by_id: Dict[int, Conversation] | None = PrivateAttr(default=None)  # built lazily
+    _change_listeners: List[Callable[[Dict[str, Any]], None]] = PrivateAttr(default_factory=list)
+
     def to_json_dict(self):
         return self.model_dump(mode='json')
 
     @field_serializer('requested_conversations', mode='plain')
-    def serialize_req(self, requested_conversations: Dict[Conversation, ConversationMeta], _info):
-        return [dict(conversation=conv, meta=meta) for conv, meta in requested_conversations.items()]
+    def serialize_req(self, requested_conversations: Dict[Conversation, ConversationMeta], info):
+        # without the display names not cached (yet), so the state file keeps its format
+        return [dict(conversation=conv, meta=meta.model_dump(mode=info.mode, exclude_none=True))
+                for conv, meta in requested_conversations.items()]
 
     @field_validator('requested_conversations', mode='before')
     @classmethod
@@ -86,6 +186,179 @@ class State(BaseModel):
             return data
         return {Conversation(**item['conversation']): item['meta'] for item in data}
 
+    # ------- mutations -------
+
+    def set_bot_uuid(self, bot_uuid: str):
+        self.bot_uuid = bot_uuid
+        self._record({'op': 'set', 'field': 'bot_uuid', 'value': bot_uuid})
+
+    def set_admin_uuid(self, admin_uuid: str):
+        self.admin_uuid = admin_uuid
+        self._record({'op': 'set', 'field': 'admin_uuid', 'value': admin_uuid})
+
+    def request_conversation(self, conversation: Conversation) -> ConversationMeta:
+        """Register an access request for the conversation, allocating the next request id."""
+        conversation_meta = ConversationMeta(request_id=self.request_id_next_value)
+        self._add_request(conversation, conversation_meta)
+        self._record({'op': 'request',
+                      'conversation': conversation.model_dump(mode='json'),
+                      'meta': conversation_meta.model_dump(mode='json', exclude_none=True)})
+        return conversation_meta
+
+    def annotate_request(self, conversation: Conversation, sender_name: str | None, title: str | None):
+        """Cache the display names of a pending request."""
+        conversation_meta = self.requested_conversations.get(conversation)
+        if conversation_meta is None:
+            return
+        conversation_meta = conversation_meta.model_copy(update=dict(sender_name=sender_name, title=title))
+        self._add_request(conversation, conversation_meta)
+        self._record({'op': 'request',
+                      'conversation': conversation.model_dump(mode='json'),
+                      'meta': conversation_meta.model_dump(mode='json', exclude_none=True)})
+
+    def approve_conversation(self, conversation: Conversation):
+        self._approve(conversation)
+        self._record({'op': 'approve', 'conversation': conversation.model_dump(mode='json')})
+
+    def reject_conversation(self, conversation: Conversation):
+        self._reject(conversation)
+        self._record({'op': 'reject', 'conversation': conversation.model_dump(mode='json')})
+
+    def authorize_conversation(self, conversation: Conversation):
+        self._authorize(conversation)
+        self._record({'op': 'authorize', 'conversation': conversation.model_dump(mode='json')})
+
+    def remove_conversation(self, conversation: Conversation) -> bool:
+        """Forget a pending request or authorization of the conversation, returning whether anything changed."""
+        if conversation not in self.requested_conversations and conversation not in self.authorized_conversations:
+            return False
+        self._remove(conversation)
+        self._record({'op': 'remove', 'conversation': conversation.model_dump(mode='json')})
+        return True
+
+    def _add_request(self, conversation: Conversation, conversation_meta: ConversationMeta):
+        self._copy_if_shared()
+        existing_meta = self.requested_conversations.get(conversation)
+        if existing_meta is not None and existing_meta.request_id != conversation_meta.request_id:
+            self._pop_request(conversation)
+        self.requested_conversations[conversation] = conversation_meta
+        self.request_id_next_value = max(self.request_id_next_value, conversation_meta.request_id + 1)
+        if self._requests_by_id is not None:
+            self._requests_by_id[conversation_meta.request_id] = conversation
+
+    def _pop_request(self, conversation: Conversation):
+        conversation_meta = self.requested_conversations.pop(conversation, None)
+        if conversation_meta is not None and self._requests_by_id is not None:
+            self._requests_by_id.pop(conversation_meta.request_id, None)
+
+    def _approve(self, conversation: Conversation):
+        self._copy_if_shared()
+        self._pop_request(conversation)
+        self.authorized_conversations.add(conversation)
+
+    def _reject(self, conversation: Conversation):
+        self._copy_if_shared()
+        self._pop_request(conversation)
+        self.rejected_conversations.add(conversation)
+
+    def _authorize(self, conversation: Conversation):
+        self._copy_if_shared()
+        self.authorized_conversations.add(conversation)
+
+    def _remove(self, conversation: Conversation):
+        self._copy_if_shared()
+        self._pop_request(conversation)
+        self.authorized_conversations.discard(conversation)
+
+    # ------- pending request index -------
+
+    def _request_index(self) -> Dict[int, Conversation]:
+        if self._requests_by_id is None:
+            self._requests_by_id = {conversation_meta.request_id: conversation
+                                    for conversation, conversation_meta in sorted(self.requested_conversations.items(),
+                                                                                  key=lambda e: e[1].request_id)}
+        return self._requests_by_id
+
+    def find_request(self, request_id: int) -> Tuple[Conversation, ConversationMeta] | None:
+        conversation = self._request_index().get(request_id)
+        if conversation is None:
+            return None
+        return conversation, self.requested_conversations[conversation]
+
+    def pending_requests(self, offset: int, limit: int) -> List[Tuple[Conversation, ConversationMeta]]:
+        """Return a page of the pending requests, in the order of their request ids."""
+        return [(conversation, self.requested_conversations[conversation])
+                for conversation in itertools.islice(self._request_index().values(), offset, offset + limit)]
+
+    # ------- snapshots -------
+
+    def snapshot(self) -> 'State':
+        """
+        Return a consistent snapshot of the state in O(1), sharing its collections with this state.
+
+        The shared collections are copied by the next mutation of this state (copy-on-write), so the snapshot can
+        be serialized in another thread while this state keeps changing.
+        """
+        self._shared_with_snapshot = True
+        return State.model_construct(bot_uuid=self.bot_uuid,
+                                     admin_uuid=self.admin_uuid,
+                                     requested_conversations=self.requested_conversations,
+                                     request_id_next_value=self.request_id_next_value,
+                                     rejected_conversations=self.rejected_conversations,
+                                     authorized_conversations=self.authorized_conversations)
+
+    def _copy_if_shared(self):
+        if self._shared_with_snapshot:
+            self.requested_conversations = dict(self.requested_conversations)
+            self.rejected_conversations = set(self.rejected_conversations)
+            self.authorized_conversations = set(self.authorized_conversations)
+            self._shared_with_snapshot = False
+
+    # ------- change records -------
+
+    @property
+    def is_dirty(self) -> bool:
+        """Whether the state has changed since the last drain_changes()."""
+        return bool(self._changes)
+
+    def _record(self, change: Dict[str, Any]):
+        self._changes.append(change)
+        for listener in self._change_listeners:
+            listener(change)
+
+    def add_change_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """Call the listener with every change record of this state, e.g. to invalidate derived caches."""
+        self._change_listeners.append(listener)
+
+    def drain_changes(self) -> List[Dict[str, Any]]:
+        """Return the change records since the last call, and forget them."""
+        changes = self._changes
+        self._changes = []
+        return changes
+
+    def apply_change(self, change: Dict[str, Any]):
+        """Replay a change record. Replaying a record more than once has no further effect."""
+        op = change['op']
+        if op == 'set':
+            if change['field'] not in ('bot_uuid', 'admin_uuid'):
+                raise ValueError(f"Invalid field in state change: {change}")
+            setattr(self, change['field'], change['value'])
+            return
+
+        conversation = Conversation(**change['conversation'])
+        if op == 'request':
+            self._add_request(conversation, ConversationMeta(**change['meta']))
+        elif op == 'approve':
+            self._approve(conversation)
+        elif op == 'reject':
+            self._reject(conversation)
+        elif op == 'authorize':
+            self._authorize(conversation)
+        elif op == 'remove':
+            self._remove(conversation)
+        else:
+            raise ValueError(f"Invalid state change: {change}")
+
 
 class Role(Enum):
     def __init__(self, value, access_level):
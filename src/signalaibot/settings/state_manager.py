@@ -1,18 +1,27 @@
 import contextlib
+import functools
+import json
 import logging
 import os
+from typing import Any, Callable, Dict, List
 
 import anyio
 import yaml
 from anyio import get_cancelled_exc_class
 from anyio.abc import TaskGroup
 
+from signalaibot.services.metrics import metrics, STATE_SAVE_DURATION
 from signalaibot.settings import constants
 from signalaibot.settings.model import State
 
+_YAML_C_DUMPER = getattr(yaml, 'CDumper', yaml.Dumper)
+_YAML_C_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 
 def load_state():
+    """Load the state file and replay the journal. Blocking, run once at startup (see bot.start_bot)."""
     global state
+    global _journal_record_count
 
     yaml_file_path = constants.STATE_FILE_PATH
     if os.path.exists(yaml_file_path):
@@ -21,41 +30,113 @@ def load_state():
     else:
         state = State()
 
+    journal_file_path = constants.STATE_JOURNAL_FILE_PATH
+    _journal_record_count = replay_journal(journal_file_path, state) if os.path.exists(journal_file_path) else 0
+
 
 def load_from_yaml(yaml_file_path: str) -> dict:
     logging.info(f"Loading bot state from file {yaml_file_path}...")
     with open(yaml_file_path, 'r') as file:
-        data = yaml.safe_load(file) or {}
+        data = yaml.load(file, Loader=_YAML_C_LOADER) or {}
         return data
 
 
-def save_state():
+def replay_journal(journal_file_path: str, st: State) -> int:
+    logging.info(f"Replaying bot state journal {journal_file_path}...")
+    count = 0
+    with open(journal_file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                change = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping undecodable record in state journal (torn write?): {line}")
+                continue
+            st.apply_change(change)
+            count += 1
+    logging.info(f"Replayed {count} state changes.")
+    return count
+
+
+def save_state(dump_backend: str = 'yaml'):
     global state
 
-    yaml_file_path = constants.STATE_FILE_PATH
-    save_to_yaml(yaml_file_path, state.to_json_dict())
+    save_state_dict(state.to_json_dict(), dump_backend)
 
 
-def save_state_dict(state_dict):
+def save_state_dict(state_dict, dump_backend: str = 'yaml'):
     yaml_file_path = constants.STATE_FILE_PATH
-    save_to_yaml(yaml_file_path, state_dict)
+    save_to_yaml(yaml_file_path, state_dict, dump_backend)
+    remove_journal(constants.STATE_JOURNAL_FILE_PATH)  # all of its changes are contained by the snapshot
 
 
-def save_to_yaml(yaml_file_path, state_dict):
+def save_state_snapshot(snapshot: State, dump_backend: str):
+    save_state_dict(snapshot.to_json_dict(), dump_backend)
+
+
+def save_journal_batch(changes: List[Dict[str, Any]], snapshot: State | None, dump_backend: str):
+    journal_file_path = constants.STATE_JOURNAL_FILE_PATH
+    if changes:
+        append_to_journal(journal_file_path, changes)
+    if snapshot is not None:
+        logging.info("Compacting the state journal into a snapshot...")
+        save_state_snapshot(snapshot, dump_backend)
+
+
+def save_to_yaml(yaml_file_path, state_dict, dump_backend: str = 'yaml'):
     logging.info(f"Saving bot state to file {yaml_file_path}...")
-    with open(yaml_file_path, 'w') as file:
+    temp_file_path = f"{yaml_file_path}.tmp"
+    with open(temp_file_path, 'w') as file:
+        dump_state_dict(state_dict, file, dump_backend)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file_path, yaml_file_path)
+
+
+def dump_state_dict(state_dict, file, dump_backend: str):
+    if dump_backend == 'yaml':
         yaml.dump(state_dict, file, sort_keys=False)
+    elif dump_backend == 'yaml_c':
+        yaml.dump(state_dict, file, Dumper=_YAML_C_DUMPER, sort_keys=False)
+    elif dump_backend == 'json':
+        json.dump(state_dict, file, separators=(',', ':'))  # JSON is valid YAML, so the state file stays loadable
+    else:
+        raise ValueError(f"Unknown state dump backend: '{dump_backend}'!")
+
+
+def append_to_journal(journal_file_path: str, changes: List[Dict[str, Any]]):
+    logging.info(f"Appending {len(changes)} changes to the state journal {journal_file_path}...")
+    with open(journal_file_path, 'a') as file:
+        file.write(''.join(json.dumps(change, separators=(',', ':')) + '\n' for change in changes))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def remove_journal(journal_file_path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(journal_file_path)
 
 
 class StateSaveContext:
-    def __init__(self, task_group: TaskGroup, cooldown_seconds: int):
+    def __init__(self, task_group: TaskGroup, cooldown_seconds: int,
+                 journal_enabled: bool = False, journal_compaction_threshold: int = 1000,
+                 dump_backend: str = 'yaml'):
         self._task_group = task_group
         self._cooldown_seconds = cooldown_seconds
+        self._journal_enabled = journal_enabled
+        self._journal_compaction_threshold = journal_compaction_threshold
+        self._dump_backend = dump_backend
         self._save_running = False
-        self._last_state_json = None
+        self._dirty_state: State | None = None
+        self._state: State | None = None  # the last state to save
+        # set by a failed save, whose drained changes are only recovered by a full snapshot
+        self._snapshot_required = False
 
     def save_soon(self, st: State):
-        self._last_state_json = st.to_json_dict()
+        self._dirty_state = st  # only marks the state dirty, it is serialized once the cooldown is over
+        self._state = st
 
         if not self._save_running:
 
@@ -64,21 +145,27 @@ class StateSaveContext:
                     await anyio.sleep(self._cooldown_seconds)
                     logging.info("Cooldown finished. Proceeding with save...")
 
-                    current_request = self._last_state_json
-                    self._last_state_json = None
-                    await anyio.to_thread.run_sync(save_state_dict, current_request)
+                    save = self._take_pending_save()
+                    if save is not None:
+                        with metrics.timer(STATE_SAVE_DURATION, journal=self._journal_enabled):
+                            await anyio.to_thread.run_sync(save)
+                except Exception as e:
+                    self._save_running = False
+                    logging.error(f"Saving the state failed, retrying with a full snapshot: {e!r}")
+                    self.save_soon(self._state)
                 except get_cancelled_exc_class():
                     self._save_running = False
                     logging.info("Save cancelled (task cancelled)...")
-                    if self._last_state_json is not None:
+                    save = self._take_pending_save()
+                    if save is not None:
                         logging.info("Saving in a blocking way before exit...")
-                        save_state_dict(self._last_state_json)  # blocking save, otherwise it will be cancelled again
+                        save()  # blocking save, otherwise it will be cancelled again
                         logging.info("Save in a blocking way successful.")
                     raise
                 else:
                     self._save_running = False
                     logging.info("Save successful.")
-                    if self._last_state_json is not None:
+                    if self._dirty_state is not None:
                         self._save_running = True
                         logging.info("Save requested. Starting cooldown...")
                         self._task_group.start_soon(cooldown_then_save)
@@ -89,12 +176,50 @@ class StateSaveContext:
         else:
             logging.info("Save requested, but a save event is already scheduled. Skipping.")
 
+    def _take_pending_save(self) -> Callable[[], None] | None:
+        """
+        Capture a consistent snapshot of the dirty state on the event loop, returning the blocking save to run.
+
+        Taking the snapshot is O(1) (copy-on-write), the serialization itself happens in the returned save.
+        """
+        global _journal_record_count
+
+        st = self._dirty_state
+        self._dirty_state = None
+        if st is None or not (st.is_dirty or self._snapshot_required):
+            return None
+
+        changes = st.drain_changes()
+        if not self._journal_enabled:
+            return functools.partial(self._save_or_require_snapshot, save_state_snapshot,
+                                     st.snapshot(), self._dump_backend)
+
+        _journal_record_count += len(changes)
+        snapshot = None
+        if self._snapshot_required or _journal_record_count >= self._journal_compaction_threshold:
+            snapshot = st.snapshot()
+            _journal_record_count = 0
+        return functools.partial(self._save_or_require_snapshot, save_journal_batch,
+                                 changes, snapshot, self._dump_backend)
+
+    def _save_or_require_snapshot(self, save: Callable[..., None], *args):
+        """Run the save, requiring the next one to be a full snapshot if it fails (its changes are drained)."""
+        self._snapshot_required = False
+        try:
+            save(*args)
+        except BaseException:
+            self._snapshot_required = True
+            raise
+
 
 _singleton_state_save_context: StateSaveContext | None = None
 
 
 @contextlib.asynccontextmanager
-async def state_save_context(cooldown_seconds: int = 5) -> StateSaveContext:
+async def state_save_context(cooldown_seconds: int = 5,
+                             journal_enabled: bool = False,
+                             journal_compaction_threshold: int = 1000,
+                             dump_backend: str = 'yaml') -> StateSaveContext:
     global _singleton_state_save_context
 
     if _singleton_state_save_context is not None:
@@ -106,7 +231,9 @@ async def state_save_context(cooldown_seconds: int = 5) -> StateSaveContext:
     else:
         logging.info("Root save context: entering...")
         async with anyio.create_task_group() as tg:
-            _singleton_state_save_context = StateSaveContext(tg, cooldown_seconds)
+            _singleton_state_save_context = StateSaveContext(tg, cooldown_seconds,
+                                                             journal_enabled, journal_compaction_threshold,
+                                                             dump_backend)
             try:
                 yield _singleton_state_save_context
             finally:
@@ -116,7 +243,12 @@ async def state_save_context(cooldown_seconds: int = 5) -> StateSaveContext:
                 _singleton_state_save_context = None
 
 
-# ------- globals -------
-state: State
+def get_state() -> State:
+    if state is None:
+        raise RuntimeError("State is not loaded!")
+    return state
 
-load_state()
+
+# ------- globals -------
+state: State | None = None
+_journal_record_count: int = 0  # records in the journal file since the last snapshot
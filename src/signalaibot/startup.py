@@ -0,0 +1,37 @@
+import contextlib
+import time
+from typing import List, Tuple
+
+from signalaibot.services.metrics import metrics, STARTUP_PHASE_DURATION
+
+
+class StartupTimer:
+    """
+    Durations of the startup phases (imports, config and state loading, handler loading...), reported right before
+    the bot starts receiving messages.
+    """
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._phases: List[Tuple[str, float]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float):
+        self._phases.append((name, seconds))
+        metrics.observe(STARTUP_PHASE_DURATION, seconds, phase=name)
+
+    def report(self) -> str:
+        total = time.perf_counter() - self._started
+        lines = [f"Startup took {total * 1000:.0f} ms:"]
+        lines += [f"  {seconds * 1000:8.1f} ms  {name}" for name, seconds in self._phases]
+        return "\n".join(lines)
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from signalaibot.settings import constants
+
+_RESTART_BACKOFF_SECONDS = (1, 5, 30, 60)
+_STABLE_RUN_SECONDS = 300  # a worker running this long is considered healthy, its restart backoff is reset
+_STOP_TIMEOUT_SECONDS = 30
+
+
+def account_data_dir(base_dir: str, number: str) -> str:
+    return os.path.join(base_dir, 'accounts', number.lstrip('+'))
+
+
+class AccountWorker:
+    def __init__(self, number: str, environment: Dict[str, str], cpu: int | None):
+        self.number = number
+        self.environment = environment
+        self.cpu = cpu
+        self.process: subprocess.Popen | None = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.restart_pending = False
+        self.next_start_at = 0.0
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def status(self) -> dict:
+        return {'pid': self.process.pid if self.process else None,
+                'alive': self.is_alive(),
+                'cpu': self.cpu,
+                'restarts': self.restarts,
+                'started_at': self.started_at}
+
+
+class Supervisor:
+    """
+    Serves several bot accounts from one container: a worker process per account, restarted when it exits.
+
+    Every worker runs the whole bot for its account, with its own persistent data directory (state, history,
+    caches) and image cache subdirectory, while sharing the config (and so the admin) and the signald socket.
+    Workers are pinned to the available CPUs round robin. The status of the workers is written into a file, so the
+    admin can check every account from any of them (!adm accounts), and a worker asked to stop by the admin
+    (!adm stop) stops the supervisor, which stops every account instead of restarting it.
+    """
+
+    def __init__(self, numbers: List[str], base_dir: str):
+        self._status_file_path = os.path.join(base_dir, 'accounts', 'status.json')
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+
+        self._workers: List[AccountWorker] = []
+        for index, number in enumerate(numbers):
+            # the worker is the single account bot, configured by its environment (read by the constants on import)
+            environment = {key: value for key, value in os.environ.items() if key != 'BOT_NUMBERS'}
+            environment |= {'BOT_NUMBER': number,
+                            'ACCOUNT_INDEX': str(index),
+                            'PERSISTENT_DATA_DIR': account_data_dir(base_dir, number),
+                            'ENV_FILE_PATH': constants.ENV_FILE_PATH,
+                            'IMAGE_CACHE_DIR': os.path.join(constants.IMAGE_CACHE_DIR, number.lstrip('+')),
+                            'ACCOUNTS_STATUS_FILE_PATH': self._status_file_path,
+                            'SUPERVISOR_PID': str(os.getpid())}
+            cpu = cpus[index % len(cpus)] if len(cpus) > 1 else None
+            self._workers.append(AccountWorker(number, environment, cpu))
+        self._stopping = False
+
+    def run(self):
+        for worker in self._workers:
+            os.makedirs(worker.environment['PERSISTENT_DATA_DIR'], exist_ok=True)
+        previous_handlers = {signum: signal.signal(signum, self._request_stop)
+                             for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            while not self._stopping:
+                now = time.monotonic()
+                for worker in self._workers:
+                    if worker.process is None or (worker.restart_pending and now >= worker.next_start_at):
+                        self._start(worker)
+                self._write_status()
+
+                time.sleep(1.0)
+                self._schedule_restarts()
+        finally:
+            self._stop_all()
+            self._write_status()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def _request_stop(self, signum, _frame):
+        logging.warning(f"Supervisor received signal {signum}, stopping the accounts...")
+        self._stopping = True
+
+    def _start(self, worker: AccountWorker):
+        if worker.process is not None:
+            worker.restarts += 1
+        worker.restart_pending = False
+        logging.info(f"Starting the worker of account {worker.number} (cpu {worker.cpu})...")
+        worker.process = subprocess.Popen([sys.executable, '-m', 'signalaibot.main'], env=worker.environment)
+        worker.started_at = time.time()
+        if worker.cpu is not None:
+            try:
+                os.sched_setaffinity(worker.process.pid, {worker.cpu})
+            except OSError as e:
+                logging.warning(f"Could not pin the worker of account {worker.number} to cpu {worker.cpu}: {e}")
+
+    def _schedule_restarts(self):
+        for worker in self._workers:
+            process = worker.process
+            if process is None or worker.is_alive() or worker.restart_pending:
+                continue
+            ran_for = time.time() - worker.started_at
+            attempt = 0 if ran_for >= _STABLE_RUN_SECONDS else min(worker.restarts, len(_RESTART_BACKOFF_SECONDS) - 1)
+            backoff = _RESTART_BACKOFF_SECONDS[attempt]
+            logging.error(f"The worker of account {worker.number} exited with code {process.returncode},"
+                          f" restarting it in {backoff} s...")
+            worker.next_start_at = time.monotonic() + backoff
+            worker.restart_pending = True
+
+    def _stop_all(self):
+        alive = [worker for worker in self._workers if worker.is_alive()]
+        for worker in alive:
+            worker.process.terminate()  # SIGTERM, the bot saves its state and exits
+        deadline = time.monotonic() + _STOP_TIMEOUT_SECONDS
+        for worker in alive:
+            try:
+                worker.process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logging.error(f"The worker of account {worker.number} did not stop in time, killing it!")
+                worker.process.kill()
+                worker.process.wait()
+
+    def _write_status(self):
+        status = {worker.number: worker.status() for worker in self._workers}
+        temp_path = self._status_file_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(status, file)
+            os.replace(temp_path, self._status_file_path)
+        except OSError as e:
+            logging.error(f"Could not write the account status file {self._status_file_path}: {e}")
+
+
+def request_supervisor_stop() -> bool:
+    """Ask the supervisor to stop every account, False if the bot runs a single account."""
+    if not constants.SUPERVISOR_PID:
+        return False
+    os.kill(int(constants.SUPERVISOR_PID), signal.SIGTERM)
+    return True
+
+
+def read_accounts_status() -> Dict[str, dict] | None:
+    """The status of the accounts written by the supervisor, None if the bot runs a single account."""
+    if not constants.ACCOUNTS_STATUS_FILE_PATH:
+        return None
+    try:
+        with open(constants.ACCOUNTS_STATUS_FILE_PATH) as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not read the account status file {constants.ACCOUNTS_STATUS_FILE_PATH}: {e}")
+        return {}
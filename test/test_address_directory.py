@@ -0,0 +1,51 @@
+import anyio
+from semaphore import Address
+
+from signalaibot.services.address_directory import address_directory_context
+
+_REGISTERED = {'+10000000001': 'uuid-1', '+10000000002': 'uuid-2', '+10000000003': 'uuid-3'}
+
+
+def test_address_directory(tmp_path):
+    path = str(tmp_path / 'addresses.json')
+    resolved = []
+    in_flight = 0
+    max_in_flight = 0
+
+    async def resolver(number: str) -> Address:
+        nonlocal in_flight, max_in_flight
+        resolved.append(number)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await anyio.sleep(0.01)
+        in_flight -= 1
+        if number == '+18888888888':
+            return None
+        return Address(uuid=_REGISTERED.get(number), number=number)
+
+    settings = dict(max_entries=100, ttl_seconds=60, negative_ttl_seconds=60, max_concurrent_resolutions=2)
+
+    async def main():
+        async with address_directory_context(resolver, path, **settings) as directory:
+            directory.learn('+10000000004', 'uuid-4')
+            uuids = await directory.resolve_many(['+10000000001', '+10000000002', '+10000000003',
+                                                  '+10000000001', '+10000000004', '+19999999999'])
+            assert uuids == {**_REGISTERED, '+10000000004': 'uuid-4', '+19999999999': None}
+            assert sorted(resolved) == ['+10000000001', '+10000000002', '+10000000003', '+19999999999']
+            assert max_in_flight == 2
+            assert directory.cached_number('uuid-2') == '+10000000002'
+
+            assert await directory.resolve('+10000000001') == 'uuid-1'
+            assert len(resolved) == 4
+
+            assert await directory.resolve('+18888888888') is None
+            assert directory.cached_uuid('+18888888888') is None
+
+        resolved.clear()
+        async with address_directory_context(resolver, path, **settings) as directory:  # warm start
+            uuids = await directory.resolve_many(['+10000000001', '+10000000004'])
+            assert uuids == {'+10000000001': 'uuid-1', '+10000000004': 'uuid-4'}
+            assert await directory.resolve('+19999999999') is None  # not persisted, resolved again
+            assert resolved == ['+19999999999']
+
+    anyio.run(main)
@@ -0,0 +1,62 @@
+from signalaibot.handlers.framework.admin_handler import find_request_id, format_pending_requests_page, \
+    LIST_PAGE_SIZE
+from signalaibot.settings import state_manager
+from signalaibot.settings.model import State, Conversation, ConversationType
+
+
+def test_find_request_id(monkeypatch):
+    state = State()
+    conversation = Conversation(type=ConversationType.PRIVATE, id='alice')
+    state.request_conversation(conversation)
+    monkeypatch.setattr(state_manager, 'state', state)
+
+    assert find_request_id(0) == (conversation, state.requested_conversations[conversation])
+    assert find_request_id(1000) == (None, None)  # unknown, unpacked by the req command
+
+
+def _request_private_chats(monkeypatch, count: int) -> State:
+    state = State()
+    for i in range(count):
+        state.request_conversation(Conversation(type=ConversationType.PRIVATE, id=f'sender-{i}'))
+    monkeypatch.setattr(state_manager, 'state', state)
+    return state
+
+
+def _listed_request_ids(page_text: str) -> list:
+    return [int(line.split(':')[0][1:]) for line in page_text.splitlines() if line.startswith('#')]
+
+
+def test_list_pages(monkeypatch):
+    _request_private_chats(monkeypatch, 2 * LIST_PAGE_SIZE + 3)
+
+    first = format_pending_requests_page(1)
+    assert first.startswith(f"Pending requests (page 1/3, {2 * LIST_PAGE_SIZE + 3} in total):")
+    assert _listed_request_ids(first) == list(range(LIST_PAGE_SIZE))
+    assert first.endswith("!adm list 2 for the next page.")
+
+    last = format_pending_requests_page(3)
+    assert _listed_request_ids(last) == list(range(2 * LIST_PAGE_SIZE, 2 * LIST_PAGE_SIZE + 3))
+    assert "next page" not in last
+
+
+def test_list_page_boundaries(monkeypatch):
+    state = _request_private_chats(monkeypatch, 2 * LIST_PAGE_SIZE)
+
+    last = format_pending_requests_page(2)  # exactly full, no empty page after it
+    assert last.startswith("Pending requests (page 2/2,")
+    assert _listed_request_ids(last) == list(range(LIST_PAGE_SIZE, 2 * LIST_PAGE_SIZE))
+    assert "next page" not in last
+
+    state.approve_conversation(Conversation(type=ConversationType.PRIVATE, id='sender-0'))
+    assert _listed_request_ids(format_pending_requests_page(1))[0] == 1  # the pages follow the pending requests
+    assert format_pending_requests_page(2).startswith("Pending requests (page 2/2,")
+
+
+def test_list_empty_and_out_of_range_pages(monkeypatch):
+    _request_private_chats(monkeypatch, 0)
+    assert format_pending_requests_page(1) == "There are no pending requests."
+
+    _request_private_chats(monkeypatch, 3)
+    assert format_pending_requests_page(5) == format_pending_requests_page(1)  # clamped to the last page
+    assert format_pending_requests_page(0) == format_pending_requests_page(1)
+    assert _listed_request_ids(format_pending_requests_page(5)) == [0, 1, 2]
@@ -0,0 +1,44 @@
+from signalaibot.handlers.framework.auth_handler import AuthorizationCache
+from signalaibot.settings.model import State, Conversation, ConversationType, RequestContext, Role
+
+
+def cache_decision(cache: AuthorizationCache, sender: str, conversation: Conversation, role: Role):
+    group_id = conversation.id if conversation.type == ConversationType.GROUP else None
+    cache.put((sender, group_id), RequestContext(sender=sender, conversation=conversation,
+                                                 sender_role_in_conversation=role))
+
+
+def test_authorization_cache_invalidation():
+    st = State()
+    group = Conversation(type=ConversationType.GROUP, id='group-id=')
+    private = Conversation(type=ConversationType.PRIVATE, id='sender-uuid')
+
+    cache = AuthorizationCache()
+    cache.bind(st)
+    st.authorize_conversation(group)
+    st.authorize_conversation(private)
+    cache_decision(cache, 'sender-uuid', group, Role.USER)
+    cache_decision(cache, 'other-uuid', group, Role.USER)
+    cache_decision(cache, 'sender-uuid', private, Role.USER)
+
+    entry = cache.get(('sender-uuid', 'group-id='))
+    assert entry is not None and not entry.rejected
+    assert len(cache) == 3
+
+    st.remove_conversation(group)
+    assert cache.get(('sender-uuid', 'group-id=')) is None
+    assert cache.get(('other-uuid', 'group-id=')) is None
+    assert cache.get(('sender-uuid', None)) is not None
+
+    st.reject_conversation(private)
+    assert len(cache) == 0
+
+    cache_decision(cache, 'sender-uuid', private, Role.REJECTED)
+    assert cache.get(('sender-uuid', None)).rejected
+    st.set_admin_uuid('admin-uuid')
+    assert len(cache) == 0
+
+    # rebinding to a new state (e.g. after a reload) drops the old decisions
+    cache_decision(cache, 'sender-uuid', private, Role.REJECTED)
+    cache.bind(State())
+    assert len(cache) == 0
@@ -0,0 +1,90 @@
+import json
+
+import anyio
+import pytest
+
+from signalaibot.services.completions import CompletionClient, CompletionError, budget_messages, estimate_tokens
+from signalaibot.services.http_client import http_client_context
+
+SSE_EVENTS = [
+    {"choices": [{"delta": {"role": "assistant"}}]},
+    {"choices": [{"delta": {"content": "Hello"}}]},
+    {"choices": [{"delta": {"content": ", world"}}]},
+    {"choices": [{"delta": {}, "finish_reason": "stop"}]},
+]
+
+
+async def serve_completion(stream, requests: list):
+    async with stream:
+        data = b''
+        while b'\r\n\r\n' not in data:
+            data += await stream.receive()
+        head, body = data.split(b'\r\n\r\n', 1)
+        length = int(next(line.split(b':')[1] for line in head.split(b'\r\n')
+                          if line.lower().startswith(b'content-length')))
+        while len(body) < length:
+            body += await stream.receive()
+        requests.append((head.decode(), json.loads(body)))
+
+        events = b''.join(b'data: ' + json.dumps(e).encode() + b'\n\n' for e in SSE_EVENTS) + b'data: [DONE]\n\n'
+        await stream.send(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                          b'Content-Length: %d\r\n\r\n' % len(events))
+        for i in range(0, len(events), 7):  # split events across chunks
+            await stream.send(events[i:i + 7])
+            await anyio.sleep(0.001)
+
+
+def test_streaming_completion_against_local_stub():
+    async def main():
+        requests = []
+        deltas = []
+
+        async def on_delta(delta: str):
+            deltas.append(delta)
+
+        async with await anyio.create_tcp_listener(local_host='127.0.0.1') as listener, \
+                anyio.create_task_group() as tg:
+            port = listener.extra(anyio.abc.SocketAttribute.local_port)
+            tg.start_soon(listener.serve, lambda stream: serve_completion(stream, requests))
+
+            async with http_client_context(retries=0):
+                client = CompletionClient(f'http://127.0.0.1:{port}/v1/', 'test-key', 'test-model')
+                answer = await client.stream([{'role': 'user', 'content': 'hi'}], on_delta)
+            tg.cancel_scope.cancel()
+
+        assert answer == "Hello, world"
+        assert deltas == ["Hello", ", world"]
+        head, request = requests[0]
+        assert head.startswith('POST /v1/chat/completions')
+        assert 'Bearer test-key' in head
+        assert request['model'] == 'test-model' and request['stream'] is True
+
+    anyio.run(main)
+
+
+def test_prompt_budget_keeps_latest_messages():
+    history = [{'role': 'user', 'content': 'x' * 400}, {'role': 'assistant', 'content': 'y' * 40},
+               {'role': 'user', 'content': 'z' * 40}]
+    budget = estimate_tokens('system') + estimate_tokens('y' * 40) + estimate_tokens('z' * 40)
+    messages = budget_messages('system', history, budget)
+    assert [m['content'][0] for m in messages] == ['s', 'y', 'z']
+
+
+def test_completion_connection_failure_is_a_completion_error():
+    async def close_at_once(stream):
+        async with stream:
+            await stream.receive()
+
+    async def main():
+        async with await anyio.create_tcp_listener(local_host='127.0.0.1') as listener, \
+                anyio.create_task_group() as tg:
+            port = listener.extra(anyio.abc.SocketAttribute.local_port)
+            tg.start_soon(listener.serve, close_at_once)
+
+            async with http_client_context(retries=0):
+                client = CompletionClient(f'http://127.0.0.1:{port}/v1/', 'test-key', 'test-model')
+                with pytest.raises(CompletionError):
+                    await client.stream([{'role': 'user', 'content': 'hi'}], on_delta=None)
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import anyio
+
+from signalaibot.services.cpu_offload import cpu_offload_context, cpu_bound
+
+
+@cpu_bound
+def checksum(data: bytes, modulo: int = 65521) -> int:
+    return sum(data) % modulo
+
+
+@cpu_bound
+def spin(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def test_cpu_offload_thread():
+    release = threading.Event()
+    running = 0
+    max_running = 0
+
+    def busy():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        release.wait(5)
+        running -= 1
+
+    async def main():
+        async with cpu_offload_context(max_workers=2) as offloader:
+            assert await checksum(b'abc') == 294
+            assert await checksum(b'abc', modulo=7) == 294 % 7
+
+            loop_ticks = 0
+            with anyio.move_on_after(0.2):
+                async with anyio.create_task_group() as tg:
+                    for _ in range(3):
+                        tg.start_soon(offloader.run, busy)
+                    while True:  # the event loop keeps running meanwhile
+                        await anyio.sleep(0.01)
+                        loop_ticks += 1
+            # the cancelled callers were released, while their threads were still running
+            assert loop_ticks > 5
+            assert max_running == 2
+            release.set()
+
+    anyio.run(main)
+
+
+def test_cpu_offload_process():
+    async def main():
+        async with cpu_offload_context(max_workers=1, mode='process'):
+            assert await checksum(b'abc', modulo=7) == 294 % 7
+
+            start = time.monotonic()
+            with anyio.move_on_after(0.5):
+                await spin(30)  # its worker process is killed when cancelled
+            assert time.monotonic() - start < 5
+
+    anyio.run(main)
@@ -0,0 +1,69 @@
+import anyio
+import anyio.abc
+
+from signalaibot.services.cpu_offload import cpu_offload_context
+from signalaibot.services.feed_cache import feed_cache_context
+from signalaibot.services.http_client import http_client_context
+
+FEED = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>News</title>
+<item><title>First</title><link>https://example.com/1</link></item>
+</channel></rss>"""
+ETAG = b'"v1"'
+
+
+async def serve_feed(stream, requests: list):
+    async with stream:
+        data = b''
+        try:
+            while True:
+                while b'\r\n\r\n' not in data:
+                    data += await stream.receive()
+                head, data = data.split(b'\r\n\r\n', 1)
+                headers = {line.split(b':', 1)[0].strip().lower(): line.split(b':', 1)[1].strip()
+                           for line in head.split(b'\r\n')[1:]}
+                requests.append(headers.get(b'if-none-match'))
+                await anyio.sleep(0.05)  # slow enough for the concurrent gets to overlap
+                if headers.get(b'if-none-match') == ETAG:
+                    await stream.send(b'HTTP/1.1 304 Not Modified\r\nETag: %s\r\nContent-Length: 0\r\n\r\n' % ETAG)
+                else:
+                    await stream.send(b'HTTP/1.1 200 OK\r\nETag: %s\r\nContent-Length: %d\r\n\r\n%s'
+                                      % (ETAG, len(FEED), FEED))
+        except (anyio.EndOfStream, anyio.BrokenResourceError):
+            pass
+
+
+def test_feed_cache_single_flight_and_conditional_get():
+    async def main():
+        requests = []
+        feeds = []
+
+        async with await anyio.create_tcp_listener(local_host='127.0.0.1') as listener, \
+                anyio.create_task_group() as tg:
+            port = listener.extra(anyio.abc.SocketAttribute.local_port)
+            tg.start_soon(listener.serve, lambda stream: serve_feed(stream, requests))
+            url = f'http://127.0.0.1:{port}/rss.xml'
+
+            async with http_client_context(retries=0), cpu_offload_context(), \
+                    feed_cache_context(ttl_seconds=0.2) as cache:
+                async def get_into_feeds():
+                    feeds.append(await cache.get(url))
+
+                async with anyio.create_task_group() as gets:
+                    for _ in range(3):
+                        gets.start_soon(get_into_feeds)
+                assert requests == [None]  # one fetch shared by the concurrent misses
+                assert all(feed is feeds[0] for feed in feeds)
+                assert feeds[0].feed.title == 'News'
+
+                assert await cache.get(url) is feeds[0]  # fresh
+                assert len(requests) == 1
+
+                await anyio.sleep(0.2)
+                assert await cache.get(url) is feeds[0]  # stale, revalidated: not modified
+                assert requests == [None, ETAG]
+                assert await cache.get(url) is feeds[0]  # fresh again
+                assert len(requests) == 2
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
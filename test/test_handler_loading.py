@@ -0,0 +1,75 @@
+import sys
+
+import pytest
+
+from signalaibot.handlers import scan_handler_declarations, DEFAULT_HANDLER_PRIORITY, DEFAULT_ROOT_HANDLER_PRIORITY
+
+_MODULE = '''
+from signalaibot.handlers.framework.handler_base import handler, root_handler
+
+
+@handler(r"^!echo(.*)", max_concurrency=1)
+async def echo(ctx):
+    pass
+
+
+@root_handler("", priority=5)
+async def observe(ctx):
+    pass
+
+
+async def helper():
+    pass
+'''
+
+
+def test_scan_handler_declarations(tmp_path):
+    path = tmp_path / 'echo_handler.py'
+    path.write_text(_MODULE)
+    assert scan_handler_declarations(str(path)) == [('echo', r"^!echo(.*)", DEFAULT_HANDLER_PRIORITY),
+                                                    ('observe', "", 5)]
+
+    path.write_text(_MODULE.replace('@root_handler("", priority=5)', '@root_handler("", priority=PRIORITY)'))
+    assert scan_handler_declarations(str(path)) is None  # not statically evaluable, to be imported
+
+    path.write_text('from signalaibot.handlers.framework.handler_base import root_handler\n\n\n'
+                    '@root_handler(r"^!x")\nasync def x(ctx):\n    pass\n')
+    assert scan_handler_declarations(str(path)) == [('x', r"^!x", DEFAULT_ROOT_HANDLER_PRIORITY)]
+
+
+def test_reload_handlers(tmp_path, monkeypatch):
+    from signalaibot import handlers
+
+    package_dir = tmp_path / 'reload_test_package'
+    package_dir.mkdir()
+    (package_dir / '__init__.py').write_text('')
+    module_path = package_dir / 'echo_handler.py'
+    module_path.write_text(_MODULE)
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    monkeypatch.setattr(handlers, 'handlers', {})
+    monkeypatch.setattr(handlers, 'handler_packages', lambda lazy=False: [('reload_test_package', lazy)])
+
+    handlers.load_handlers(lazy=True)
+    assert [regex for regex, _, _ in handlers.handlers.values()] == [r"^!echo(.*)", ""]
+    assert 'reload_test_package.echo_handler' not in sys.modules  # deferred
+
+    module_path.write_text(_MODULE.replace('^!echo', '^!say'))
+    handlers.reload_handlers([str(module_path)], lazy=False)  # imported, as the module was not imported yet
+    assert [regex for regex, _, _ in handlers.handlers.values()] == [r"^!say(.*)", ""]
+    module = sys.modules['reload_test_package.echo_handler']
+
+    module_path.write_text(_MODULE.replace('^!echo', '^!tell'))
+    handlers.reload_handlers([str(module_path)])
+    assert [regex for regex, _, _ in handlers.handlers.values()] == [r"^!tell(.*)", ""]
+    assert sys.modules['reload_test_package.echo_handler'] is module  # reloaded in place
+
+    previous_handlers = handlers.handlers
+    module_path.write_text('def broken(:\n')
+    with pytest.raises(SyntaxError):
+        handlers.reload_handlers([str(module_path)])
+    assert handlers.handlers is previous_handlers
+
+    sys.modules.pop('reload_test_package.echo_handler')
+    sys.modules.pop('reload_test_package')
@@ -0,0 +1,26 @@
+import re
+
+from signalaibot.extensions.handler_router import HandlerRouter, literal_prefix
+
+
+def test_literal_prefix():
+    assert literal_prefix(re.compile(r"^!adm\s+(\w+)\s*(.*)")) == "!adm"
+    assert literal_prefix(re.compile(r"^!bbc(.*)")) == "!bbc"
+    assert literal_prefix(re.compile(r"^!apods?")) == "!apod"
+    assert literal_prefix(re.compile("")) == ""
+    assert literal_prefix(re.compile(r"^!a|!b")) == ""
+    assert literal_prefix(re.compile(r"(?i)^!ai")) == ""
+    assert literal_prefix(re.compile(r"!ai")) == ""
+
+
+def test_router_matches_like_linear_scan():
+    patterns = ["", r"^!ai", r"^!apod", r"^!adm\s+(\w+)\s*(.*)", r"^!bbc(.*)", r"world", r"^!a"]
+    routes = [(re.compile(p), name) for name, p in enumerate(patterns)]
+    router = HandlerRouter(routes)
+
+    for body in ["", "!ai", "!aiwhat", "!apod", "!adm req 1 y", "!bbc world", "hello world", "!a", "!b"]:
+        expected = [(name, m.group(0)) for regex, name in routes if (m := regex.search(body))]
+        actual = [(name, m.group(0)) for name, m in router.match(body)]
+        assert actual == expected, body
+
+    assert router.unindexed_count == 2
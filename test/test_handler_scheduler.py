@@ -0,0 +1,116 @@
+import anyio
+import pytest
+
+from signalaibot.handlers.framework.scheduler import HandlerScheduler, SchedulingRejected, PrioritySemaphore, \
+    HIGH_PRIORITY, NORMAL_PRIORITY
+
+
+def test_conversation_rate_limit():
+    async def main():
+        scheduler = HandlerScheduler(conversation_rate_per_minute=1, conversation_burst=2)
+        for _ in range(2):
+            async with scheduler.slot('bbc', 'noisy'):
+                pass
+
+        with pytest.raises(SchedulingRejected) as rejected:
+            async with scheduler.slot('bbc', 'noisy'):
+                pass
+        assert rejected.value.reason == 'rate_limited' and rejected.value.reply
+
+        with pytest.raises(SchedulingRejected) as rejected:
+            async with scheduler.slot('bbc', 'noisy'):
+                pass
+        assert rejected.value.reply is None  # told only once
+
+        async with scheduler.slot('bbc', 'quiet'):
+            pass
+
+    anyio.run(main)
+
+
+def test_rate_limit_buckets_are_bounded():
+    async def main():
+        scheduler = HandlerScheduler(conversation_rate_per_minute=600, conversation_burst=1,
+                                     max_rate_limited_conversations=3)
+        for conversation_id in ('spammer', 'b', 'c'):
+            async with scheduler.slot('bbc', conversation_id):
+                pass
+
+        # a wave of new senders cannot push out the buckets still refilling, handing the spammer a fresh burst
+        with pytest.raises(SchedulingRejected) as rejected:
+            async with scheduler.slot('bbc', 'd'):
+                pass
+        assert rejected.value.reply is None
+        assert list(scheduler._buckets) == ['spammer', 'b', 'c']
+
+        await anyio.sleep(0.11)  # refilled: 10 tokens per second
+        for conversation_id in ('d', 'e'):
+            async with scheduler.slot('bbc', conversation_id):
+                pass
+        assert list(scheduler._buckets) == ['c', 'd', 'e']  # the least recently active full ones were evicted
+
+    anyio.run(main)
+
+
+def test_concurrency_limits_queue_and_shed():
+    async def main():
+        scheduler = HandlerScheduler(max_concurrent_per_conversation=1, conversation_rate_per_minute=0,
+                                     queue_timeout_seconds=0.2)
+        running = anyio.Event()
+        release = anyio.Event()
+
+        async def hold():
+            async with scheduler.slot('apod', 'noisy'):
+                running.set()
+                await release.wait()
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(hold)
+            await running.wait()
+
+            with pytest.raises(SchedulingRejected) as rejected:
+                async with scheduler.slot('apod', 'noisy'):
+                    pass
+            assert rejected.value.reason == 'queue_timeout'
+
+            async with scheduler.slot('apod', 'other'):
+                assert scheduler.running == 2
+            release.set()
+
+        assert scheduler.running == 0 and scheduler.queued == 0
+
+    anyio.run(main)
+
+
+def test_priority_semaphore_reserves_and_prioritizes():
+    async def main():
+        semaphore = PrioritySemaphore(capacity=2, reserved=1)
+        order = []
+
+        async def acquire(name: str, priority: int):
+            await semaphore.acquire(priority)
+            order.append(name)
+
+        await semaphore.acquire(NORMAL_PRIORITY)
+        async with anyio.create_task_group() as tg:
+            # the last slot is reserved, so normal work queues even though one slot is free
+            tg.start_soon(acquire, 'user-1', NORMAL_PRIORITY)
+            tg.start_soon(acquire, 'user-2', NORMAL_PRIORITY)
+            await anyio.wait_all_tasks_blocked()
+            assert order == [] and semaphore.waiting == 2
+
+            await acquire('admin-1', HIGH_PRIORITY)
+            tg.start_soon(acquire, 'admin-2', HIGH_PRIORITY)
+            await anyio.wait_all_tasks_blocked()
+            assert order == ['admin-1']
+
+            semaphore.release()
+            semaphore.release()
+            await anyio.wait_all_tasks_blocked()
+            assert order == ['admin-1', 'admin-2']
+
+            semaphore.release()
+            semaphore.release()
+        assert order == ['admin-1', 'admin-2', 'user-1', 'user-2']
+
+    anyio.run(main)
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import time
+
+import anyio
+
+from signalaibot.services.history import history_context, HistoryEntry
+
+
+def test_history_ring_buffer_and_persistence():
+    db_path = os.path.join(tempfile.mkdtemp(), "history.sqlite3")
+    now = int(time.time() * 1000)
+
+    async def record():
+        async with history_context(db_path, ring_size=3, batch_size=2, flush_interval_seconds=60) as history:
+            for i in range(5):
+                history.record(HistoryEntry('group', now + i, 'sender', f"message {i}"))
+            history.record(HistoryEntry('other', now, 'sender', "other message"))
+            history.record(HistoryEntry('old', now - 100 * 24 * 3600 * 1000, 'sender', "ancient"))
+
+            assert [e.body for e in await history.recent('group')] == ["message 2", "message 3", "message 4"]
+            assert [e.body for e in await history.recent('group', limit=1)] == ["message 4"]
+
+            in_range = await history.query('group', since=now + 1, until=now + 3)
+            assert [e.body for e in in_range] == ["message 1", "message 2"]
+
+            await history.apply_retention()
+            assert await history.query('old') == []
+
+    async def reload():
+        async with history_context(db_path, ring_size=3) as history:
+            assert [e.body for e in await history.recent('group')] == ["message 2", "message 3", "message 4"]
+            history.record(HistoryEntry('other', now + 1, 'bot', "answer", from_bot=True))
+            entries = await history.recent('other')
+            assert [(e.body, e.from_bot) for e in entries] == [("other message", False), ("answer", True)]
+
+    anyio.run(record)
+    anyio.run(reload)
+
+
+def test_history_flushes_full_batches_after_other_flushes():
+    db_path = os.path.join(tempfile.mkdtemp(), "history.sqlite3")
+    now = int(time.time() * 1000)
+
+    async def main():
+        async with history_context(db_path, batch_size=2, flush_interval_seconds=60) as history:
+            await anyio.sleep(0.01)  # the background flusher is waiting
+            history.record(HistoryEntry('group', now, 'sender', "message 0"))
+            await history.recent('other')  # flushed while warming up
+
+            for i in range(1, 3):  # a full batch, written without waiting for the flush interval
+                history.record(HistoryEntry('group', now + i, 'sender', f"message {i}"))
+            with anyio.fail_after(1):
+                while history._pending:
+                    await anyio.sleep(0.01)
+
+    anyio.run(main)
@@ -0,0 +1,100 @@
+import time
+
+import anyio
+import anyio.abc
+import asks
+
+from signalaibot.services.http_client import http_client_context
+
+
+async def serve_statuses(stream, statuses: list, requests: list, closed: list):
+    """
+    Answer each request on the connection with the next status (and a streamed body), until the client closes.
+    Status 0 drops the connection without an answer.
+    """
+    async with stream:
+        data = b''
+        try:
+            while statuses:
+                while b'\r\n\r\n' not in data:
+                    data += await stream.receive()
+                head, data = data.split(b'\r\n\r\n', 1)
+                requests.append(head.split(b' ', 1)[0].decode())
+                status = statuses.pop(0)
+                if status == 0:
+                    return
+                await stream.send(b'HTTP/1.1 %d Status\r\nContent-Length: 2\r\n\r\nok' % status)
+            await stream.receive()
+        except (anyio.EndOfStream, anyio.BrokenResourceError):
+            closed.append(len(requests))
+
+
+async def run_with_server(statuses: list, requests: list, closed: list, client_main):
+    async with await anyio.create_tcp_listener(local_host='127.0.0.1') as listener, anyio.create_task_group() as tg:
+        port = listener.extra(anyio.abc.SocketAttribute.local_port)
+        tg.start_soon(listener.serve, lambda stream: serve_statuses(stream, statuses, requests, closed))
+        async with http_client_context(retries=2, retry_backoff_seconds=0.01) as client:
+            await client_main(client, f'http://127.0.0.1:{port}/')
+        tg.cancel_scope.cancel()
+
+
+def test_streamed_response_closed_before_retry():
+    requests, closed = [], []
+
+    async def client_main(client, url):
+        response = await client.get(url, stream=True)
+        assert response.status_code == 200
+        async with response.body:
+            assert b''.join([chunk async for chunk in response.body]) == b'ok'
+        with anyio.fail_after(1):
+            while not closed:  # the 503 one was closed by the client, not left open in the pool
+                await anyio.sleep(0.01)
+
+    anyio.run(run_with_server, [503, 200], requests, closed, client_main)
+    assert requests == ['GET', 'GET'] and closed[0] == 1
+
+
+def test_post_not_retried_unless_asked():
+    requests, closed = [], []
+
+    async def client_main(client, url):
+        assert (await client.post(url, data='x')).status_code == 503
+        assert (await client.post(url, data='x', retries=1)).status_code == 200
+
+    anyio.run(run_with_server, [503, 503, 200], requests, closed, client_main)
+    assert requests == ['POST', 'POST', 'POST']
+
+
+def test_session_does_not_retry_on_its_own(monkeypatch):
+    requests, closed = [], []
+    session_retries = []
+    session_request = asks.Session.request
+
+    async def request(self, method, url=None, **kwargs):
+        session_retries.append(kwargs.get('retries'))
+        return await session_request(self, method, url, **kwargs)
+
+    monkeypatch.setattr(asks.Session, 'request', request)
+
+    async def client_main(client, url):
+        assert (await client.post(url, data='x')).status_code == 200
+        assert (await client.get(url)).status_code == 200
+
+    anyio.run(run_with_server, [200, 200], requests, closed, client_main)
+    # asks would otherwise send the requests, even the POST ones, again on connection errors
+    assert session_retries == [0, 0]
+
+
+def test_get_retried_with_backoff():
+    requests, closed = [], []
+    elapsed = []
+
+    async def client_main(client, url):
+        start = time.monotonic()
+        assert (await client.get(url)).status_code == 200  # after a dropped connection and a 503
+        elapsed.append(time.monotonic() - start)
+        assert (await client.get(url)).status_code == 502  # retries exhausted: the last response is returned
+
+    anyio.run(run_with_server, [0, 503, 200, 502, 502, 502], requests, closed, client_main)
+    assert requests == ['GET'] * 6
+    assert elapsed[0] >= 0.01 + 0.02  # exponential backoff, at least 0.01s then 0.02s
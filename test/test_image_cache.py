@@ -0,0 +1,102 @@
+import os
+
+import anyio
+import anyio.abc
+import pytest
+from asks.errors import BadStatus
+
+from signalaibot.services.http_client import http_client_context
+from signalaibot.services.image_cache import image_cache_context
+
+IMAGE = b'i' * 100
+
+
+async def serve_images(stream, requests: list, closed: list):
+    """
+    Serve IMAGE at every path, except /broken.png whose connection is dropped halfway through the body, and
+    /missing.png which is not found. The connections closed by the client are recorded.
+    """
+    async with stream:
+        data = b''
+        try:
+            while True:
+                while b'\r\n\r\n' not in data:
+                    data += await stream.receive()
+                head, data = data.split(b'\r\n\r\n', 1)
+                path = head.split(b' ')[1].decode()
+                requests.append(path)
+                if path == '/missing.png':
+                    await stream.send(b'HTTP/1.1 404 Not Found\r\nContent-Length: 2\r\n\r\nno')
+                    continue
+                await stream.send(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(IMAGE))
+                if path == '/broken.png':
+                    await stream.send(IMAGE[:50])
+                    return
+                await stream.send(IMAGE)
+        except (anyio.EndOfStream, anyio.BrokenResourceError):
+            closed.append(len(requests))
+
+
+async def run_with_server(requests: list, client_main, closed: list | None = None):
+    async with await anyio.create_tcp_listener(local_host='127.0.0.1') as listener, anyio.create_task_group() as tg:
+        port = listener.extra(anyio.abc.SocketAttribute.local_port)
+        tg.start_soon(listener.serve, lambda stream: serve_images(stream, requests, [] if closed is None else closed))
+        async with http_client_context(retries=0):
+            await client_main(f'http://127.0.0.1:{port}')
+        tg.cancel_scope.cancel()
+
+
+def test_image_cache_lru_eviction(tmp_path):
+    requests = []
+
+    async def client_main(base_url):
+        async with image_cache_context(str(tmp_path), max_bytes=250) as cache:
+            path_a = await cache.get_or_fetch(f'{base_url}/a.png')
+            await cache.get_or_fetch(f'{base_url}/b.png')
+            assert await cache.get_or_fetch(f'{base_url}/a.png') == path_a  # hit, now the most recent
+            await cache.get_or_fetch(f'{base_url}/c.png')
+
+            assert cache.get(f'{base_url}/b.png') is None  # least recently used, evicted
+            assert cache.get(f'{base_url}/a.png') == path_a
+            assert path_a.read_bytes() == IMAGE
+            assert len(os.listdir(tmp_path)) == 2
+
+        async with image_cache_context(str(tmp_path), max_bytes=250) as cache:  # the files are indexed again
+            assert cache.get(f'{base_url}/c.png') is not None
+            assert cache.get(f'{base_url}/a.png') == path_a
+
+    anyio.run(run_with_server, requests, client_main)
+    assert requests == ['/a.png', '/b.png', '/c.png']
+
+
+def test_image_cache_atomic_writes(tmp_path):
+    requests = []
+    (tmp_path / 'leftover.png.part').write_bytes(b'partial')  # of a crashed download
+
+    async def client_main(base_url):
+        async with image_cache_context(str(tmp_path), max_bytes=1000) as cache:
+            assert os.listdir(tmp_path) == []
+
+            with pytest.raises(anyio.EndOfStream):  # raised by asks as is
+                await cache.get_or_fetch(f'{base_url}/broken.png')
+            assert cache.get(f'{base_url}/broken.png') is None
+            assert os.listdir(tmp_path) == []  # neither the image nor its partial download
+
+    anyio.run(run_with_server, requests, client_main)
+    assert requests == ['/broken.png']
+
+
+def test_image_cache_closes_failed_downloads(tmp_path):
+    requests, closed = [], []
+
+    async def client_main(base_url):
+        async with image_cache_context(str(tmp_path), max_bytes=1000) as cache:
+            with pytest.raises(BadStatus):
+                await cache.get_or_fetch(f'{base_url}/missing.png')
+            with anyio.fail_after(1):
+                while not closed:  # the connection was closed, not leaked
+                    await anyio.sleep(0.01)
+            assert os.listdir(tmp_path) == []
+
+    anyio.run(run_with_server, requests, client_main, closed)
+    assert requests == ['/missing.png'] and closed == [1]
@@ -0,0 +1,71 @@
+import struct
+
+import pytest
+from PIL import Image
+
+from signalaibot.services.image_preparation import ImageInfo, read_image_info, prepare_attachment
+
+# smallest valid PNG (1x1, transparent)
+_PNG = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                     '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+
+
+def _jpeg(width: int, height: int) -> bytes:
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + bytes(9)
+    exif = b'\xff\xe1' + struct.pack('>H', 1002) + b'\xff\xc0' * 500  # metadata looking like a frame header
+    sof0 = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return b'\xff\xd8' + app0 + exif + b'\xff\xff' + sof0 + b'\xff\xda'
+
+
+def _webp(chunk: bytes, payload: bytes) -> bytes:
+    return b'RIFF' + struct.pack('<I', 4 + 8 + len(payload)) + b'WEBP' + chunk + struct.pack('<I', len(payload)) \
+        + payload
+
+
+@pytest.mark.parametrize('content, info', [
+    (_PNG, ImageInfo('png', 1, 1)),
+    (b'GIF89a' + struct.pack('<HH', 320, 200) + bytes(20), ImageInfo('gif', 320, 200)),
+    (_jpeg(4000, 3000), ImageInfo('jpeg', 4000, 3000)),
+    (_webp(b'VP8 ', b'\x00\x00\x00\x9d\x01\x2a' + struct.pack('<HH', 640, 480) + bytes(4)),
+     ImageInfo('webp', 640, 480)),
+    (_webp(b'VP8L', b'\x2f' + ((640 - 1) | (480 - 1) << 14).to_bytes(4, 'little') + bytes(8)),
+     ImageInfo('webp', 640, 480)),
+    (_webp(b'VP8X', bytes(4) + (20000 - 1).to_bytes(3, 'little') + (10000 - 1).to_bytes(3, 'little')),
+     ImageInfo('webp', 20000, 10000)),
+    (b'not an image', None),
+    (b'\x89PNG\r\n\x1a\n', None),
+])
+def test_read_image_info(tmp_path, content, info):
+    path = tmp_path / 'image'
+    path.write_bytes(content)
+    assert read_image_info(str(path)) == info
+
+
+def test_prepare_attachment(tmp_path):
+    source = tmp_path / 'source.png'
+    source.write_bytes(_PNG)
+    target = str(tmp_path / 'prepared.jpg')
+    assert prepare_attachment(str(source), target, 1024, 100) == (str(source), ImageInfo('png', 1, 1))
+
+    Image.effect_noise((2000, 1500), 64).convert('RGB').save(source)  # large and poorly compressible
+    path, info = prepare_attachment(str(source), target, 200 * 1024, 1_000_000)
+    assert path == target
+    assert info.format == 'jpeg' and info.width * info.height <= 1_000_000
+    assert info.width / info.height == pytest.approx(4 / 3, abs=0.01)
+    assert (tmp_path / 'prepared.jpg').stat().st_size <= 200 * 1024
+    assert read_image_info(path) == info
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith('.part')] == []
+
+
+def test_exif_orientation(tmp_path):
+    source = tmp_path / 'photo.jpg'
+    exif = Image.Exif()
+    exif[0x0112] = 6  # stored landscape, displayed rotated by 90 degrees: portrait
+    Image.effect_noise((400, 300), 64).convert('RGB').save(source, exif=exif)
+    assert read_image_info(str(source)) == ImageInfo('jpeg', 300, 400)
+
+    path, info = prepare_attachment(str(source), str(tmp_path / 'prepared.jpg'), 1024 * 1024, 30_000)
+    assert info.width < info.height  # turned upright, not rotated back to landscape
+    with Image.open(path) as prepared:
+        assert prepared.size == (info.width, info.height)
+        assert prepared.getexif().get(0x0112) is None
@@ -0,0 +1,161 @@
+import json
+import os
+import tempfile
+
+import anyio
+import pytest
+from anyio.streams.buffered import BufferedByteReceiveStream
+from semaphore import Socket
+
+from signalaibot.extensions import semaphore_extensions
+from signalaibot.extensions.semaphore_extensions import ExtendedMessageSender, PooledMessageSender
+
+
+async def serve_reversed(listener, request_count: int):
+    """Fake signald answering a batch of requests in reverse order."""
+    async with await listener.accept() as client:
+        stream = BufferedByteReceiveStream(client)
+        requests = [json.loads(await stream.receive_until(b"\n", 65536)) for _ in range(request_count)]
+        for request in reversed(requests):
+            response = {"id": request["id"], "data": {"number": request["partial"]["number"]}}
+            await client.send(json.dumps(response).encode() + b"\n")
+        await anyio.sleep(10)
+
+
+def test_out_of_order_responses_are_delivered():
+    async def run_concurrent():
+        socket_path = os.path.join(tempfile.mkdtemp(), "signald.sock")
+        results = {}
+        async with await anyio.create_unix_listener(socket_path) as listener:
+            async with anyio.create_task_group() as server_tg:
+                server_tg.start_soon(serve_reversed, listener, 3)
+
+                socket = await Socket("+10", socket_path).__aenter__()
+                async with ExtendedMessageSender("+10", socket, raise_errors=True,
+                                                 request_timeout_seconds=5) as sender:
+                    async def resolve(number):
+                        results[number] = await sender._generic_send(
+                            {"type": "resolve_address", "partial": {"number": number}},
+                            lambda d: d["number"])
+
+                    async with anyio.create_task_group() as tg:
+                        for n in ("+1", "+2", "+3"):
+                            tg.start_soon(resolve, n)
+                server_tg.cancel_scope.cancel()
+        return results
+
+    assert anyio.run(run_concurrent) == {"+1": "+1", "+2": "+2", "+3": "+3"}
+
+
+def test_request_timeout():
+    async def run():
+        socket_path = os.path.join(tempfile.mkdtemp(), "signald.sock")
+        async with await anyio.create_unix_listener(socket_path) as listener:
+            async with anyio.create_task_group() as server_tg:
+                server_tg.start_soon(serve_reversed, listener, 2)
+
+                socket = await Socket("+10", socket_path).__aenter__()
+                async with ExtendedMessageSender("+10", socket, raise_errors=True) as sender:
+                    with pytest.raises(TimeoutError):
+                        await sender._generic_send({"type": "resolve_address", "partial": {"number": "+1"}},
+                                                   None, timeout=0.1)
+                    assert sender.in_flight == 0
+                server_tg.cancel_scope.cancel()
+
+    anyio.run(run)
+
+
+async def serve_oversized_line(listener):
+    """Fake signald answering with a line longer than the sender accepts."""
+    async with await listener.accept() as client:
+        await BufferedByteReceiveStream(client).receive_until(b"\n", 65536)
+        await client.send(b"x" * 4096)  # no delimiter within the limit
+        await anyio.sleep(10)
+
+
+def test_oversized_response_line_disconnects(monkeypatch):
+    monkeypatch.setattr(semaphore_extensions, "MAX_RESPONSE_LINE_BYTES", 1024)
+
+    async def run():
+        socket_path = os.path.join(tempfile.mkdtemp(), "signald.sock")
+        async with await anyio.create_unix_listener(socket_path) as listener:
+            async with anyio.create_task_group() as server_tg:
+                server_tg.start_soon(serve_oversized_line, listener)
+
+                socket = await Socket("+10", socket_path).__aenter__()
+                async with ExtendedMessageSender("+10", socket, raise_errors=True,
+                                                 request_timeout_seconds=5) as sender:
+                    with pytest.raises(ConnectionResetError):  # failed like a disconnection, not crashing the bot
+                        await sender._generic_send({"type": "resolve_address", "partial": {"number": "+1"}}, None)
+                    assert not sender.is_connected and sender.in_flight == 0
+                server_tg.cancel_scope.cancel()
+
+    anyio.run(run)
+
+
+def test_pool_replaces_broken_connections():
+    async def run():
+        socket_path = os.path.join(tempfile.mkdtemp(), "signald.sock")
+        clients = []
+
+        async def echo(client):
+            clients.append(client)
+            stream = BufferedByteReceiveStream(client)
+            try:
+                while True:
+                    request = json.loads(await stream.receive_until(b"\n", 65536))
+                    if "id" in request:
+                        await client.send(json.dumps({"id": request["id"], "data": {"ok": True}}).encode() + b"\n")
+            except (anyio.EndOfStream, anyio.IncompleteRead, anyio.BrokenResourceError, anyio.ClosedResourceError):
+                pass
+
+        async with await anyio.create_unix_listener(socket_path) as listener:
+            async with anyio.create_task_group() as server_tg:
+                server_tg.start_soon(listener.serve, echo)
+
+                async with PooledMessageSender("+10", socket_path, raise_errors=True, pool_size=2,
+                                               request_timeout_seconds=5, health_check_interval_seconds=0) as pool:
+                    assert all(c is not None for c in pool.connections)
+                    assert await pool._generic_send({"type": "version"}, None) == {"ok": True}
+
+                    await clients[0].aclose()
+                    with anyio.fail_after(5):
+                        while len(clients) < 3 or not all(c is not None and c.is_connected
+                                                          for c in pool.connections):
+                            await anyio.sleep(0.05)
+                    for _ in range(4):
+                        assert await pool._generic_send({"type": "version"}, None) == {"ok": True}
+                server_tg.cancel_scope.cancel()
+
+    anyio.run(run)
+
+
+def test_pool_replaces_connections_failing_health_checks():
+    async def run():
+        socket_path = os.path.join(tempfile.mkdtemp(), "signald.sock")
+        clients = []
+
+        async def answer_errors(client):
+            clients.append(client)
+            stream = BufferedByteReceiveStream(client)
+            try:
+                while True:
+                    request = json.loads(await stream.receive_until(b"\n", 65536))
+                    if "id" in request:
+                        response = {"id": request["id"], "error_type": "SomethingWrong", "error": {"message": "no"}}
+                        await client.send(json.dumps(response).encode() + b"\n")
+            except (anyio.EndOfStream, anyio.IncompleteRead, anyio.BrokenResourceError, anyio.ClosedResourceError):
+                pass
+
+        async with await anyio.create_unix_listener(socket_path) as listener:
+            async with anyio.create_task_group() as server_tg:
+                server_tg.start_soon(listener.serve, answer_errors)
+
+                async with PooledMessageSender("+10", socket_path, raise_errors=True, pool_size=1,
+                                               request_timeout_seconds=5, health_check_interval_seconds=0.05):
+                    with anyio.fail_after(5):
+                        while len(clients) < 2:  # the failing connection was replaced, the pool kept running
+                            await anyio.sleep(0.05)
+                server_tg.cancel_scope.cancel()
+
+    anyio.run(run)
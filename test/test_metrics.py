@@ -0,0 +1,51 @@
+import anyio
+import pytest
+
+from signalaibot.services.metrics import Metrics, metrics, metrics_server_context, HANDLER_DURATION
+
+
+def test_metrics_rendering():
+    m = Metrics(buckets=(0.1, 1.0))
+    m.inc('requests_total', handler='ai')
+    m.inc('requests_total', handler='ai')
+    m.observe('latency_seconds', 0.05, handler='ai')
+    m.observe('latency_seconds', 0.5, handler='ai')
+    m.observe('latency_seconds', 5.0, handler='ai')
+    with pytest.raises(ValueError):
+        with m.timer('latency_seconds', handler='bbc'):
+            raise ValueError()
+
+    text = m.render_prometheus()
+    assert 'requests_total{handler="ai"} 2' in text
+    assert 'latency_seconds_bucket{handler="ai",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{handler="ai",le="1"} 2' in text
+    assert 'latency_seconds_bucket{handler="ai",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{handler="ai"} 3' in text
+    assert 'latency_seconds_count{handler="bbc",outcome="ValueError"} 1' in text
+
+    summary = m.summary()
+    assert 'handler=ai: 3x' in summary
+    assert 'max 5.000s' in summary
+
+
+def test_metrics_endpoint():
+    async def main():
+        metrics.observe(HANDLER_DURATION, 0.2, handler='test_handler', outcome='ok')
+        listener = await anyio.create_tcp_listener(local_host='127.0.0.1', local_port=0)
+        port = listener.extra(anyio.abc.SocketAttribute.local_port)
+        await listener.aclose()
+
+        async with metrics_server_context(port=port):
+            async with await anyio.connect_tcp('127.0.0.1', port) as stream:
+                await stream.send(b'GET /metrics HTTP/1.0\r\n\r\n')
+                response = b''
+                try:
+                    while True:
+                        response += await stream.receive()
+                except anyio.EndOfStream:
+                    pass
+
+        assert response.startswith(b'HTTP/1.0 200 OK')
+        assert b'handler="test_handler"' in response
+
+    anyio.run(main)
@@ -0,0 +1,45 @@
+import os
+
+import anyio
+
+from signalaibot.services.name_cache import name_cache_context, get_name_caches
+
+
+def test_name_cache_negative_ttl():
+    async def main():
+        async with name_cache_context(None, max_entries=10, ttl_seconds=60, negative_ttl_seconds=0.05) as caches:
+            calls = []
+
+            async def fetch(name):
+                calls.append(name)
+                return name
+
+            assert await caches.sender_names.get_or_load('uuid-1', fetch, None) is None
+            assert await caches.sender_names.get_or_load('uuid-1', fetch, 'Alice') is None  # negative hit
+            await anyio.sleep(0.06)
+            assert await caches.sender_names.get_or_load('uuid-1', fetch, 'Alice') == 'Alice'
+            assert await caches.sender_names.get_or_load('uuid-1', fetch, 'Bob') == 'Alice'
+            assert calls == [None, 'Alice']
+
+    anyio.run(main)
+
+
+def test_name_cache_persistence(tmp_path):
+    path = str(tmp_path / 'names.json')
+
+    async def main():
+        async with name_cache_context(path, max_entries=10, ttl_seconds=60, negative_ttl_seconds=60) as caches:
+            caches.sender_names.put('uuid-1', 'Alice')
+            caches.sender_names.put('uuid-2', None)  # failed lookups are not persisted
+            caches.group_titles.put('group-1', 'Hiking')
+            caches.group_titles.put('group-2', 'Expired', ttl_seconds=0)
+        assert os.path.exists(path)
+
+        async with name_cache_context(path, max_entries=10, ttl_seconds=60, negative_ttl_seconds=60):
+            caches = get_name_caches()
+            assert caches.sender_names.get('uuid-1') == 'Alice'
+            assert len(caches.sender_names) == 1
+            assert caches.group_titles.get('group-1') == 'Hiking'
+            assert len(caches.group_titles) == 1
+
+    anyio.run(main)
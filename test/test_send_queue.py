@@ -0,0 +1,152 @@
+import time
+
+import anyio
+import pytest
+from semaphore.exceptions import RateLimitError, InternalError, InvalidRecipientError
+
+from signalaibot.extensions.send_queue import MessageNotSentError, SendQueue
+
+
+def _send(recipient: str, body: str) -> dict:
+    return {"type": "send", "recipientAddress": {"uuid": recipient}, "messageBody": body}
+
+
+def _typing(recipient: str, typing: bool) -> dict:
+    return {"type": "typing", "address": {"uuid": recipient}, "typing": typing}
+
+
+def _mark_read(recipient: str, timestamp: int) -> dict:
+    return {"type": "mark_read", "to": {"uuid": recipient}, "timestamps": [timestamp]}
+
+
+def test_send_queue_orders_and_coalesces():
+    sent = []
+
+    async def send(message: dict):
+        await anyio.sleep(0.01)
+        sent.append(message)
+        return True
+
+    async def main():
+        queue = SendQueue()
+        async with anyio.create_task_group() as tg:
+            await tg.start(queue.run, send)
+            async with anyio.create_task_group() as senders:
+                senders.start_soon(queue.send, _send('a', 'first'))
+                await anyio.sleep(0)  # the first message is sending from now on
+                await queue.send(_mark_read('a', 1))
+                await queue.send(_typing('a', True))
+                await queue.send(_typing('a', False))  # cancels the queued start
+                await queue.send(_mark_read('a', 2))  # merged into the queued one
+                senders.start_soon(queue.send, _send('a', 'second'))
+                senders.start_soon(queue.send, _send('b', 'other'))
+            assert queue.queued == 0
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
+    a_messages = [(m["type"], m.get("messageBody") or m.get("timestamps")) for m in sent
+                  if (m.get("recipientAddress") or m.get("to") or m.get("address"))["uuid"] == 'a']
+    assert a_messages == [("send", "first"), ("mark_read", [1, 2]), ("send", "second")]
+    assert len(sent) == 4
+
+
+def test_send_queue_pauses_on_rate_limits():
+    attempts = []
+    failures = [RateLimitError()]
+
+    async def send(message: dict):
+        attempts.append((message["type"], message.get("messageBody"), time.monotonic()))
+        if message.get("messageBody") == "a" and failures:
+            raise failures.pop(0)
+        return True
+
+    def sent_at(*bodies: str):
+        return [at for message_type, body, at in attempts if message_type == "send" and body in bodies]
+
+    async def main():
+        queue = SendQueue(retries=2, retry_backoff_seconds=0.01, rate_limit_pause_seconds=0.2,
+                          rate_limited_interval_seconds=0.05, rate_limited_window_seconds=10)
+        async with anyio.create_task_group() as tg:
+            await tg.start(queue.run, send)
+            started = time.monotonic()
+            async with anyio.create_task_group() as senders:
+                senders.start_soon(queue.send, _send('a', 'a'))  # sent again after the pause
+                await anyio.sleep(0.01)
+                # Signal rate limits the whole account: every conversation is paused
+                assert queue.is_paused('a') and queue.is_paused('b')
+                assert await queue.send(_typing('b', True)) is True  # dropped, not sent after the pause
+                senders.start_soon(queue.send, _send('b', 'b'))
+            assert min(sent_at('a')[-1:] + sent_at('b')) - started >= 0.1  # at least half of the rate limit pause
+
+            # all the sends are then spaced out for a while, whatever their conversation
+            async with anyio.create_task_group() as senders:
+                for recipient, body in (('a', 'a1'), ('a', 'a2'), ('c', 'c'), ('d', 'd')):
+                    senders.start_soon(queue.send, _send(recipient, body))
+            times = sorted(sent_at('a')[-1:] + sent_at('b', 'a1', 'a2', 'c', 'd'))
+            assert len(times) == 6
+            assert all(later - earlier >= 0.04 for earlier, later in zip(times, times[1:]))
+            assert queue.queued == 0
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
+    assert [body for _, body, _ in attempts].count('a') == 2
+    assert [message_type for message_type, _, _ in attempts].count('typing') == 0
+
+
+def test_send_queue_retries_unsent_replies_and_transient_errors():
+    attempts = []
+    failures = {'unsent': [MessageNotSentError(), MessageNotSentError()],
+                'lost': [ConnectionResetError("Connection was reset")],
+                'internal': [InternalError()],
+                'refused': [InvalidRecipientError()],
+                'typing': [ConnectionResetError("Connection was reset")]}
+
+    async def send(message: dict):
+        name = message.get("messageBody") or message["type"]
+        attempts.append(name)
+        if failures.get(name):
+            raise failures[name].pop(0)
+        return True
+
+    async def main():
+        queue = SendQueue(retries=3, retry_backoff_seconds=0.01)
+        async with anyio.create_task_group() as tg:
+            await tg.start(queue.run, send)
+            assert await queue.send(_send('a', 'unsent')) is True  # never written, sent again
+            with pytest.raises(ConnectionResetError):  # written before the connection was lost, maybe delivered
+                await queue.send(_send('b', 'lost'))
+            assert await queue.send(_send('c', 'internal')) is True  # transient signald error, sent again
+            with pytest.raises(InvalidRecipientError):  # answered with a permanent signald error
+                await queue.send(_send('c', 'refused'))
+            await queue.send(_typing('d', True))  # idempotent, sent again
+            await anyio.sleep(0.1)
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
+    assert attempts == ['unsent'] * 3 + ['lost'] + ['internal'] * 2 + ['refused'] + ['typing'] * 2
+
+
+def test_send_queue_orders_group_receipts_with_the_group_messages():
+    sent = []
+
+    async def send(message: dict):
+        await anyio.sleep(0.01)
+        sent.append((message["type"], message.get("messageBody") or message.get("timestamps")))
+        return True
+
+    async def main():
+        queue = SendQueue()
+        async with anyio.create_task_group() as tg:
+            await tg.start(queue.run, send)
+            async with anyio.create_task_group() as senders:
+                senders.start_soon(queue.send, {"type": "send", "recipientGroupId": 'g', "messageBody": "first"})
+                await anyio.sleep(0)
+                await queue.send(_mark_read('a', 1), key='g')
+                await queue.send(_mark_read('b', 2), key='g')  # another sender, not merged
+                await queue.send(_mark_read('a', 3), key='g')
+                senders.start_soon(queue.send, {"type": "send", "recipientGroupId": 'g', "messageBody": "second"})
+            assert queue.queued == 0
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
+    assert sent == [("send", "first"), ("mark_read", [1, 3]), ("mark_read", [2]), ("send", "second")]
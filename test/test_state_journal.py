@@ -0,0 +1,121 @@
+import anyio
+
+from signalaibot.settings import constants
+from signalaibot.settings import state_manager
+from signalaibot.settings.model import State, Conversation, ConversationType
+
+
+def mutate(st: State):
+    group = Conversation(type=ConversationType.GROUP, id='group-id=')
+    private = Conversation(type=ConversationType.PRIVATE, id='sender-uuid')
+    spam = Conversation(type=ConversationType.PRIVATE, id='spammer-uuid')
+
+    st.set_bot_uuid('bot-uuid')
+    st.request_conversation(group)
+    st.request_conversation(private)
+    st.request_conversation(spam)
+    st.approve_conversation(group)
+    st.reject_conversation(spam)
+    st.remove_conversation(group)
+    st.authorize_conversation(group)
+
+
+def test_journal_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, 'STATE_FILE_PATH', str(tmp_path / 'state.yaml'))
+    monkeypatch.setattr(constants, 'STATE_JOURNAL_FILE_PATH', str(tmp_path / 'state.journal'))
+
+    original = State()
+    mutate(original)
+    state_manager.save_journal_batch(original.drain_changes(), None, 'yaml')
+
+    state_manager.load_state()
+    assert state_manager.state == original
+    assert state_manager.state.request_id_next_value == 3
+
+
+def test_journal_compaction_is_idempotent(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, 'STATE_FILE_PATH', str(tmp_path / 'state.yaml'))
+    monkeypatch.setattr(constants, 'STATE_JOURNAL_FILE_PATH', str(tmp_path / 'state.journal'))
+
+    original = State()
+    mutate(original)
+    changes = original.drain_changes()
+
+    # simulate a crash after the snapshot was written, but before the journal was removed
+    state_manager.append_to_journal(constants.STATE_JOURNAL_FILE_PATH, changes)
+    state_manager.save_to_yaml(constants.STATE_FILE_PATH, original.to_json_dict())
+
+    state_manager.load_state()
+    assert state_manager.state == original
+
+    state_manager.save_journal_batch([], original.snapshot(), 'json')
+    assert not (tmp_path / 'state.journal').exists()
+
+    state_manager.load_state()
+    assert state_manager.state.to_json_dict() == original.to_json_dict()
+
+
+def test_failed_journal_append_is_recovered_by_a_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, 'STATE_FILE_PATH', str(tmp_path / 'state.yaml'))
+    monkeypatch.setattr(constants, 'STATE_JOURNAL_FILE_PATH', str(tmp_path / 'state.journal'))
+    failures = [OSError(28, "No space left on device")]
+    append_to_journal = state_manager.append_to_journal
+
+    def failing_append_to_journal(journal_file_path, changes):
+        if failures:
+            raise failures.pop(0)
+        append_to_journal(journal_file_path, changes)
+
+    monkeypatch.setattr(state_manager, 'append_to_journal', failing_append_to_journal)
+    original = State()
+
+    async def main():
+        async with state_manager.state_save_context(cooldown_seconds=0, journal_enabled=True) as save_context:
+            mutate(original)
+            save_context.save_soon(original)
+            with anyio.fail_after(2):
+                while not (tmp_path / 'state.yaml').exists():  # the drained changes are saved by a full snapshot
+                    await anyio.sleep(0.01)
+
+    anyio.run(main)
+    assert not failures
+    state_manager.load_state()
+    assert state_manager.state.to_json_dict() == original.to_json_dict()
+
+
+def test_snapshot_is_copy_on_write():
+    original = State()
+    mutate(original)
+    snapshot = original.snapshot()
+    snapshot_json = snapshot.to_json_dict()
+
+    original.approve_conversation(Conversation(type=ConversationType.PRIVATE, id='sender-uuid'))
+    original.remove_conversation(Conversation(type=ConversationType.GROUP, id='group-id='))
+
+    assert snapshot.to_json_dict() == snapshot_json
+    assert original.to_json_dict() != snapshot_json
+
+
+def test_pending_request_index():
+    st = State()
+    conversations = [Conversation(type=ConversationType.PRIVATE, id=f'sender-{i}') for i in range(25)]
+    for conversation in conversations:
+        st.request_conversation(conversation)
+    st.annotate_request(conversations[0], 'Alice', None)
+    st.approve_conversation(conversations[1])
+    st.reject_conversation(conversations[2])
+
+    assert st.find_request(0) == (conversations[0], st.requested_conversations[conversations[0]])
+    assert st.find_request(0)[1].sender_name == 'Alice'
+    assert st.find_request(1) is None
+    assert [meta.request_id for _, meta in st.pending_requests(0, 3)] == [0, 3, 4]
+    assert len(st.pending_requests(20, 10)) == 3
+
+    metas = [item['meta'] for item in st.to_json_dict()['requested_conversations']]
+    assert metas[0] == {'request_id': 0, 'sender_name': 'Alice'}
+    assert metas[1] == {'request_id': 3}  # no null display names written into the state file
+
+    replayed = State()
+    for change in st.drain_changes():
+        replayed.apply_change(change)
+    assert replayed.to_json_dict() == st.to_json_dict()
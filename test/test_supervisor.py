@@ -0,0 +1,33 @@
+import os
+import signal
+
+from signalaibot import supervisor
+from signalaibot.supervisor import Supervisor, account_data_dir
+
+
+def test_supervisor_worker_environments(tmp_path, monkeypatch):
+    monkeypatch.setenv('BOT_NUMBERS', '+10000000001,+10000000002')
+    base_dir = str(tmp_path)
+
+    supervisor = Supervisor(['+10000000001', '+10000000002'], base_dir)
+    environments = [worker.environment for worker in supervisor._workers]
+
+    assert [environment['BOT_NUMBER'] for environment in environments] == ['+10000000001', '+10000000002']
+    assert [environment['ACCOUNT_INDEX'] for environment in environments] == ['0', '1']
+    assert environments[0]['PERSISTENT_DATA_DIR'] == os.path.join(base_dir, 'accounts', '10000000001')
+    assert environments[1]['PERSISTENT_DATA_DIR'] == account_data_dir(base_dir, '+10000000002')
+    assert environments[0]['IMAGE_CACHE_DIR'] != environments[1]['IMAGE_CACHE_DIR']  # scanned and evicted per worker
+    assert environments[0]['SUPERVISOR_PID'] == str(os.getpid())
+    assert all('BOT_NUMBERS' not in environment for environment in environments)  # no nested supervisors
+
+
+def test_stop_requests_go_to_the_supervisor(monkeypatch):
+    kills = []
+    monkeypatch.setattr(supervisor.os, 'kill', lambda pid, signum: kills.append((pid, signum)))
+
+    monkeypatch.setattr(supervisor.constants, 'SUPERVISOR_PID', None)
+    assert not supervisor.request_supervisor_stop()  # single account
+
+    monkeypatch.setattr(supervisor.constants, 'SUPERVISOR_PID', '1234')
+    assert supervisor.request_supervisor_stop()
+    assert kills == [(1234, signal.SIGTERM)]
@@ -0,0 +1,50 @@
+import anyio
+
+from signalaibot.services.completions import normalize_prompt, response_cache_key
+from signalaibot.services.ttl_cache import TtlCache
+
+
+def test_ttl_cache_bounds():
+    cache = TtlCache('test', max_entries=3, ttl_seconds=60, max_bytes=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    assert cache.get('a') == 'xxxx'  # 'b' becomes the least recently used
+    cache.put('c', 'xxxx')  # over 10 bytes
+    assert cache.get('b') is None and cache.get('a') == 'xxxx' and cache.total_bytes == 8
+
+    cache.put('d', 'x' * 11)  # larger than the cache, not cached
+    assert cache.get('d') is None and len(cache) == 2
+
+    cache.put('e', 'x', ttl_seconds=0)
+    assert cache.get('e') is None
+
+
+def test_ttl_cache_single_flight():
+    async def main():
+        cache = TtlCache('test', max_entries=10, ttl_seconds=60)
+        calls = []
+
+        async def load(value: str):
+            calls.append(value)
+            await anyio.sleep(0.05)
+            return value.upper()
+
+        results = []
+
+        async def lookup():
+            results.append(await cache.get_or_load('key', load, 'answer'))
+
+        async with anyio.create_task_group() as tg:
+            for _ in range(5):
+                tg.start_soon(lookup)
+        assert results == ['ANSWER'] * 5 and calls == ['answer']
+        assert await cache.get_or_load('key', load, 'other') == 'ANSWER'
+
+    anyio.run(main)
+
+
+def test_prompt_normalization():
+    assert normalize_prompt("  What is  the\nMeaning of life?? ") == "what is the meaning of life"
+    key = response_cache_key('model', 'system', [], "What is the meaning of life?")
+    assert key == response_cache_key('model', 'system', [], "what is the meaning of LIFE")
+    assert key != response_cache_key('other-model', 'system', [], "what is the meaning of life")